@@ -6,5 +6,7 @@ DEC_FILES = (
     "/home/belle2/murphyco/PycharmProjects/belle2/b2jpsi_eta/src/evt_gen/dec_files"
 )
 PROJECT_ROOT = "/home/belle2/murphyco/PycharmProjects/belle2/b2jpsi_eta/src/"
+RECONSTRUCTED_FILES = "/home/belle2/murphyco/PycharmProjects/belle2/b2jpsi_eta/src/my_reconstruction/root_files/"
 MERGED_FILES = "/home/belle2/murphyco/PycharmProjects/belle2/b2jpsi_eta/src/merged/root_files/"
 PLOTS_DIR = "/home/belle2/murphyco/PycharmProjects/belle2/b2jpsi_eta/src/plots/plots/"
+CACHE_DIR = "/home/belle2/murphyco/PycharmProjects/belle2/b2jpsi_eta/src/merged/cache/"
@@ -1,20 +1,26 @@
 """efficiencies/detection.py
 Simple script to tabulate selection efficiencies
+Usage:
+    $ python efficiencies/detection.py                  # whole table at once
+    $ python efficiencies/detection.py row <decay>      # one row, tables/detection_efficiency/<decay>.tex
+    $ python efficiencies/detection.py rows             # whole table from the row files
 """
 
 import attr
 
 from constants.mode_info import mode2latex
-from misc.utils import get_merged_df
+from efficiencies.service import EFFICIENCIES
 
 
 @attr.s
 class DetectionEfficiencyRow:
     decay: str = attr.ib()
+    # Version of the mode's efficiency inputs (EFFICIENCIES.versions), resolved on every access if not given
+    version: str = attr.ib(default=None)
 
-    def __attrs_post_init__(self):
-        self.tree = get_merged_df(self.decay, columns=["isSignal"])
-        self.N_GEN = 10000  # TODO: Update this when cuts are optimised and you're running on more than 10*1000 events.
+    @property
+    def N_GEN(self):
+        return EFFICIENCIES.n_gen(self.decay, self.version)
 
     @staticmethod
     def latex(x, fmt=None):
@@ -27,16 +33,17 @@ class DetectionEfficiencyRow:
 
     @property
     def nsig(self):
-        return sum(self.tree["isSignal"])
+        # Counted once per process (see efficiencies/service.py), however many rows and tables ask
+        return EFFICIENCIES.nsig(self.decay, self.version)
 
     @property
     def eff(self):
-        return self.nsig / self.N_GEN
+        return EFFICIENCIES.eff(self.decay, self.version)
 
     @property
     def predicted_yield(self):
         from misc import predicted_yields
-        return predicted_yields.predicted_info(self.decay)["tot"]
+        return predicted_yields.predicted_info(self.decay, version=self.version)["tot"]
 
     @property
     def row(self):
@@ -51,10 +58,22 @@ class DetectionEfficiencyRow:
 @attr.s
 class DetectionEfficiencyTable:
     path: str = attr.ib()
+    # Directory of per-mode row files written by write_row. If given, rows are read from there, so only modes
+    # whose efficiency shards changed need recomputing.
+    rows_dir: str = attr.ib(default=None)
 
     def get_rows(self):
+        if self.rows_dir is not None:
+            rows = []
+            for decay in mode2latex:
+                with open(get_row_file(self.rows_dir, decay)) as f:
+                    rows.append(f.read())
+            return rows
+
+        versions = EFFICIENCIES.versions(mode2latex)
+        EFFICIENCIES.prefetch(mode2latex, versions=versions)
         rows = [
-            DetectionEfficiencyRow(decay).row
+            DetectionEfficiencyRow(decay, version=versions[decay]).row
             for decay in mode2latex
         ]
         return rows
@@ -81,13 +100,34 @@ class DetectionEfficiencyTable:
             f.write(self._table())
 
 
+def get_row_file(rows_dir, decay):
+    import os
+    return os.path.join(rows_dir, f"{decay}.tex")
+
+
+def write_row(rows_dir, decay):
+    import os
+    os.makedirs(rows_dir, exist_ok=True)
+    with open(get_row_file(rows_dir, decay), 'w') as f:
+        f.write(DetectionEfficiencyRow(decay, version=EFFICIENCIES.versions([decay])[decay]).row)
+
+
 if __name__ == '__main__':
     import pprint
     import os
+    import sys
     from constants.locations import PROJECT_ROOT
 
-    print("Making detection efficiency table for modes:")
-    pprint.pprint(list(mode2latex.keys()))
+    path = os.path.join(PROJECT_ROOT, "tables", "detection_efficiency.tex")
+    rows_dir = os.path.join(PROJECT_ROOT, "tables", "detection_efficiency")
+    args = sys.argv[1:]
+
+    if args[:1] == ["row"]:
+        print(f"Making detection efficiency row for {args[1]}")
+        write_row(rows_dir, args[1])
+    else:
+        print("Making detection efficiency table for modes:")
+        pprint.pprint(list(mode2latex.keys()))
 
-    table = DetectionEfficiencyTable(os.path.join(PROJECT_ROOT, "tables", "detection_efficiency.tex"))
-    table.table()
+        table = DetectionEfficiencyTable(path, rows_dir=rows_dir if args[:1] == ["rows"] else None)
+        table.table()
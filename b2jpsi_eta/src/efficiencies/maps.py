@@ -0,0 +1,238 @@
+"""efficiencies/maps.py
+Detection efficiency in bins of true momentum and polar angle of the B0, J/psi and eta, rather than one number per
+mode (efficiencies/detection.py).
+- Denominator: generated particles of the signal decay, from the "<tree>_gen" trees my_reconstruction/template.py
+  writes. The other B of the event, and any J/psi or eta it decays to, is left out.
+- Numerator: events with a truth-matched candidate of the signal decay, binned in the true kinematics of that
+  candidate.
+Both are filled chunk by chunk with np.bincount on flat bin indices, so a map never needs more than one chunk in
+memory, and maps of separate files (e.g. the per-job reconstruction outputs) add up with +.
+Usage:
+    $ python efficiencies/maps.py [<decay>,...]  # writes tables/efficiency_maps/<decay>_<tree>.npz
+"""
+import functools
+from typing import Dict, Iterable, Optional, Tuple
+
+import attr
+import numpy as np
+import pandas as pd
+
+from constants.mode_info import mode2latex
+
+# Trees of the particles maps are made for
+MAP_TREES = ["b0", "jpsi", "eta"]
+
+# Default binning: lab-frame momentum in GeV, and cos(theta)
+P_EDGES = np.linspace(0, 4, 21)
+COS_THETA_EDGES = np.linspace(-1, 1, 21)
+
+_KINEMATICS = ["mcPX", "mcPY", "mcPZ"]
+
+# Flag of the particles belonging to the signal decay: the B0 decaying to J/psi eta, and that B0's J/psi and eta.
+# Stored by my_reconstruction/template.py on the generated and reconstructed trees as passesCut(SIGNAL_SIDE_CUT).
+SIGNAL_SIDE_COLUMN = "fromSignalB"
+# EvtGen keeps the order of the signal decay, B0 -> J/psi eta
+_SIGNAL_B = ("abs(mcPDG) == 511 and nMCDaughters == 2 "
+             "and abs(mcDaughter(0, PDG)) == 443 and abs(mcDaughter(1, PDG)) == 221")
+_MOTHER_IS_SIGNAL_B = ("abs(mcMother(PDG)) == 511 and mcMother(nMCDaughters) == 2 "
+                       "and abs(mcMother(mcDaughter(0, PDG))) == 443 and abs(mcMother(mcDaughter(1, PDG))) == 221")
+SIGNAL_SIDE_CUT = f"[{_SIGNAL_B}] or [{_MOTHER_IS_SIGNAL_B}]"
+
+
+def true_kinematics(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    True momentum and cos(polar angle) of each row
+    :return: Tuple of numpy arrays (p, cos_theta)
+    """
+    px, py, pz = (df[c].to_numpy(dtype=float) for c in _KINEMATICS)
+    p = np.sqrt(px ** 2 + py ** 2 + pz ** 2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cos_theta = pz / p
+    return p, cos_theta
+
+
+@attr.s
+class EfficiencyMap:
+    p_edges: np.ndarray = attr.ib(factory=lambda: P_EDGES.copy())
+    cos_theta_edges: np.ndarray = attr.ib(factory=lambda: COS_THETA_EDGES.copy())
+    numerator: np.ndarray = attr.ib(default=None)
+    denominator: np.ndarray = attr.ib(default=None)
+
+    def __attrs_post_init__(self):
+        if self.numerator is None:
+            self.numerator = np.zeros(self.shape, dtype=np.int64)
+        if self.denominator is None:
+            self.denominator = np.zeros(self.shape, dtype=np.int64)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return len(self.p_edges) - 1, len(self.cos_theta_edges) - 1
+
+    def _counts(self, p: np.ndarray, cos_theta: np.ndarray) -> np.ndarray:
+        """ 2D histogram of (p, cos_theta), via one bincount. Entries outside the edges are dropped. """
+        i = np.searchsorted(self.p_edges, p, side="right") - 1
+        j = np.searchsorted(self.cos_theta_edges, cos_theta, side="right") - 1
+        # The upper edge belongs to the last bin, as in np.histogram
+        i[p == self.p_edges[-1]] = self.shape[0] - 1
+        j[cos_theta == self.cos_theta_edges[-1]] = self.shape[1] - 1
+        inside = (i >= 0) & (i < self.shape[0]) & (j >= 0) & (j < self.shape[1])
+        flat = np.ravel_multi_index((i[inside], j[inside]), self.shape)
+        return np.bincount(flat, minlength=self.shape[0] * self.shape[1]).reshape(self.shape)
+
+    def fill_generated(self, p: np.ndarray, cos_theta: np.ndarray) -> None:
+        self.denominator += self._counts(p, cos_theta)
+
+    def fill_detected(self, p: np.ndarray, cos_theta: np.ndarray) -> None:
+        self.numerator += self._counts(p, cos_theta)
+
+    def __add__(self, other: "EfficiencyMap") -> "EfficiencyMap":
+        if not (np.array_equal(self.p_edges, other.p_edges)
+                and np.array_equal(self.cos_theta_edges, other.cos_theta_edges)):
+            raise ValueError("Can only add efficiency maps with the same binning")
+        return EfficiencyMap(self.p_edges, self.cos_theta_edges, self.numerator + other.numerator,
+                             self.denominator + other.denominator)
+
+    @property
+    def efficiency(self) -> np.ndarray:
+        """ Efficiency per bin, NaN where nothing was generated """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.denominator > 0, self.numerator / self.denominator, np.nan)
+
+    @property
+    def error(self) -> np.ndarray:
+        """ Binomial uncertainty of the efficiency per bin """
+        eff = self.efficiency
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.sqrt(eff * (1 - eff) / self.denominator)
+
+    def save(self, path: str) -> None:
+        np.savez(path, p_edges=self.p_edges, cos_theta_edges=self.cos_theta_edges, numerator=self.numerator,
+                 denominator=self.denominator)
+
+    @classmethod
+    def load(cls, path: str) -> "EfficiencyMap":
+        with np.load(path) as f:
+            return cls(f["p_edges"], f["cos_theta_edges"], f["numerator"], f["denominator"])
+
+
+def first_signal(chunk: pd.DataFrame, previous_key: Optional[int]) -> Tuple[pd.DataFrame, Optional[int]]:
+    """
+    First truth-matched candidate of each event. Candidates of one event are consecutive in the ntuples, so it
+    is enough to compare with the previous signal candidate, carried over from the previous chunk.
+    :return: Tuple (signal candidates, event key of the last signal candidate)
+    """
+    from misc.event_index import EVENT_COLUMNS, event_keys
+
+    signal = chunk[chunk["isSignal"].to_numpy() == 1]
+    if signal.empty:
+        return signal, previous_key
+    keys = event_keys(*(signal[c].to_numpy() for c in EVENT_COLUMNS))
+    first = np.empty(len(keys), dtype=bool)
+    first[0] = previous_key is None or keys[0] != previous_key
+    first[1:] = keys[1:] != keys[:-1]
+    return signal[first], int(keys[-1])
+
+
+def fill_map(generated: Iterable[pd.DataFrame], reconstructed: Iterable[pd.DataFrame],
+             efficiency_map: Optional[EfficiencyMap] = None) -> EfficiencyMap:
+    """
+    Fill a map from chunks of generated particles and of reconstructed candidates
+    :param generated: Chunks with the columns mcPX, mcPY, mcPZ and SIGNAL_SIDE_COLUMN
+    :param reconstructed: Chunks with the event columns, isSignal, SIGNAL_SIDE_COLUMN, mcPX, mcPY, mcPZ
+    :param efficiency_map: Map to add to, defaults to a new one with the default binning
+    :return: EfficiencyMap
+    """
+    efficiency_map = EfficiencyMap() if efficiency_map is None else efficiency_map
+    for chunk in generated:
+        efficiency_map.fill_generated(*true_kinematics(chunk[chunk[SIGNAL_SIDE_COLUMN].to_numpy() == 1]))
+    previous_key = None
+    for chunk in reconstructed:
+        signal, previous_key = first_signal(chunk[chunk[SIGNAL_SIDE_COLUMN].to_numpy() == 1], previous_key)
+        efficiency_map.fill_detected(*true_kinematics(signal))
+    return efficiency_map
+
+
+def _reco_columns():
+    from misc.event_index import EVENT_COLUMNS
+    return EVENT_COLUMNS + ["isSignal", SIGNAL_SIDE_COLUMN] + _KINEMATICS
+
+
+_GENERATED_COLUMNS = _KINEMATICS + [SIGNAL_SIDE_COLUMN]
+
+
+def file_map(path: str, tree: str, chunksize: int = 100000) -> EfficiencyMap:
+    """
+    Efficiency map of one reconstruction output
+    :param path: .root file written by my_reconstruction/template.py
+    :param tree: Tree of the particle, e.g. "jpsi"
+    :param chunksize: Number of entries read at a time
+    :return: EfficiencyMap
+    """
+    import root_pandas
+
+    generated = root_pandas.read_root(path, key=f"{tree}_gen", columns=_GENERATED_COLUMNS, chunksize=chunksize)
+    reconstructed = root_pandas.read_root(path, key=tree, columns=_reco_columns(), chunksize=chunksize)
+    return fill_map(generated, reconstructed)
+
+
+def merged_map(decay: str, tree: str, chunksize: int = 100000) -> EfficiencyMap:
+    """
+    Efficiency map of a mode, streamed from the (cached) merged file
+    :param decay: The decay mode in question
+    :param tree: Tree of the particle, e.g. "jpsi"
+    :param chunksize: Number of entries read at a time
+    :return: EfficiencyMap
+    """
+    from misc.utils import iter_merged_df
+
+    generated = iter_merged_df(decay, key=f"{tree}_gen", columns=_GENERATED_COLUMNS, chunksize=chunksize)
+    reconstructed = iter_merged_df(decay, key=tree, columns=_reco_columns(), chunksize=chunksize)
+    return fill_map(generated, reconstructed)
+
+
+def reconstructed_map(decay: str, tree: str, max_workers: Optional[int] = None) -> EfficiencyMap:
+    """
+    Efficiency map of a mode, made from the per-job reconstruction outputs in parallel and summed
+    :param decay: The decay mode in question
+    :param tree: Tree of the particle, e.g. "jpsi"
+    :param max_workers: Number of files read at once, defaults to the number of cores
+    :return: EfficiencyMap
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from misc.utils import get_reconstructed_files
+
+    paths = get_reconstructed_files(decay=decay)
+    if not paths:
+        raise FileNotFoundError(f"No reconstructed files found for {decay}")
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return sum(pool.map(functools.partial(file_map, tree=tree), paths), EfficiencyMap())
+
+
+def all_maps(decays: Optional[Iterable[str]] = None, trees: Iterable[str] = MAP_TREES,
+             max_workers: Optional[int] = None) -> Dict[Tuple[str, str], EfficiencyMap]:
+    """
+    Efficiency maps of every (mode, particle), each streamed once from its merged file, several at a time
+    :param decays: Modes, defaults to all modes of the analysis
+    :param trees: Particles to make maps for
+    :param max_workers: Number of maps filled at once
+    :return: dict of (decay, tree) to EfficiencyMap
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    keys = [(decay, tree) for decay in (mode2latex if decays is None else decays) for tree in trees]
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        maps = pool.map(merged_map, *zip(*keys))
+        return dict(zip(keys, maps))
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    from constants.locations import PROJECT_ROOT
+
+    directory = os.path.join(PROJECT_ROOT, "tables", "efficiency_maps")
+    os.makedirs(directory, exist_ok=True)
+    for (decay, tree), efficiency_map in all_maps(sys.argv[1:] or None).items():
+        path = os.path.join(directory, f"{decay}_{tree}.npz")
+        print(f"Writing {path}")
+        efficiency_map.save(path)
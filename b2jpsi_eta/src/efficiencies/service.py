@@ -0,0 +1,130 @@
+"""efficiencies/service.py
+Signal counts and detection efficiencies of every mode, computed once per version of their inputs and
+shared by efficiencies/detection.py and misc/predicted_yields.py.
+Modes whose reconstruction jobs wrote efficiency shards (see efficiencies/shards.py) are summed from those,
+without reading the merged .root file; otherwise the signal is counted in the merged file.
+Only signal is counted, and background retention (my_reconstruction/retention.py) keeps every signal candidate
+with a retentionWeight of 1, so prescaled files need no weighting here, nor in misc/yield_scan.py built on these.
+Usage:
+    from efficiencies.service import EFFICIENCIES
+    EFFICIENCIES.prefetch()  # all modes, read concurrently
+    EFFICIENCIES.eff("jpsi2ee_eta2gammagamma")
+Finding the version of a mode's inputs globs and stats its shards, so code asking for many numbers (a table)
+resolves the versions once and passes them on:
+    versions = EFFICIENCIES.versions()
+    EFFICIENCIES.prefetch(versions=versions)
+    EFFICIENCIES.eff("jpsi2ee_eta2gammagamma", version=versions["jpsi2ee_eta2gammagamma"])
+"""
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+import attr
+import numpy as np
+
+from constants.mode_info import mode2latex
+
+# Generated events per mode, for merged files made before the shards existed
+N_GEN = 10000
+
+
+def count_signal(decay: str) -> int:
+    """
+    Number of truth-matched candidates in the merged file of a mode, in one vectorised pass over isSignal
+    (memory-mapped from misc/column_store.py, so nothing but the one column is read)
+    :param decay: The decay mode in question
+    :return: int
+    """
+    from misc.utils import get_merged_df
+
+    is_signal = get_merged_df(decay, columns=["isSignal"], memoize=False)["isSignal"].to_numpy()
+    return int(np.count_nonzero(is_signal == 1))
+
+
+def count_mode(decay: str) -> Tuple[int, int]:
+    """
+    Generated events and signal candidates of a mode, from its shards if there are any (refused when only some
+    of the reconstruction jobs have one, see reduce_shards)
+    :param decay: The decay mode in question
+    :return: Tuple (n_gen, nsig)
+    """
+    from efficiencies.shards import reduce_shards
+
+    totals = reduce_shards(decay)
+    if totals["n_jobs"]:
+        return totals["n_gen"], totals["nsig"]
+    return N_GEN, count_signal(decay)
+
+
+def _source_version(decay: str) -> str:
+    from efficiencies.shards import shards_version
+    from misc.columnar import fingerprint
+    from misc.utils import get_merged_file
+    return shards_version(decay) or fingerprint(get_merged_file(decay=decay))
+
+
+@attr.s
+class EfficiencyService:
+    # (decay, version of its shards or merged file) -> (generated events, signal candidates)
+    counts: Dict[Tuple[str, str], Tuple[int, int]] = attr.ib(factory=dict)
+
+    def __attrs_post_init__(self):
+        self._lock = threading.Lock()
+
+    def versions(self, decays: Optional[Iterable[str]] = None) -> Dict[str, str]:
+        """
+        Current version of the shards or merged file of each mode
+        :param decays: Modes, defaults to all modes of the analysis
+        :return: dict of decay to version, to pass on to the other methods
+        """
+        return {decay: _source_version(decay) for decay in (mode2latex if decays is None else decays)}
+
+    def prefetch(self, decays: Optional[Iterable[str]] = None, max_workers: Optional[int] = None,
+                 versions: Optional[Dict[str, str]] = None) -> None:
+        """
+        Count the signal of every mode not counted yet, several modes at a time. The work is reading one column
+        and a numpy reduction, both of which release the GIL, so threads are enough.
+        :param decays: Modes to count, defaults to all modes of the analysis
+        :param max_workers: Number of modes read at once
+        :param versions: Versions of the modes, from versions(), resolved here if not given
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        decays = list(mode2latex if decays is None else decays)
+        versions = self.versions(decays) if versions is None else versions
+        keys = [(decay, versions[decay]) for decay in decays]
+        missing = [key for key in keys if key not in self.counts]
+        if not missing:
+            return
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(count_mode, [decay for decay, _ in missing]))
+        with self._lock:
+            self.counts.update(zip(missing, results))
+
+    def _counts(self, decay: str, version: Optional[str] = None) -> Tuple[int, int]:
+        key = (decay, _source_version(decay) if version is None else version)
+        if key not in self.counts:
+            counts = count_mode(decay)
+            with self._lock:
+                self.counts[key] = counts
+        return self.counts[key]
+
+    def nsig(self, decay: str, version: Optional[str] = None) -> int:
+        """ Number of signal candidates of a mode, at the given version of its inputs (default: the current one) """
+        return self._counts(decay, version)[1]
+
+    def n_gen(self, decay: str, version: Optional[str] = None) -> int:
+        """ Number of generated events of a mode, at the given version of its inputs (default: the current one) """
+        return self._counts(decay, version)[0]
+
+    def eff(self, decay: str, version: Optional[str] = None) -> float:
+        """ Detection efficiency of a mode, at the given version of its inputs (default: the current one) """
+        counts = self._counts(decay, version)
+        return counts[1] / counts[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self.counts.clear()
+
+
+# Shared by every table and plot made in one process
+EFFICIENCIES = EfficiencyService()
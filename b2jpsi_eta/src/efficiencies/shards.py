@@ -0,0 +1,105 @@
+"""efficiencies/shards.py
+Per-job efficiency "shards": each reconstruction job (my_reconstruction/template.py) writes a small JSON file next
+to its output with the number of events it processed and the number of truth-matched B0 candidates it kept.
+Summing the shards of a mode gives its detection efficiency without opening any merged .root file.
+Usage:
+    $ python efficiencies/shards.py <reconstructed file> <generated events>  # (re)write the shard of one job
+"""
+import glob
+import json
+import os
+import re
+from typing import Dict, List
+
+SHARD_SUFFIX = ".eff.json"
+
+
+def get_shard_file(reconstructed_file: str) -> str:
+    """
+    Location of the shard of one reconstruction job
+    :param reconstructed_file: Output .root file of the job
+    :return: A string representing the location of the shard
+    """
+    root, _ = os.path.splitext(reconstructed_file)
+    return root + SHARD_SUFFIX
+
+
+def write_shard(reconstructed_file: str, n_gen: int, nsig: int) -> str:
+    """
+    Write the shard of one reconstruction job
+    :param reconstructed_file: Output .root file of the job
+    :param n_gen: Number of events the job processed
+    :param nsig: Number of truth-matched B0 candidates in its output
+    :return: Location of the shard
+    """
+    path = get_shard_file(reconstructed_file)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(dict(n_gen=int(n_gen), nsig=int(nsig)), f)
+    os.replace(tmp_path, path)
+    return path
+
+
+def count_signal(reconstructed_file: str, key: str = "b0") -> int:
+    """ Number of truth-matched candidates in the output of one job, which is small enough to read at once """
+    import root_pandas
+
+    df = root_pandas.read_root(reconstructed_file, key=key, columns=["isSignal"])
+    return int((df["isSignal"].to_numpy() == 1).sum())
+
+
+def shard_files(decay: str) -> List[str]:
+    """
+    Shards of every reconstruction job of a mode, ordered by job number
+    :param decay: The decay mode in question
+    :return: List of shard locations
+    """
+    from constants.locations import RECONSTRUCTED_FILES
+
+    pattern = re.compile(re.escape(decay) + r"_(\d+)" + re.escape(SHARD_SUFFIX) + "$")
+    jobs = []
+    for path in glob.glob(os.path.join(RECONSTRUCTED_FILES, f"{decay}_*{SHARD_SUFFIX}")):
+        match = pattern.search(os.path.basename(path))
+        if match is not None:
+            jobs.append((int(match.group(1)), path))
+    return [path for _, path in sorted(jobs)]
+
+
+def reduce_shards(decay: str) -> Dict[str, int]:
+    """
+    Sum the shards of a mode. Either every reconstruction job output has its shard, or none does: the sum of a
+    partial set would under-count both generated events and signal.
+    :param decay: The decay mode in question
+    :return: dict with keys n_gen, nsig and n_jobs (zero for all of them if there are no shards)
+    """
+    from misc.utils import get_reconstructed_files
+
+    paths = shard_files(decay)
+    missing = [f for f in get_reconstructed_files(decay) if not os.path.exists(get_shard_file(f))] if paths else []
+    if missing:
+        raise ValueError(f"{len(missing)} reconstruction job(s) of {decay} have no efficiency shard, e.g. "
+                         f"{os.path.basename(missing[0])}: write them with efficiencies/shards.py, or remove the "
+                         f"{len(paths)} existing shards to count the merged file instead")
+
+    totals = dict(n_gen=0, nsig=0, n_jobs=0)
+    for path in paths:
+        with open(path) as f:
+            shard = json.load(f)
+        totals["n_gen"] += shard["n_gen"]
+        totals["nsig"] += shard["nsig"]
+        totals["n_jobs"] += 1
+    return totals
+
+
+def shards_version(decay: str) -> str:
+    """ Identifier of the current set of shards of a mode, changing whenever a shard is added or rewritten """
+    from misc.columnar import fingerprint
+
+    return "|".join(f"{os.path.basename(p)}:{fingerprint(p)}" for p in shard_files(decay))
+
+
+if __name__ == "__main__":
+    import sys
+
+    reconstructed_file, n_gen = sys.argv[1:]
+    print(f"Writing {write_shard(reconstructed_file, int(n_gen), count_signal(reconstructed_file))}")
@@ -0,0 +1,176 @@
+"""misc/column_store.py
+Raw .npy copies of the columns nearly every analysis step reads (Mbc, deltaE, isSignal).
+They are opened memory-mapped, so reads are zero-copy and concurrent processes share the OS page cache
+instead of each holding a private copy.
+A second copy, clustered by Mbc and with a zone map (see misc/zone_map.py), answers range cuts by reading only
+the blocks that can pass them.
+Usage:
+    $ python misc/column_store.py <decay> [<decay>,...]
+"""
+import glob
+import os
+import shutil
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from misc.columnar import build_cache, fingerprint
+from misc.zone_map import ZoneMap
+from selection.cuts import compile_cut, cut_variables, where_mask
+
+HOT_COLUMNS = ["Mbc", "deltaE", "isSignal"]
+
+# Column the clustered copy is sorted by
+CLUSTER_COLUMN = "Mbc"
+
+
+def get_store_dir(decay: str, key: str = "b0") -> str:
+    """
+    Directory holding the .npy columns of one tree of a merged file, named after the fingerprint of the source
+    :param decay: The decay mode in question
+    :param key: The tree within the .root file
+    :return: A string representing the location of the directory
+    """
+    from constants.locations import CACHE_DIR
+    from misc.utils import get_merged_file
+
+    source = get_merged_file(decay=decay)
+    return os.path.join(CACHE_DIR, decay, f"{key}_{fingerprint(source)}.npy")
+
+
+def build_store(decay: str, key: str = "b0") -> str:
+    """
+    Write the HOT_COLUMNS of a tree to one .npy file each, unless an up-to-date store already exists
+    :param decay: The decay mode in question
+    :param key: The tree within the .root file
+    :return: Location of the store directory
+    """
+    import pyarrow.parquet as pq
+
+    path = get_store_dir(decay=decay, key=key)
+    if os.path.exists(os.path.join(path, "clustered", "zones.npz")):
+        return path
+    # Stores written before the clustered copy existed are rebuilt
+    shutil.rmtree(path, ignore_errors=True)
+
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    for stale in glob.glob(os.path.join(parent, f"{key}_[0-9]*_[0-9]*.npy")):
+        if stale != path:
+            shutil.rmtree(stale, ignore_errors=True)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(tmp_path)
+    table = pq.read_table(build_cache(decay=decay, key=key), columns=HOT_COLUMNS)
+    arrays = {column: table.column(column).to_numpy() for column in HOT_COLUMNS}
+    for column, values in arrays.items():
+        np.save(os.path.join(tmp_path, f"{column}.npy"), values)
+
+    # Clustered copy. __entry__ keeps the original row number, so results can be put back in file order.
+    clustered_path = os.path.join(tmp_path, "clustered")
+    os.makedirs(clustered_path)
+    order = np.argsort(arrays[CLUSTER_COLUMN], kind="stable")
+    clustered = {column: values[order] for column, values in arrays.items()}
+    for column, values in clustered.items():
+        np.save(os.path.join(clustered_path, f"{column}.npy"), values)
+    np.save(os.path.join(clustered_path, "__entry__.npy"), order)
+    ZoneMap.from_arrays(clustered).save(os.path.join(clustered_path, "zones.npz"))
+
+    # Another job may have finished the same store first, in which case ours is redundant
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return path
+
+
+def covers(columns: Optional[List[str]], where: Optional[str] = None) -> bool:
+    """
+    Whether a request can be answered from the column store alone
+    :param columns: Columns requested
+    :param where: Cut string of the request
+    :return: True if every column needed is one of HOT_COLUMNS
+    """
+    if columns is None:
+        return False
+    return set(columns).union(cut_variables(where)).issubset(HOT_COLUMNS)
+
+
+def load_columns(decay: str, columns: List[str], key: str = "b0") -> Dict[str, np.memmap]:
+    """
+    Memory-map the requested columns. Nothing is read from disk until the arrays are used.
+    :param decay: The decay you want
+    :param columns: Columns you want, a subset of HOT_COLUMNS
+    :param key: The tree within the .root file you want
+    :return: dict of column name to read-only numpy memmap
+    """
+    path = build_store(decay=decay, key=key)
+    return {column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r") for column in columns}
+
+
+def _read_clustered(decay: str, columns: List[str], bounds: dict, key: str = "b0") -> pd.DataFrame:
+    """ Rows of the clustered copy in zones compatible with bounds, returned in the original file order """
+    path = os.path.join(build_store(decay=decay, key=key), "clustered")
+    zones = ZoneMap.load(os.path.join(path, "zones.npz"))
+    keep = zones.candidates(bounds)
+    slices = [slice(a, b) for a, b in zip(zones.starts[keep], zones.stops[keep])]
+
+    def gather(column):
+        values = np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r")
+        return np.concatenate([values[s] for s in slices]) if slices else values[:0].copy()
+
+    order = np.argsort(gather("__entry__"), kind="stable")
+    return pd.DataFrame({column: gather(column)[order] for column in columns})
+
+
+def read_columns(decay: str, key: str = "b0", where: Optional[str] = None,
+                 columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Same interface as misc.utils.get_merged_df, for requests where covers(columns, where) is True.
+    Without a where cut the returned DataFrame is a view of the memory-mapped files. Range cuts
+    on the clustering column are answered from the clustered copy, reading only the zones they can pass; other cuts
+    are applied to the memory-mapped files, as the clustered copy couldn't skip anything for them.
+    :param decay: The decay you want
+    :param key: The tree within the .root file you want
+    :param where: Optional cuts to apply before returning
+    :param columns: Columns you want in the DataFrame
+    :return: pandas DataFrame
+    """
+    to_read = list(dict.fromkeys(list(columns) + cut_variables(where)))
+    bounds = {} if where is None else compile_cut(where).bounds()
+    if CLUSTER_COLUMN in bounds:
+        df = _read_clustered(decay=decay, columns=to_read, bounds=bounds, key=key)
+    else:
+        df = pd.DataFrame(load_columns(decay=decay, columns=to_read, key=key), copy=False)
+    if where is not None:
+        df = df[where_mask(df, where)].reset_index(drop=True)
+    return df[list(columns)]
+
+
+def iter_columns(decay: str, key: str = "b0", where: Optional[str] = None, columns: Optional[List[str]] = None,
+                 chunksize: int = 100000) -> Iterator[pd.DataFrame]:
+    """
+    Chunked version of read_columns, slicing the memory-mapped arrays
+    :param decay: The decay you want
+    :param key: The tree within the .root file you want
+    :param where: Optional cuts, applied to each chunk
+    :param columns: Columns you want in each chunk
+    :param chunksize: Number of rows per chunk (before the where cut)
+    :return: Generator of pandas DataFrames
+    """
+    to_read = list(dict.fromkeys(list(columns) + cut_variables(where)))
+    arrays = load_columns(decay=decay, columns=to_read, key=key)
+    n_rows = len(arrays[to_read[0]])
+    for start in range(0, n_rows, chunksize):
+        df = pd.DataFrame({c: a[start:start + chunksize] for c, a in arrays.items()}, copy=False)
+        if where is not None:
+            df = df[where_mask(df, where)].reset_index(drop=True)
+        yield df[list(columns)]
+
+
+if __name__ == "__main__":
+    import sys
+
+    for decay in sys.argv[1:]:
+        print(f"Writing column store for {decay}: {build_store(decay)}")
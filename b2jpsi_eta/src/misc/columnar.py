@@ -0,0 +1,170 @@
+"""misc/columnar.py
+Parquet cache of the merged .root trees.
+Each tree is converted once, then every later read only decodes the columns it asks for.
+Usage:
+    $ python misc/columnar.py <decay> [<decay>,...]
+"""
+import glob
+import os
+from typing import Iterator, List, Optional
+
+import pandas as pd
+
+from selection.cuts import cut_variables, where_mask
+
+# Number of candidates converted per ROOT read
+CHUNKSIZE = 500000
+
+# Candidates per Parquet row group. Each row group carries min/max statistics, so smaller groups let range cuts
+# skip more of the file (see misc/zone_map.py)
+ROW_GROUP_SIZE = 100000
+
+
+def fingerprint(path: str) -> str:
+    """
+    Cheap identifier for the current version of a file, built from its size and modification time
+    :param path: File to fingerprint
+    :return: String of the form "<size>_<mtime in ns>"
+    """
+    stat = os.stat(path)
+    return f"{stat.st_size}_{stat.st_mtime_ns}"
+
+
+def get_cache_file(decay: str, key: str = "b0") -> str:
+    """
+    Location of the Parquet cache for one tree of a merged file. The name includes the fingerprint of the
+    source, so a re-merged .root file never reuses an old cache.
+    :param decay: The decay mode in question
+    :param key: The tree within the .root file
+    :return: A string representing the location of the cache file
+    """
+    from constants.locations import CACHE_DIR
+    from misc.utils import get_merged_file
+
+    source = get_merged_file(decay=decay)
+    return os.path.join(CACHE_DIR, decay, f"{key}_{fingerprint(source)}.parquet")
+
+
+def _read_root_chunks(source: str, key: str) -> Iterator[pd.DataFrame]:
+    import root_pandas
+    return root_pandas.read_root(source, key=key, chunksize=CHUNKSIZE)
+
+
+def build_cache(decay: str, key: str = "b0") -> str:
+    """
+    Convert one tree of a merged .root file to Parquet, unless an up-to-date cache already exists.
+    The tree is read in chunks of CHUNKSIZE candidates, so the conversion never holds the whole file in memory.
+    :param decay: The decay mode in question
+    :param key: The tree within the .root file
+    :return: Location of the cache file
+    """
+    path = get_cache_file(decay=decay, key=key)
+    if os.path.exists(path):
+        return path
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from misc.utils import get_merged_file
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+
+    # Caches made from older versions of the merged file are never read again
+    for stale in glob.glob(os.path.join(directory, f"{key}_[0-9]*_[0-9]*.parquet")):
+        if stale != path:
+            os.remove(stale)
+
+    source = get_merged_file(decay=decay)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    writer = None
+    try:
+        for chunk in _read_root_chunks(source, key):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+    except BaseException:
+        # A failed conversion leaves neither a cache nor a half-written temporary file behind
+        if writer is not None:
+            writer.close()
+            os.remove(tmp_path)
+        raise
+
+    if writer is None:
+        raise ValueError(f"Tree {key!r} in {source} has no entries to cache")
+    writer.close()
+
+    # Atomic, so parallel jobs never see a half-written cache
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_cached(decay: str, key: str = "b0", where: Optional[str] = None,
+                columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Same interface as misc.utils.get_merged_df, but reading from the Parquet cache (built on first use)
+    :param decay: The decay you want
+    :param key: The tree within the .root file you want
+    :param where: Optional cuts to apply before returning
+    :param columns: Columns you want in the DataFrame
+    :return: pandas DataFrame
+    """
+    import pyarrow.parquet as pq
+    from misc.zone_map import parquet_row_groups
+
+    parquet_file = pq.ParquetFile(build_cache(decay=decay, key=key))
+    to_read = None
+    if columns is not None:
+        to_read = list(dict.fromkeys(list(columns) + cut_variables(where)))
+
+    if where is None:
+        df = parquet_file.read(columns=to_read).to_pandas()
+    else:
+        # Only decode row groups whose min/max are compatible with the cut
+        row_groups = parquet_row_groups(parquet_file, where)
+        df = parquet_file.read_row_groups(row_groups, columns=to_read).to_pandas()
+    if where is not None:
+        df = df[where_mask(df, where)].reset_index(drop=True)
+    if columns is not None:
+        df = df[list(columns)]
+    return df
+
+
+def iter_cached(decay: str, key: str = "b0", where: Optional[str] = None, columns: Optional[List[str]] = None,
+                chunksize: int = CHUNKSIZE) -> Iterator[pd.DataFrame]:
+    """
+    Chunked version of read_cached. Only one batch of chunksize rows is decoded at a time.
+    :param decay: The decay you want
+    :param key: The tree within the .root file you want
+    :param where: Optional cuts to apply to each chunk
+    :param columns: Columns you want in each chunk
+    :param chunksize: Number of rows read per chunk (before the where cut)
+    :return: Generator of pandas DataFrames
+    """
+    import pyarrow.parquet as pq
+    from misc.zone_map import parquet_row_groups
+
+    parquet_file = pq.ParquetFile(build_cache(decay=decay, key=key))
+    to_read = None
+    if columns is not None:
+        to_read = list(dict.fromkeys(list(columns) + cut_variables(where)))
+
+    row_groups = None if where is None else parquet_row_groups(parquet_file, where)
+    for batch in parquet_file.iter_batches(batch_size=chunksize, row_groups=row_groups, columns=to_read):
+        df = batch.to_pandas()
+        if where is not None:
+            df = df[where_mask(df, where)].reset_index(drop=True)
+        if columns is not None:
+            df = df[list(columns)]
+        yield df
+
+
+if __name__ == "__main__":
+    import sys
+
+    from misc.event_table import EVENT_KEY, has_event_table
+
+    for decay in sys.argv[1:]:
+        print(f"Caching {decay}: {build_cache(decay)}")
+        if has_event_table(decay):
+            print(f"Caching {decay} event table: {build_cache(decay, key=EVENT_KEY)}")
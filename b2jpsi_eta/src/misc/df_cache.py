@@ -0,0 +1,115 @@
+"""misc/df_cache.py
+Process-wide, size-bounded LRU cache of DataFrames read from merged files.
+A request can be answered from any cached DataFrame holding a superset of what it needs, e.g. a request for
+["Mbc"] with where="isSignal" is sliced out of a cached, uncut ["Mbc", "deltaE", "isSignal"].
+"""
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+import attr
+import pandas as pd
+
+from selection.cuts import cut_variables, where_mask
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+CacheKey = Tuple[str, str, str, Optional[Tuple[str, ...]], Optional[str]]
+
+
+def nbytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+@attr.s
+class DataFrameCache:
+    max_bytes: int = attr.ib(default=DEFAULT_MAX_BYTES)
+
+    def __attrs_post_init__(self):
+        self._entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(decay: str, key: str, columns: Optional[List[str]], where: Optional[str],
+                 profile: str = "") -> CacheKey:
+        return decay, key, profile, None if columns is None else tuple(columns), where
+
+    def _slice(self, cached_key: CacheKey, df: pd.DataFrame, columns: Optional[List[str]],
+               where: Optional[str]) -> Optional[pd.DataFrame]:
+        """ Cut the requested DataFrame out of a cached one, or return None if it doesn't hold enough """
+        *_, cached_columns, cached_where = cached_key
+        available = set(df.columns)
+        if columns is not None and not available.issuperset(columns):
+            return None
+        if columns is None and cached_columns is not None:
+            return None
+
+        if where == cached_where:
+            result = df
+        elif cached_where is None and available.issuperset(cut_variables(where)):
+            result = df[where_mask(df, where)].reset_index(drop=True)
+        else:
+            return None
+
+        if columns is not None:
+            result = result[list(columns)]
+        # Shallow copy: adding columns to the result doesn't touch the cached entry
+        return result.copy(deep=False)
+
+    def lookup(self, decay: str, key: str, columns: Optional[List[str]], where: Optional[str],
+               profile: str = "") -> Optional[pd.DataFrame]:
+        """
+        Find a cached DataFrame that answers the request, marking it as recently used
+        :return: The requested DataFrame, or None on a miss
+        """
+        exact = self.make_key(decay, key, columns, where, profile)
+        candidates = [exact] if exact in self._entries else []
+        candidates += [k for k in reversed(self._entries) if k[:3] == exact[:3] and k != exact]
+        for cached_key in candidates:
+            result = self._slice(cached_key, self._entries[cached_key], columns, where)
+            if result is not None:
+                self._entries.move_to_end(cached_key)
+                return result
+        return None
+
+    def store(self, decay: str, key: str, columns: Optional[List[str]], where: Optional[str],
+              df: pd.DataFrame, profile: str = "") -> None:
+        """ Add a DataFrame, evicting least recently used entries until the cache is within max_bytes """
+        size = nbytes(df)
+        if size > self.max_bytes:
+            return
+
+        cache_key = self.make_key(decay, key, columns, where, profile)
+        if cache_key in self._entries:
+            self.current_bytes -= nbytes(self._entries.pop(cache_key))
+        self._entries[cache_key] = df
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= nbytes(evicted)
+
+    def get(self, decay: str, key: str, columns: Optional[List[str]], where: Optional[str],
+            loader: Callable[..., pd.DataFrame], profile: str = "") -> pd.DataFrame:
+        """
+        Return the requested DataFrame from the cache, calling loader(decay=, key=, where=, columns=) on a miss
+        Treat the result as read-only: its values are shared with the cached entry.
+        DataFrames loaded with a different profile (e.g. "compact" dtypes) never answer each other's requests.
+        """
+        result = self.lookup(decay, key, columns, where, profile)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        df = loader(decay=decay, key=key, where=where, columns=columns)
+        self.store(decay, key, columns, where, df, profile)
+        return df.copy(deep=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.current_bytes = 0
+
+
+# Shared by every reader in the process. Change DF_CACHE.max_bytes to adjust the memory ceiling.
+DF_CACHE = DataFrameCache()
@@ -0,0 +1,114 @@
+"""misc/dtypes.py
+Compact dtype profile for ntuples read from merged files.
+basf2 writes every variable as float64. With compact=True every float64 column becomes float32, and truth flags /
+PDG codes become bool or the smallest integer type. There is no per-column precision check: rounding to float32
+changes a value by at most 2^-24 of itself (e.g. 0.3 keV on Mbc, far below any resolution of the analysis), so
+studies that need more than that must not ask for compact=True.
+The only float64 columns kept are those float32 can't hold at all: values beyond its range, or so small they would
+become subnormal (or zero).
+Usage:
+    $ python misc/dtypes.py <decay> [<decay>,...]
+"""
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+# Integer-valued basf2 variables, stored as float by variablesToNtuple
+INTEGER_COLUMNS = (
+    "mcErrors",
+    "mcPDG",
+    "genMotherPDG",
+    "nMCMatches",
+    "__experiment__",
+    "__run__",
+    "__event__",
+    "__candidate__",
+    "__ncandidates__",
+)
+
+
+def is_integer_column(column: str) -> bool:
+    """ Truth flags (isSignal, isSignalAcceptMissingGamma, ...) and the columns in INTEGER_COLUMNS """
+    return column.startswith("is") or column in INTEGER_COLUMNS
+
+
+def _compact_integer(values: pd.Series) -> pd.Series:
+    array = values.to_numpy()
+    if array.dtype.kind == "f" and (not np.isfinite(array).all() or (array != np.round(array)).any()):
+        # NaN flags (e.g. isSignal for candidates without an MC match) can't be stored as integers
+        return values.astype(np.float32)
+    if len(array) and np.isin(array, (0, 1)).all():
+        return values.astype(bool)
+    if len(array) and array.min() >= 0:
+        return pd.to_numeric(values.astype(np.int64), downcast="unsigned")
+    return pd.to_numeric(values.astype(np.int64), downcast="integer")
+
+
+def _compact_float(values: pd.Series) -> pd.Series:
+    array = values.to_numpy()
+    with np.errstate(over="ignore"):
+        as_float32 = array.astype(np.float32)
+    magnitude = np.abs(array[np.isfinite(array) & (array != 0)])
+    # Columns with values that would overflow, or become subnormal or zero, are kept as they are
+    if len(magnitude) and (magnitude.max() > np.finfo(np.float32).max or magnitude.min() < np.finfo(np.float32).tiny):
+        return values
+    return pd.Series(as_float32, index=values.index, name=values.name)
+
+
+def compact_dtypes(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Downcast the columns of a DataFrame read from an ntuple
+    :param df: DataFrame to compact. It is not modified.
+    :return: The compacted DataFrame, and a report with one row per column:
+    {before: old dtype, after: new dtype, bytes_before, bytes_after, saved: bytes saved}
+    """
+    compact = {}
+    rows = []
+    for column in df.columns:
+        values = df[column]
+        if values.dtype.kind in "iuf" and is_integer_column(column):
+            values = _compact_integer(values)
+        elif values.dtype == np.float64:
+            values = _compact_float(values)
+        compact[column] = values
+        rows.append(dict(
+            column=column,
+            before=str(df[column].dtype),
+            after=str(values.dtype),
+            bytes_before=df[column].memory_usage(index=False, deep=True),
+            bytes_after=values.memory_usage(index=False, deep=True),
+        ))
+
+    report = pd.DataFrame(rows, columns="column before after bytes_before bytes_after".split()).set_index("column")
+    report["saved"] = report["bytes_before"] - report["bytes_after"]
+    return pd.DataFrame(compact, index=df.index), report
+
+
+def slice_report(report: pd.DataFrame, df: pd.DataFrame) -> pd.DataFrame:
+    """
+    The report of compact_dtypes for a part of the DataFrame it was made for, e.g. rows and columns sliced from a
+    memoized superset
+    :param report: Report of compact_dtypes
+    :param df: Compacted DataFrame, a subset of the rows and columns the report describes
+    :return: Report of the columns of df, with the bytes of its rows
+    """
+    report = report.loc[list(df.columns)].copy()
+    report["bytes_after"] = [df[c].memory_usage(index=False, deep=True) for c in df.columns]
+    # Columns that were downcast were numeric, so their old size follows from the number of rows
+    changed = report["before"] != report["after"]
+    report.loc[changed, "bytes_before"] = [np.dtype(d).itemsize * len(df) for d in report.loc[changed, "before"]]
+    report.loc[~changed, "bytes_before"] = report.loc[~changed, "bytes_after"]
+    report["saved"] = report["bytes_before"] - report["bytes_after"]
+    return report
+
+
+if __name__ == "__main__":
+    import sys
+    from misc.utils import get_merged_df
+
+    for decay in sys.argv[1:]:
+        report = get_merged_df(decay, compact=True).attrs["compact_report"]
+        print(f"{decay}: saved {report['saved'].sum() / 1024 ** 2:.1f} MiB "
+              f"of {report['bytes_before'].sum() / 1024 ** 2:.1f} MiB")
+        print(report.sort_values("saved", ascending=False).to_string())
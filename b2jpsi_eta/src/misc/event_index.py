@@ -0,0 +1,181 @@
+"""misc/event_index.py
+Sorted (experiment, run, event, candidate) index of the per-particle trees written by
+my_reconstruction/template.py (b0, jpsi, eta, gamma, ... see config/tree_names.yaml), and joins between them
+done with np.searchsorted instead of pandas hash merges.
+Rows of a mother tree are joined to their own daughters: template.py numbers the candidates of each daughter
+list (RANK_COLUMN) and writes, on the head tree, the number of each of its daughters ("{tree}_" + RANK_COLUMN).
+Joining b0 to jpsi therefore gives each B candidate with the one J/psi candidate it was built from.
+Usage:
+    b0_jpsi = join("jpsi2ee_eta2gammagamma", left="b0", right="jpsi", left_columns=["Mbc"], right_columns=["M"])
+"""
+import os
+from typing import List, Optional
+
+import attr
+import numpy as np
+import pandas as pd
+
+from misc.columnar import fingerprint
+
+EVENT_COLUMNS = ["__experiment__", "__run__", "__event__"]
+CANDIDATE_COLUMN = "__candidate__"
+# Number of a candidate within its particle list, unique per event, the extraInfo and alias set by template.py.
+# Unlike __candidate__ (the row number within one tree) it can be read on the mother through daughter(i, ...)
+RANK_COLUMN = "listRank"
+
+
+def daughter_column(tree: str) -> str:
+    """ Column of a mother tree holding the RANK_COLUMN of its daughter written to the given tree """
+    return f"{tree}_{RANK_COLUMN}"
+
+# Bits of the packed event key given to run and event number; the experiment number takes the rest
+_RUN_BITS = 20
+_EVENT_BITS = 32
+
+
+def event_keys(experiment: np.ndarray, run: np.ndarray, event: np.ndarray) -> np.ndarray:
+    """
+    Pack (experiment, run, event) into one uint64 per row, ordered the same way as the tuples
+    :return: numpy uint64 array
+    """
+    experiment, run, event = (np.asarray(x).astype(np.uint64) for x in (experiment, run, event))
+    if len(run) and (run.max() >= 2 ** _RUN_BITS or event.max() >= 2 ** _EVENT_BITS
+                     or experiment.max() >= 2 ** (64 - _RUN_BITS - _EVENT_BITS)):
+        raise ValueError("Experiment/run/event numbers too large to pack into an event key")
+    return (experiment << np.uint64(_RUN_BITS + _EVENT_BITS)) | (run << np.uint64(_EVENT_BITS)) | event
+
+
+@attr.s
+class EventIndex:
+    # Event key and candidate number of every row, sorted by (event key, candidate)
+    keys: np.ndarray = attr.ib()
+    candidates: np.ndarray = attr.ib()
+    # order[i] is the row number (in file order) of the i-th sorted entry
+    order: np.ndarray = attr.ib()
+
+    @classmethod
+    def from_df(cls, df: pd.DataFrame, candidate_column: str = CANDIDATE_COLUMN) -> "EventIndex":
+        keys = event_keys(*(df[c].to_numpy() for c in EVENT_COLUMNS))
+        candidates = _candidate_numbers(df[candidate_column].to_numpy())
+        order = np.lexsort((candidates, keys))
+        return cls(keys=keys[order], candidates=candidates[order], order=order)
+
+    def save(self, path: str) -> None:
+        np.savez(path, keys=self.keys, candidates=self.candidates, order=self.order)
+
+    @classmethod
+    def load(cls, path: str) -> "EventIndex":
+        with np.load(path) as f:
+            return cls(keys=f["keys"], candidates=f["candidates"], order=f["order"])
+
+    @property
+    def row_keys(self) -> np.ndarray:
+        """ Event key of every row, in file order """
+        keys = np.empty_like(self.keys)
+        keys[self.order] = self.keys
+        return keys
+
+    def lookup(self, keys: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        """
+        Row numbers of exact (event key, candidate) matches
+        :return: numpy array of row numbers, -1 where nothing matches
+        """
+        # Replace each event key by its rank among the distinct events, so (rank, candidate) packs into one
+        # sorted int64 and a single searchsorted finds exact matches
+        unique_keys = np.unique(self.keys)
+        stride = int(self.candidates.max()) + 1 if len(self.candidates) else 1
+        packed = np.searchsorted(unique_keys, self.keys) * stride + self.candidates
+
+        keys, candidates = np.asarray(keys, dtype=np.uint64), np.asarray(candidates, dtype=np.int64)
+        rank = np.minimum(np.searchsorted(unique_keys, keys), max(len(unique_keys) - 1, 0))
+        query = rank * stride + candidates
+        position = np.minimum(np.searchsorted(packed, query), max(len(packed) - 1, 0))
+        found = (
+            (len(packed) > 0)
+            & (unique_keys[rank] == keys if len(unique_keys) else False)
+            & (candidates >= 0) & (candidates < stride)
+            & (packed[position] == query if len(packed) else False)
+        )
+        return np.where(found, self.order[position] if len(packed) else -1, -1)
+
+
+def _candidate_numbers(values: np.ndarray) -> np.ndarray:
+    """ Candidate numbers as int64, -1 where missing (NaN, as extraInfo of a particle that has none) """
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        values = np.where(np.isnan(values), -1, values)
+    return values.astype(np.int64)
+
+
+def join_rows(left: EventIndex, daughters: np.ndarray, right: EventIndex):
+    """
+    Each row of a mother tree with the row of its daughter in the daughter tree
+    :param left: Index of the mother tree
+    :param daughters: RANK_COLUMN of the daughter of every mother row, in file order
+    :param right: Index of the daughter tree, built on RANK_COLUMN
+    :return: Tuple of numpy arrays (left row numbers, right row numbers), ordered by left row; mother rows whose
+    daughter isn't in the daughter tree are left out
+    """
+    right_rows = right.lookup(left.row_keys, _candidate_numbers(daughters))
+    left_rows = np.flatnonzero(right_rows >= 0)
+    return left_rows, right_rows[left_rows]
+
+
+def get_index_file(decay: str, key: str = "b0", candidate_column: str = CANDIDATE_COLUMN) -> str:
+    from constants.locations import CACHE_DIR
+    from misc.utils import get_merged_file
+
+    source = get_merged_file(decay=decay)
+    return os.path.join(CACHE_DIR, decay, f"{key}_{candidate_column}_{fingerprint(source)}.index.npz")
+
+
+def build_index(decay: str, key: str = "b0", candidate_column: str = CANDIDATE_COLUMN) -> EventIndex:
+    """
+    Event index of one tree of a merged file, saved next to the cache and reused until the file changes
+    :param decay: The decay mode in question
+    :param key: The tree within the .root file
+    :param candidate_column: Column numbering the candidates of an event, __candidate__ or RANK_COLUMN
+    :return: EventIndex
+    """
+    from misc.utils import get_merged_df
+
+    path = get_index_file(decay=decay, key=key, candidate_column=candidate_column)
+    if os.path.exists(path):
+        return EventIndex.load(path)
+
+    df = get_merged_df(decay, key=key, columns=EVENT_COLUMNS + [candidate_column], memoize=False)
+    index = EventIndex.from_df(df, candidate_column=candidate_column)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    index.save(tmp_path)
+    os.replace(tmp_path, path)
+    return index
+
+
+def join(decay: str, left: str = "b0", right: str = "jpsi", left_columns: Optional[List[str]] = None,
+         right_columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Pair every row of a mother tree with the row of its daughter in a daughter tree
+    :param decay: The decay mode in question
+    :param left: Mother tree, e.g. "b0"
+    :param right: Daughter tree, e.g. "jpsi"; the left tree must have its daughter_column
+    :param left_columns: Columns of the left tree to include (default: all)
+    :param right_columns: Columns of the right tree to include (default: all), prefixed with "{right}_"
+    :return: pandas DataFrame with one row per matched mother, plus "{left}_row" and "{right}_row" row numbers
+    """
+    from misc.utils import get_merged_df, merged_columns
+
+    link = daughter_column(right)
+    if link not in merged_columns(decay, left):
+        raise ValueError(f"Tree {left} of {decay} has no {link} column, so it can't be joined to its {right} daughter")
+
+    daughters = get_merged_df(decay, key=left, columns=[link], memoize=False)[link].to_numpy()
+    left_rows, right_rows = join_rows(build_index(decay, key=left), daughters,
+                                      build_index(decay, key=right, candidate_column=RANK_COLUMN))
+    left_df = get_merged_df(decay, key=left, columns=left_columns)
+    right_df = get_merged_df(decay, key=right, columns=right_columns)
+
+    joined = {f"{left}_row": left_rows, f"{right}_row": right_rows}
+    joined.update({c: left_df[c].to_numpy()[left_rows] for c in left_df.columns})
+    joined.update({f"{right}_{c}": right_df[c].to_numpy()[right_rows] for c in right_df.columns})
+    return pd.DataFrame(joined)
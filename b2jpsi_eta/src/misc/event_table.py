@@ -0,0 +1,146 @@
+"""misc/event_table.py
+Normalized layout of the reconstruction output: per-event quantities (event shape, ...) go to their own "event"
+tree with one row per event, instead of being repeated on every B0 candidate (dozens of times per event in the
+3pi0 modes). See the normalized option of Reconstruction.reconstruction in my_reconstruction/perform_reconstruction.py.
+Readers don't need to know about the split: misc.utils.get_merged_df and iter_merged_df broadcast event columns
+onto the candidates they belong to, and only when a request asks for them.
+Usage:
+    get_merged_df("jpsi2ee_eta23pi0", columns=["Mbc", "thrustBm"])  # thrustBm comes from the event tree
+"""
+import functools
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from misc.columnar import fingerprint
+from misc.event_index import EVENT_COLUMNS, event_keys
+from selection.cuts import cut_variables, where_mask
+
+# Name of the event-level tree in the reconstruction output
+EVENT_KEY = "event"
+
+
+@functools.lru_cache(maxsize=None)
+def _has_event_tree(source: str, source_fingerprint: str) -> bool:
+    # The fingerprint is only part of the memoization key, so a re-merged file is looked at again
+    import root_numpy
+    return EVENT_KEY in root_numpy.list_trees(source)
+
+
+def has_event_table(decay: str) -> bool:
+    """
+    Whether the merged file of a mode was written with the normalized layout
+    :param decay: The decay mode in question
+    :return: True if the merged file has an event tree
+    """
+    import os
+    from misc.columnar import get_cache_file
+    from misc.utils import get_merged_file
+
+    if os.path.exists(get_cache_file(decay=decay, key=EVENT_KEY)):
+        return True
+    source = get_merged_file(decay=decay)
+    return _has_event_tree(source, fingerprint(source))
+
+
+def event_columns(decay: str) -> List[str]:
+    """
+    Event-level columns of a mode, empty for files written with every variable on every candidate
+    :param decay: The decay mode in question
+    :return: List of column names
+    """
+    if not has_event_table(decay):
+        return []
+    import pyarrow.parquet as pq
+    from misc.columnar import build_cache
+
+    names = pq.ParquetFile(build_cache(decay=decay, key=EVENT_KEY)).schema_arrow.names
+    return [c for c in names if c not in EVENT_COLUMNS and not c.startswith("__")]
+
+
+def needed_event_columns(decay: str, key: str, columns: Optional[List[str]], where: Optional[str]) -> List[str]:
+    """
+    Event columns a request on a candidate tree needs. With columns=None every event column is broadcast.
+    :return: List of column names
+    """
+    if key == EVENT_KEY:
+        return []
+    available = event_columns(decay)
+    if not available:
+        return []
+    if columns is None:
+        return available
+    wanted = dict.fromkeys(list(columns) + cut_variables(where))
+    return [c for c in available if c in wanted]
+
+
+def _event_table(decay: str, needed: List[str]) -> Dict[str, np.ndarray]:
+    """ Sorted event keys and the needed event columns in the same order """
+    from misc.utils import get_merged_df
+
+    events = get_merged_df(decay, key=EVENT_KEY, columns=EVENT_COLUMNS + list(needed))
+    keys = event_keys(*(events[c].to_numpy() for c in EVENT_COLUMNS))
+    order = np.argsort(keys, kind="stable")
+    table = {c: events[c].to_numpy()[order] for c in needed}
+    table["__keys__"] = keys[order]
+    return table
+
+
+def broadcast(base: pd.DataFrame, table: Dict[str, np.ndarray], needed: List[str]) -> pd.DataFrame:
+    """
+    Add event columns to candidates, matching on (experiment, run, event)
+    :param base: Candidates, including EVENT_COLUMNS
+    :param table: Output of _event_table
+    :param needed: Event columns to add
+    :return: base with the event columns added. Candidates of events missing from the event tree get NaN.
+    """
+    keys = event_keys(*(base[c].to_numpy() for c in EVENT_COLUMNS))
+    position = np.minimum(np.searchsorted(table["__keys__"], keys), max(len(table["__keys__"]) - 1, 0))
+    found = table["__keys__"][position] == keys if len(table["__keys__"]) else np.zeros(len(keys), dtype=bool)
+    df = base.copy(deep=False)
+    for column in needed:
+        values = table[column][position] if len(table["__keys__"]) else np.empty(len(keys))
+        if not found.all():
+            values = np.where(found, values, np.nan)
+        df[column] = values
+    return df
+
+
+def _split(columns: Optional[List[str]], where: Optional[str], needed: List[str]) -> Optional[List[str]]:
+    """ Columns to read from the candidate tree itself """
+    if columns is None:
+        return None
+    wanted = dict.fromkeys(list(columns) + cut_variables(where) + EVENT_COLUMNS)
+    return [c for c in wanted if c not in needed]
+
+
+def _finish(df: pd.DataFrame, where: Optional[str], columns: Optional[List[str]]) -> pd.DataFrame:
+    if where is not None:
+        df = df[where_mask(df, where)].reset_index(drop=True)
+    return df if columns is None else df[list(columns)]
+
+
+def read_with_events(decay: str, key: str, where: Optional[str], columns: Optional[List[str]],
+                     needed: List[str], reader) -> pd.DataFrame:
+    """
+    Read the candidate tree with reader (same arguments as get_merged_df), broadcast the needed event columns,
+    then cut
+    """
+    # Cuts on candidate columns alone can still be pushed down to the reader
+    pushed = where if where is not None and not set(cut_variables(where)) & set(needed) else None
+    base = reader(decay=decay, key=key, where=pushed, columns=_split(columns, where, needed))
+    df = broadcast(base, _event_table(decay, needed), needed)
+    return _finish(df, None if pushed else where, columns)
+
+
+def iter_with_events(decay: str, key: str, where: Optional[str], columns: Optional[List[str]],
+                     needed: List[str], iterator, chunksize: int):
+    """
+    Chunked version of read_with_events. The event table is loaded once, each chunk is broadcast on its own.
+    """
+    pushed = where if where is not None and not set(cut_variables(where)) & set(needed) else None
+    table = _event_table(decay, needed)
+    for base in iterator(decay=decay, key=key, where=pushed, columns=_split(columns, where, needed),
+                         chunksize=chunksize):
+        yield _finish(broadcast(base, table, needed), None if pushed else where, columns)
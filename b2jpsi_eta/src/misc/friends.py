@@ -0,0 +1,292 @@
+"""misc/friends.py
+"Friend" columns: derived or extra variables stored next to a merged ntuple, aligned row by row with it.
+A new variable costs one pass over the columns it is computed from, instead of re-running reconstruction and
+hadd for every mode. Each friend is versioned on its own; readers use the highest version, and friends made
+from an older version of the merged file are ignored.
+Friends are joined transparently by misc.utils.get_merged_df and iter_merged_df.
+Usage:
+    add_friend("jpsi2ee_eta2gammagamma", "mbc_shift", lambda df: pd.DataFrame({"Mbc_shift": df.Mbc - 5.2796}),
+               inputs=["Mbc"])
+    get_merged_df("jpsi2ee_eta2gammagamma", columns=["Mbc_shift"], where="Mbc_shift > 0")
+"""
+import glob
+import os
+import re
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import pandas as pd
+
+from misc.columnar import build_cache, fingerprint
+from selection.cuts import cut_variables, where_mask
+
+_FRIEND_FILE = re.compile(r"^(?P<name>.+)\.v(?P<version>\d+)\.parquet$")
+
+
+def get_friend_dir(decay: str, key: str = "b0") -> str:
+    """
+    Directory holding the friends of one tree of a merged file, named after the fingerprint of the source
+    :param decay: The decay mode in question
+    :param key: The tree within the .root file
+    :return: A string representing the location of the directory
+    """
+    from constants.locations import CACHE_DIR
+    from misc.utils import get_merged_file
+
+    source = get_merged_file(decay=decay)
+    return os.path.join(CACHE_DIR, decay, "friends", f"{key}_{fingerprint(source)}")
+
+
+def friend_files(decay: str, key: str = "b0") -> Dict[str, str]:
+    """
+    Latest version of every friend of a tree
+    :return: dict of friend name to file location
+    """
+    latest = {}
+    for path in glob.glob(os.path.join(get_friend_dir(decay=decay, key=key), "*.parquet")):
+        match = _FRIEND_FILE.match(os.path.basename(path))
+        if match is None:
+            continue
+        name, version = match.group("name"), int(match.group("version"))
+        if name not in latest or version > latest[name][0]:
+            latest[name] = (version, path)
+    return {name: path for name, (_, path) in latest.items()}
+
+
+def friend_columns(decay: str, key: str = "b0") -> Dict[str, str]:
+    """
+    Columns provided by the friends of a tree
+    :return: dict of column name to the location of the friend file holding it
+    """
+    import pyarrow.parquet as pq
+
+    columns = {}
+    for path in friend_files(decay=decay, key=key).values():
+        for column in pq.ParquetFile(path).schema_arrow.names:
+            columns[column] = path
+    return columns
+
+
+def _base_schema(decay: str, key: str):
+    import pyarrow.parquet as pq
+
+    return pq.ParquetFile(build_cache(decay=decay, key=key)).metadata
+
+
+def _friend_path(decay: str, name: str, version: int, key: str, columns: List[str]) -> str:
+    """ Where a new friend goes, after checking its columns don't shadow existing ones """
+    if version < 1:
+        raise ValueError(f"Friend versions start at 1, got {version}")
+    import pyarrow.parquet as pq
+
+    taken = set(_base_schema(decay, key).schema.to_arrow_schema().names)
+    for other, path in friend_files(decay=decay, key=key).items():
+        if other != name:
+            taken.update(pq.ParquetFile(path).schema_arrow.names)
+    clashes = [c for c in columns if c in taken]
+    if clashes:
+        raise ValueError(f"Friend {name!r} would shadow existing columns {clashes} of {decay}/{key}")
+
+    directory = get_friend_dir(decay=decay, key=key)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{name}.v{version}.parquet")
+
+
+def write_friend(decay: str, name: str, df: pd.DataFrame, version: int = 1, key: str = "b0") -> str:
+    """
+    Store already computed columns as a friend of a merged tree
+    :param decay: The decay mode in question
+    :param name: Name of the friend, e.g. "continuum_suppression"
+    :param df: One row per entry of the merged tree, in the same order
+    :param version: Version of this friend. Readers use the highest version present.
+    :param key: The tree within the .root file
+    :return: Location of the friend file
+    """
+    from misc.df_cache import DF_CACHE
+
+    n_rows = _base_schema(decay, key).num_rows
+    if len(df) != n_rows:
+        raise ValueError(f"Friend {name!r} has {len(df)} rows but {decay}/{key} has {n_rows}")
+
+    path = _friend_path(decay, name, version, key, list(df.columns))
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.reset_index(drop=True).to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    # DataFrames cached before this friend existed don't have its columns
+    DF_CACHE.clear()
+    return path
+
+
+def write_friend_chunks(decay: str, name: str, chunks: Iterable[pd.DataFrame], version: int = 1,
+                        key: str = "b0") -> str:
+    """
+    Store columns computed chunk by chunk as a friend of a merged tree, without holding them all in memory
+    :param decay: The decay mode in question
+    :param name: Name of the friend
+    :param chunks: DataFrames of new columns which, concatenated, have one row per entry of the merged tree
+    :param version: Version of this friend. Readers use the highest version present.
+    :param key: The tree within the .root file
+    :return: Location of the friend file
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from misc.df_cache import DF_CACHE
+
+    path = tmp_path = writer = None
+    n_rows = 0
+    for chunk in chunks:
+        table = pa.Table.from_pandas(chunk.reset_index(drop=True), preserve_index=False)
+        if writer is None:
+            path = _friend_path(decay, name, version, key, table.schema.names)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            writer = pq.ParquetWriter(tmp_path, table.schema)
+        writer.write_table(table)
+        n_rows += len(chunk)
+
+    if writer is None:
+        raise ValueError(f"{decay}/{key} has no entries to make friend {name!r} from")
+    writer.close()
+    if n_rows != _base_schema(decay, key).num_rows:
+        os.remove(tmp_path)
+        raise ValueError(f"Friend {name!r} covers {n_rows} rows but {decay}/{key} has "
+                         f"{_base_schema(decay, key).num_rows}")
+    os.replace(tmp_path, path)
+    DF_CACHE.clear()
+    return path
+
+
+def add_friend(decay: str, name: str, func: Callable[[pd.DataFrame], pd.DataFrame], inputs: List[str],
+               version: int = 1, key: str = "b0", chunksize: int = 100000) -> str:
+    """
+    Compute a friend in one streaming pass over the columns it needs
+    :param decay: The decay mode in question
+    :param name: Name of the friend
+    :param func: Maps a chunk of the input columns to a DataFrame of new columns with the same number of rows
+    :param inputs: Columns func needs (may include columns of other friends)
+    :param version: Version of this friend. Readers use the highest version present.
+    :param key: The tree within the .root file
+    :param chunksize: Number of entries processed at a time
+    :return: Location of the friend file
+    """
+    from misc.utils import iter_merged_df
+
+    def derived_chunks():
+        for chunk in iter_merged_df(decay, key=key, columns=inputs, chunksize=chunksize):
+            derived = func(chunk)
+            if len(derived) != len(chunk):
+                raise ValueError(f"Friend {name!r} returned {len(derived)} rows for a chunk of {len(chunk)}")
+            yield derived
+
+    return write_friend_chunks(decay, name, derived_chunks(), version=version, key=key)
+
+
+def needed_friends(decay: str, key: str, columns: Optional[List[str]],
+                   where: Optional[str]) -> Dict[str, List[str]]:
+    """
+    Friend files (and their columns) a request needs. With columns=None every friend is joined.
+    :return: dict of friend file location to list of columns to read from it
+    """
+    available = friend_columns(decay=decay, key=key)
+    if not available:
+        return {}
+    wanted = list(available) if columns is None else list(dict.fromkeys(list(columns) + cut_variables(where)))
+    needed = {}
+    for column in wanted:
+        if column in available:
+            needed.setdefault(available[column], []).append(column)
+    return needed
+
+
+def inputs_digest(decay: str, key: str, columns: Optional[List[str]], where: Optional[str]) -> str:
+    """
+    Short hash of the fingerprints of every file a request reads: the merged file and the friends it needs.
+    Anything derived from the request can be cached under it, and goes stale exactly when an input changes.
+    :return: Hex string
+    """
+    import hashlib
+    from misc.utils import get_merged_file
+
+    prints = [fingerprint(get_merged_file(decay=decay))]
+    needed = needed_friends(decay, key, columns, where)
+    prints += [f"{os.path.basename(path)}:{fingerprint(path)}" for path in sorted(needed)]
+    return hashlib.sha1("|".join(prints).encode()).hexdigest()[:12]
+
+
+def _join(base: pd.DataFrame, friends: Dict[str, pd.DataFrame], where: Optional[str],
+          columns: Optional[List[str]]) -> pd.DataFrame:
+    df = pd.concat([base.reset_index(drop=True)] + [f.reset_index(drop=True) for f in friends.values()], axis=1)
+    if where is not None:
+        df = df[where_mask(df, where)].reset_index(drop=True)
+    return df if columns is None else df[list(columns)]
+
+
+def read_with_friends(decay: str, key: str, where: Optional[str], columns: Optional[List[str]],
+                      needed: Dict[str, List[str]], reader: Callable[..., pd.DataFrame]) -> pd.DataFrame:
+    """
+    Read the base tree with reader (same arguments as get_merged_df), join the needed friends, then cut
+    """
+    friend_cols = {c for cols in needed.values() for c in cols}
+    base_columns = None
+    if columns is not None:
+        base_columns = [c for c in dict.fromkeys(list(columns) + cut_variables(where)) if c not in friend_cols]
+    # The cut can only be applied once the friends are joined, so every row of the base is read
+    if base_columns == []:
+        base = pd.DataFrame(index=pd.RangeIndex(_base_schema(decay, key).num_rows))
+    else:
+        base = reader(decay=decay, key=key, where=None, columns=base_columns)
+    friends = {path: pd.read_parquet(path, columns=cols) for path, cols in needed.items()}
+    return _join(base, friends, where, columns)
+
+
+class _FriendRows:
+    """ The rows of a friend file in order, handed out n at a time while holding about one batch in memory """
+
+    def __init__(self, path: str, columns: List[str], batch_size: int):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path)
+        self._batches = parquet_file.iter_batches(batch_size=batch_size, columns=columns)
+        self._schema = parquet_file.schema_arrow
+        self._columns = columns
+        self._buffer = []
+        self._buffered = 0
+
+    def take(self, n_rows: int) -> pd.DataFrame:
+        import pyarrow as pa
+
+        while self._buffered < n_rows:
+            batch = next(self._batches, None)
+            if batch is None:
+                break
+            self._buffer.append(batch)
+            self._buffered += batch.num_rows
+        if self._buffer:
+            table = pa.Table.from_batches(self._buffer)
+        else:
+            table = pa.schema([self._schema.field(c) for c in self._columns]).empty_table()
+        self._buffer = table.slice(n_rows).to_batches()
+        self._buffered = table.num_rows - min(n_rows, table.num_rows)
+        return table.slice(0, n_rows).to_pandas()
+
+
+def iter_with_friends(decay: str, key: str, where: Optional[str], columns: Optional[List[str]],
+                      needed: Dict[str, List[str]], iterator: Callable[..., Iterator[pd.DataFrame]],
+                      chunksize: int) -> Iterator[pd.DataFrame]:
+    """
+    Chunked version of read_with_friends. Friends are read alongside the base, a batch at a time, and cut to the
+    rows of each base chunk.
+    """
+    friend_cols = {c for cols in needed.values() for c in cols}
+    base_columns = None
+    if columns is not None:
+        base_columns = [c for c in dict.fromkeys(list(columns) + cut_variables(where)) if c not in friend_cols]
+
+    friends = {path: _FriendRows(path, cols, batch_size=chunksize) for path, cols in needed.items()}
+    if base_columns == []:
+        n_total = _base_schema(decay, key).num_rows
+        bases = (pd.DataFrame(index=pd.RangeIndex(min(chunksize, n_total - start)))
+                 for start in range(0, n_total, chunksize))
+    else:
+        bases = iterator(decay=decay, key=key, where=None, columns=base_columns, chunksize=chunksize)
+
+    for base in bases:
+        yield _join(base, {path: rows.take(len(base)) for path, rows in friends.items()}, where, columns)
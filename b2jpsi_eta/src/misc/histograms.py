@@ -0,0 +1,190 @@
+"""misc/histograms.py
+Fixed-width histograms filled with np.bincount, and an on-disk cache of them for plots.
+With equal-width bins the bin of a value is arithmetic, (value - low) * bins / (high - low), so filling is one
+multiply and one np.bincount per chunk, with no binary search over the edges as in np.histogram.
+Along with the counts, every histogram keeps the moments (n, mean, sum of squared deviations) of the values it
+was filled with, for stat boxes. Histograms of a (decay, variable, range, bins, selection) are cached next to the
+Parquet cache, under a name that also covers the fingerprints of the inputs (see misc/friends.inputs_digest), so
+re-styling or regenerating a plot never reads the ntuple again.
+Usage:
+    histograms = sig_and_bkg_histograms("jpsi2ee_eta2gammagamma", "Mbc", (4.9, 5.3), bins=100)
+    histograms["signal"].counts, histograms["signal"].std
+"""
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, Optional, Tuple
+
+import attr
+import numpy as np
+import pandas as pd
+
+from misc.profiler import merge_moments
+
+
+def _binned(values: np.ndarray, low: float, high: float, bins: int) -> Tuple[np.ndarray, np.ndarray]:
+    """ Bins of the values in [low, high], and the mask of those values """
+    scaled = (np.asarray(values, dtype=float) - low) * (bins / (high - low))
+    with np.errstate(invalid="ignore"):
+        inside = (scaled >= 0) & (scaled <= bins)
+    # Truncation is floor for non-negative values; high falls in the last bin as in np.histogram
+    index = scaled[inside].astype(np.int64)
+    np.minimum(index, bins - 1, out=index)
+    return index, inside
+
+
+def bin_index(values: np.ndarray, low: float, high: float, bins: int) -> np.ndarray:
+    """
+    Bin of each value for bins equal-width bins over [low, high]
+    :return: numpy int64 array, -1 for values outside the range (and NaN)
+    """
+    index, inside = _binned(values, low, high, bins)
+    result = np.full(len(inside), -1, dtype=np.int64)
+    result[inside] = index
+    return result
+
+
+def bin_counts(values: np.ndarray, low: float, high: float, bins: int,
+               weights: Optional[np.ndarray] = None) -> np.ndarray:
+    """ np.histogram(values, bins, range=(low, high), weights=weights)[0], by np.bincount """
+    index, inside = _binned(values, low, high, bins)
+    return np.bincount(index, weights=None if weights is None else np.asarray(weights)[inside],
+                       minlength=bins).astype(float)
+
+
+@attr.s
+class Histogram:
+    low: float = attr.ib()
+    high: float = attr.ib()
+    bins: int = attr.ib()
+    counts: np.ndarray = attr.ib(default=None)
+    # Moments of the (unweighted) values in range
+    n: int = attr.ib(default=0)
+    mean: float = attr.ib(default=0.0)
+    m2: float = attr.ib(default=0.0)
+
+    def __attrs_post_init__(self):
+        if self.counts is None:
+            self.counts = np.zeros(self.bins)
+
+    @property
+    def edges(self) -> np.ndarray:
+        return np.linspace(self.low, self.high, self.bins + 1)
+
+    @property
+    def total(self) -> float:
+        """ Sum of weights in range """
+        return float(self.counts.sum())
+
+    @property
+    def std(self) -> float:
+        """ Sample standard deviation, as pandas.Series.std """
+        return float(np.sqrt(self.m2 / (self.n - 1))) if self.n > 1 else np.nan
+
+    def fill(self, values: np.ndarray, weights: Optional[np.ndarray] = None) -> None:
+        index, inside = _binned(values, self.low, self.high, self.bins)
+        self.counts += np.bincount(index, weights=None if weights is None else np.asarray(weights)[inside],
+                                   minlength=self.bins)
+        selected = np.asarray(values, dtype=float)[inside]
+        if len(selected):
+            mean = selected.mean()
+            self.n, self.mean, self.m2 = merge_moments(self.n, self.mean, self.m2, len(selected), mean,
+                                                       float(np.square(selected - mean).sum()))
+
+    def __add__(self, other: "Histogram") -> "Histogram":
+        if (self.low, self.high, self.bins) != (other.low, other.high, other.bins):
+            raise ValueError("Can only add histograms with the same binning")
+        n, mean, m2 = merge_moments(self.n, self.mean, self.m2, other.n, other.mean, other.m2)
+        return Histogram(self.low, self.high, self.bins, self.counts + other.counts, n, mean, m2)
+
+
+def fill(chunks: Iterable[pd.DataFrame], var: str, range: Tuple[float, float], bins: int, split: str = "isSignal",
+         weight: Optional[str] = None) -> Dict[str, Histogram]:
+    """
+    Signal and background histograms of var
+    :param chunks: DataFrames with var, split and weight
+    :param var: Column to histogram
+    :param range: (low, high) of the histograms
+    :param bins: Number of bins
+    :param split: Column telling signal (== 1) from background
+    :param weight: Optional column of candidate weights for the counts. Moments are unweighted.
+    :return: dict with keys "signal" and "background"
+    """
+    low, high = range
+    histograms = {name: Histogram(low, high, bins) for name in ("signal", "background")}
+    for chunk in chunks:
+        values = chunk[var].to_numpy()
+        weights = None if weight is None else chunk[weight].to_numpy()
+        is_signal = chunk[split].to_numpy() == 1
+        for name, mask in (("signal", is_signal), ("background", ~is_signal)):
+            histograms[name].fill(values[mask], None if weights is None else weights[mask])
+    return histograms
+
+
+def get_histogram_file(decay: str, var: str, range: Tuple[float, float], bins: int, where: Optional[str] = None,
+                       key: str = "b0", weight: Optional[str] = None) -> str:
+    """
+    Location of the cached histograms of a request, named after a hash of the request and of its inputs
+    :return: A string representing the location of the .npz file
+    """
+    from constants.locations import CACHE_DIR
+    from misc.friends import inputs_digest
+
+    columns = [var, "isSignal"] + ([weight] if weight else [])
+    request = json.dumps([var, [float(x) for x in range], int(bins), where, key, weight,
+                          inputs_digest(decay, key, columns, where)])
+    digest = hashlib.sha1(request.encode()).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, decay, "histograms", f"{var}_{digest}.npz")
+
+
+def save(path: str, histograms: Dict[str, Histogram]) -> None:
+    arrays = {}
+    for name, h in histograms.items():
+        arrays[f"{name}_counts"] = h.counts
+        arrays[f"{name}_info"] = np.array([h.low, h.high, h.bins, h.n, h.mean, h.m2])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load(path: str) -> Dict[str, Histogram]:
+    histograms = {}
+    with np.load(path) as f:
+        for name in dict.fromkeys(k.rsplit("_", 1)[0] for k in f.files):
+            low, high, bins, n, mean, m2 = f[f"{name}_info"]
+            histograms[name] = Histogram(float(low), float(high), int(bins), f[f"{name}_counts"], int(n),
+                                         float(mean), float(m2))
+    return histograms
+
+
+def sig_and_bkg_histograms(decay: str, var: str, range: Tuple[float, float], bins: int = 100,
+                           where: Optional[str] = None, key: str = "b0", weight: Optional[str] = None,
+                           chunksize: int = 500000) -> Dict[str, Histogram]:
+    """
+    Signal and background histograms of var, from the cache when an up-to-date entry exists, otherwise filled in
+    one streaming pass over the columns needed and cached
+    :param decay: The decay mode in question
+    :param var: Column to histogram
+    :param range: (low, high) of the histograms. Only candidates in range are read.
+    :param bins: Number of bins
+    :param where: Optional further cuts
+    :param key: The tree within the .root file
+    :param weight: Optional column of candidate weights, e.g. the retention weight of my_reconstruction/retention.py
+    :param chunksize: Number of candidates read at a time
+    :return: dict with keys "signal" and "background"
+    """
+    path = get_histogram_file(decay, var, range, bins, where=where, key=key, weight=weight)
+    if os.path.exists(path):
+        return load(path)
+
+    from misc.utils import iter_merged_df
+
+    low, high = range
+    in_range = f"{var} >= {float(low)!r} && {var} <= {float(high)!r}"
+    columns = [var, "isSignal"] + ([weight] if weight else [])
+    chunks = iter_merged_df(decay, key=key, where=in_range if where is None else f"[{where}] && {in_range}",
+                            columns=columns, chunksize=chunksize)
+    histograms = fill(chunks, var, range, bins, weight=weight)
+    save(path, histograms)
+    return histograms
@@ -0,0 +1,188 @@
+"""misc/kinematics.py
+Four-vector arithmetic on ntuple columns, so Mbc, deltaE and invariant masses can be recomputed offline under a
+different beam-energy assumption or with mass-constrained daughters, instead of reprocessing with basf2.
+Every operation works on whole columns at once: a FourVector holds one numpy array per component.
+The b0 tree stores the lab-frame four-vectors of the B (vc.kinematics: px, py, pz, E, ...) and of its J/psi and eta
+daughters (jpsi_*, eta_* aliases, see my_reconstruction/template.py).
+Usage:
+    df = get_merged_df(decay, columns=kinematic_columns(["", "jpsi", "eta"]))
+    recompute(df, masses={"jpsi": M_JPSI})  # J/psi mass-constrained Mbc and deltaE
+    recompute(df, beam=NOMINAL_BEAM.scaled(1.001))  # beam energies 0.1% higher
+    add_variation(decay, "jpsi_mc", masses={"jpsi": M_JPSI})  # stored as friend columns Mbc_jpsi_mc, ...
+"""
+from typing import Dict, List, Optional, Sequence
+
+import attr
+import numpy as np
+import pandas as pd
+
+# Masses in GeV, from the PDG
+M_ELECTRON = 0.51099895e-3
+M_B0 = 5.27966
+M_JPSI = 3.096900
+M_ETA = 0.547862
+M_PI0 = 0.1349768
+
+# Daughters of the B whose four-vectors are stored in the b0 tree, as alias prefixes
+DAUGHTERS = ["jpsi", "eta"]
+
+
+def _column(prefix: str, variable: str) -> str:
+    return f"{prefix}_{variable}" if prefix else variable
+
+
+def kinematic_columns(prefixes: Sequence[str] = ("",)) -> List[str]:
+    """
+    Columns holding the four-vectors of particles, e.g. ["px", "py", "pz", "E", "jpsi_px", ...] for ["", "jpsi"]
+    :param prefixes: Alias prefixes, "" for the candidate itself and "CMS" for its centre-of-mass four-vector
+    :return: List of column names
+    """
+    return [_column(prefix, v) for prefix in prefixes for v in ["px", "py", "pz", "E"]]
+
+
+@attr.s(frozen=True)
+class FourVector:
+    e: np.ndarray = attr.ib()
+    px: np.ndarray = attr.ib()
+    py: np.ndarray = attr.ib()
+    pz: np.ndarray = attr.ib()
+
+    @classmethod
+    def from_columns(cls, df: pd.DataFrame, prefix: str = "") -> "FourVector":
+        return cls(*(df[_column(prefix, v)].to_numpy(dtype=float) for v in ["E", "px", "py", "pz"]))
+
+    def __add__(self, other: "FourVector") -> "FourVector":
+        return FourVector(self.e + other.e, self.px + other.px, self.py + other.py, self.pz + other.pz)
+
+    def __sub__(self, other: "FourVector") -> "FourVector":
+        return FourVector(self.e - other.e, self.px - other.px, self.py - other.py, self.pz - other.pz)
+
+    @property
+    def p2(self) -> np.ndarray:
+        return self.px ** 2 + self.py ** 2 + self.pz ** 2
+
+    @property
+    def p(self) -> np.ndarray:
+        return np.sqrt(self.p2)
+
+    @property
+    def m2(self) -> np.ndarray:
+        return self.e ** 2 - self.p2
+
+    @property
+    def mass(self) -> np.ndarray:
+        """ Invariant mass, negative for space-like vectors as basf2's M """
+        m2 = self.m2
+        return np.sign(m2) * np.sqrt(np.abs(m2))
+
+    @property
+    def beta(self) -> np.ndarray:
+        """ Velocity, of shape (..., 3) """
+        return np.stack([self.px, self.py, self.pz], axis=-1) / np.asarray(self.e)[..., None]
+
+    def boost(self, beta: np.ndarray) -> "FourVector":
+        """
+        The same four-vectors seen from a frame moving with velocity beta
+        :param beta: Shape (3,), or (candidates, 3) for a different frame per candidate
+        :return: FourVector
+        """
+        beta = np.asarray(beta, dtype=float)
+        bx, by, bz = beta[..., 0], beta[..., 1], beta[..., 2]
+        b2 = bx ** 2 + by ** 2 + bz ** 2
+        gamma = 1 / np.sqrt(1 - b2)
+        bp = bx * self.px + by * self.py + bz * self.pz
+        with np.errstate(invalid="ignore", divide="ignore"):
+            coefficient = np.where(b2 > 0, (gamma - 1) * bp / b2, 0) - gamma * self.e
+        return FourVector(gamma * (self.e - bp), self.px + coefficient * bx, self.py + coefficient * by,
+                          self.pz + coefficient * bz)
+
+    def with_mass(self, mass: float) -> "FourVector":
+        """ Mass substitution: the same momentum, with the energy of a particle of the given mass """
+        return FourVector(np.sqrt(self.p2 + mass ** 2), self.px, self.py, self.pz)
+
+
+@attr.s(frozen=True)
+class Beam:
+    # Nominal SuperKEKB beams; the beams cross in the x-z plane, symmetric about the z axis
+    her_energy: float = attr.ib(default=7.004)
+    ler_energy: float = attr.ib(default=4.002)
+    crossing_angle: float = attr.ib(default=0.0830)
+
+    @property
+    def four_vector(self) -> FourVector:
+        """ Four-momentum of the e+e- system in the lab """
+        half = self.crossing_angle / 2
+        p_her = np.sqrt(self.her_energy ** 2 - M_ELECTRON ** 2)
+        p_ler = np.sqrt(self.ler_energy ** 2 - M_ELECTRON ** 2)
+        return FourVector(np.float64(self.her_energy + self.ler_energy), (p_her + p_ler) * np.sin(half),
+                          np.float64(0.0), (p_her - p_ler) * np.cos(half))
+
+    @property
+    def cms_beta(self) -> np.ndarray:
+        """ Velocity of the centre-of-mass frame in the lab """
+        return self.four_vector.beta
+
+    @property
+    def sqrt_s(self) -> float:
+        return float(self.four_vector.mass)
+
+    def scaled(self, factor: float) -> "Beam":
+        """ The same beams with both energies scaled, e.g. for a beam-energy systematic """
+        return attr.evolve(self, her_energy=self.her_energy * factor, ler_energy=self.ler_energy * factor)
+
+
+NOMINAL_BEAM = Beam()
+
+
+def mbc_delta_e(b: FourVector, beam: Beam = NOMINAL_BEAM) -> Dict[str, np.ndarray]:
+    """
+    Beam-constrained mass and energy difference of B candidates
+    Mbc = sqrt(E_beam*^2 - p_B*^2), deltaE = E_B* - E_beam*, with E_beam* = sqrt(s) / 2
+    :param b: Lab-frame four-vectors of the candidates
+    :param beam: Beam conditions
+    :return: dict with Mbc and deltaE
+    """
+    cms = b.boost(beam.cms_beta)
+    e_beam = beam.sqrt_s / 2
+    m2 = e_beam ** 2 - cms.p2
+    # basf2 returns a negative Mbc when the momentum exceeds the beam energy
+    return dict(Mbc=np.sign(m2) * np.sqrt(np.abs(m2)), deltaE=cms.e - e_beam)
+
+
+def recompute(df: pd.DataFrame, beam: Beam = NOMINAL_BEAM, masses: Optional[Dict[str, float]] = None,
+              suffix: str = "") -> pd.DataFrame:
+    """
+    Mbc, deltaE and invariant mass of B candidates, optionally with daughters constrained to a mass
+    :param df: DataFrame with the B four-vector, and that of every daughter in masses (see kinematic_columns)
+    :param beam: Beam conditions
+    :param masses: dict of daughter prefix to the mass it is substituted with, e.g. {"jpsi": M_JPSI}
+    :param suffix: Appended to the names of the output columns
+    :return: pandas DataFrame with Mbc, deltaE and M, aligned with df
+    """
+    b = FourVector.from_columns(df)
+    for prefix, mass in (masses or {}).items():
+        daughter = FourVector.from_columns(df, prefix)
+        b = b - daughter + daughter.with_mass(mass)
+    result = dict(mbc_delta_e(b, beam=beam), M=b.mass)
+    return pd.DataFrame({f"{name}{suffix}": values for name, values in result.items()}, index=df.index)
+
+
+def add_variation(decay: str, name: str, beam: Beam = NOMINAL_BEAM, masses: Optional[Dict[str, float]] = None,
+                  version: int = 1, chunksize: int = 100000) -> str:
+    """
+    Store recomputed Mbc, deltaE and M as friend columns Mbc_<name>, deltaE_<name> and M_<name> of the b0 tree,
+    see misc/friends.py
+    :param decay: The decay mode in question
+    :param name: Name of the variation, e.g. "jpsi_mc" or "beam_up"
+    :param beam: Beam conditions
+    :param masses: dict of daughter prefix to the mass it is substituted with
+    :param version: Version of the friend
+    :param chunksize: Number of candidates processed at a time
+    :return: Location of the friend file
+    """
+    from misc.friends import add_friend
+
+    inputs = kinematic_columns([""] + list(masses or {}))
+    return add_friend(decay, f"kinematics_{name}",
+                      lambda df: recompute(df, beam=beam, masses=masses, suffix=f"_{name}").reset_index(drop=True),
+                      inputs=inputs, version=version, chunksize=chunksize)
@@ -1,15 +1,22 @@
 """ Calculate predicted yields of B->J/psi eta events """
 from __future__ import annotations
 
+from typing import Optional
+
 from constants.mode_info import mode2latex
 
 
 # import pandas as pd
 
+# Default number of BB pairs. See misc/yield_scan.py for yields over a range of sample sizes, with uncertainties.
+NUM_BB = 200e6
+
 
-def predicted_info(decay: str) -> dict:
-    """ Calculate predicted signal yield given 200e6 BB pairs, for decay
+def predicted_info(decay: str, num_bb: float = NUM_BB, version: Optional[str] = None) -> dict:
+    """ Calculate predicted signal yield given num_bb BB pairs (default 200e6), for decay
     :param decay: The decay mode you want information for
+    :param num_bb: Number of BB pairs
+    :param version: Version of the mode's efficiency inputs (EFFICIENCIES.versions), default the current one
     :return: dict with the following keys:
     {num_bb: the number of BB pairs used in calculation,
      b2jpsieta: BF of B decay,
@@ -20,18 +27,17 @@ def predicted_info(decay: str) -> dict:
      latex: LaTeX string of decay mode}
     """
     from constants import branching_ratios as br
-    from efficiencies import detection
+    from efficiencies.service import EFFICIENCIES
 
-    num_bb = 200e6
     b2jpsieta = br.b02jpsi_eta[0]
     jpsi, eta = decay.split("_")
     jpsi = getattr(br, jpsi)[0]
     eta = getattr(br, eta)[0]
-    det = detection.DetectionEfficiencyRow(decay).eff
+    det = EFFICIENCIES.eff(decay, version)
     tot = num_bb * b2jpsieta * jpsi * eta * det
 
     info = dict(
-        num_bb=num_bb, b2jpsieta=b2jpsieta, jpsi=jpsi, eta=eta, det=det, tot=tot, latex=f"${mode2latex[decay]}$"
+        num_bb=float(num_bb), b2jpsieta=b2jpsieta, jpsi=jpsi, eta=eta, det=det, tot=tot, latex=f"${mode2latex[decay]}$"
     )
     return info
 
@@ -40,8 +46,11 @@ def table() -> pd.DataFrame:
     """Quick function to print and return a pandas DataFrame with predicted yield/BF information for all decay
     considered in this analysis."""
     import pandas as pd
+    from efficiencies.service import EFFICIENCIES
 
-    rows = [predicted_info(decay) for decay in mode2latex]
+    versions = EFFICIENCIES.versions(mode2latex)
+    EFFICIENCIES.prefetch(mode2latex, versions=versions)
+    rows = [predicted_info(decay, version=versions[decay]) for decay in mode2latex]
     df = pd.DataFrame(rows)
     print(df["latex tot".split()])
     return df
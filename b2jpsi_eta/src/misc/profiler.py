@@ -0,0 +1,267 @@
+"""misc/profiler.py
+One-pass profile of every column of an ntuple, for validating production outputs: counts, NaN/inf counts, min/max,
+mean/std and approximate quantiles.
+Every statistic is mergeable: moments are combined with Chan's parallel form of Welford's algorithm, and quantiles
+come from a DDSketch (log-spaced buckets with a fixed relative accuracy), whose buckets simply add. So per-job
+profiles combine into the profile of the merged file without reading anything again.
+Usage:
+    $ python misc/profiler.py <decay> [<decay>,...]  # writes the summary next to the Parquet cache
+    profile = profile_merged("jpsi2ee_eta2gammagamma"); profile.to_frame()
+    sum(profile_file(path) for path in get_reconstructed_files(decay))  # same statistics, per job
+"""
+import json
+from typing import Dict, Iterable, Optional, Sequence
+
+import attr
+import numpy as np
+import pandas as pd
+
+# Quantiles reported in summaries
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+# Relative accuracy of the quantile sketches
+RELATIVE_ACCURACY = 0.01
+
+
+def _add_counts(index: np.ndarray, count: np.ndarray, new_index: np.ndarray, new_count: np.ndarray):
+    """ Sum two sparse histograms given as (sorted bucket indices, counts) """
+    index = np.concatenate([index, new_index])
+    count = np.concatenate([count, new_count])
+    unique, inverse = np.unique(index, return_inverse=True)
+    return unique, np.bincount(inverse, weights=count, minlength=len(unique)).astype(np.int64)
+
+
+def merge_moments(n_a: int, mean_a: float, m2_a: float, n_b: int, mean_b: float, m2_b: float):
+    """
+    Combine the moments of two samples (Chan et al.), where m2 is the sum of squared deviations from the mean
+    :return: Tuple (n, mean, m2) of the union
+    """
+    n = n_a + n_b
+    if n == 0:
+        return 0, 0.0, 0.0
+    delta = mean_b - mean_a
+    return n, mean_a + delta * n_b / n, m2_a + m2_b + delta ** 2 * n_a * n_b / n
+
+
+@attr.s
+class DDSketch:
+    relative_accuracy: float = attr.ib(default=RELATIVE_ACCURACY)
+    # Buckets of positive values and of the magnitude of negative values: bucket i holds (gamma^(i-1), gamma^i]
+    positive_index: np.ndarray = attr.ib(factory=lambda: np.empty(0, dtype=np.int64))
+    positive_count: np.ndarray = attr.ib(factory=lambda: np.empty(0, dtype=np.int64))
+    negative_index: np.ndarray = attr.ib(factory=lambda: np.empty(0, dtype=np.int64))
+    negative_count: np.ndarray = attr.ib(factory=lambda: np.empty(0, dtype=np.int64))
+    zero_count: int = attr.ib(default=0)
+
+    @property
+    def gamma(self) -> float:
+        return (1 + self.relative_accuracy) / (1 - self.relative_accuracy)
+
+    def _buckets(self, magnitudes: np.ndarray):
+        index = np.ceil(np.log(magnitudes) / np.log(self.gamma)).astype(np.int64)
+        return np.unique(index, return_counts=True)
+
+    def add(self, values: np.ndarray) -> None:
+        """ Add finite values """
+        positive, negative = values[values > 0], values[values < 0]
+        self.zero_count += int(len(values) - len(positive) - len(negative))
+        if len(positive):
+            self.positive_index, self.positive_count = _add_counts(self.positive_index, self.positive_count,
+                                                                   *self._buckets(positive))
+        if len(negative):
+            self.negative_index, self.negative_count = _add_counts(self.negative_index, self.negative_count,
+                                                                   *self._buckets(-negative))
+
+    def __add__(self, other: "DDSketch") -> "DDSketch":
+        if self.relative_accuracy != other.relative_accuracy:
+            raise ValueError("Can only merge sketches with the same relative accuracy")
+        positive = _add_counts(self.positive_index, self.positive_count, other.positive_index, other.positive_count)
+        negative = _add_counts(self.negative_index, self.negative_count, other.negative_index, other.negative_count)
+        return DDSketch(self.relative_accuracy, *positive, *negative, zero_count=self.zero_count + other.zero_count)
+
+    def quantiles(self, q: Sequence[float]) -> np.ndarray:
+        """ Approximate quantiles, each within relative_accuracy of a value of the right rank """
+        gamma = self.gamma
+        # All buckets in increasing order of value: negatives from the largest magnitude, zero, then positives
+        values = np.concatenate([
+            -2 * gamma ** self.negative_index[::-1] / (gamma + 1),
+            [0.0],
+            2 * gamma ** self.positive_index / (gamma + 1),
+        ])
+        counts = np.concatenate([self.negative_count[::-1], [self.zero_count], self.positive_count])
+        total = counts.sum()
+        if total == 0:
+            return np.full(len(q), np.nan)
+        ranks = np.asarray(q) * (total - 1)
+        return values[np.searchsorted(np.cumsum(counts), ranks, side="right")]
+
+    def to_dict(self) -> dict:
+        return dict(relative_accuracy=self.relative_accuracy, zero_count=self.zero_count,
+                    positive=[self.positive_index.tolist(), self.positive_count.tolist()],
+                    negative=[self.negative_index.tolist(), self.negative_count.tolist()])
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "DDSketch":
+        arrays = [np.asarray(x, dtype=np.int64) for x in d["positive"] + d["negative"]]
+        return cls(d["relative_accuracy"], *arrays, zero_count=d["zero_count"])
+
+
+@attr.s
+class ColumnProfile:
+    count: int = attr.ib(default=0)
+    n_nan: int = attr.ib(default=0)
+    n_posinf: int = attr.ib(default=0)
+    n_neginf: int = attr.ib(default=0)
+    min: float = attr.ib(default=np.inf)
+    max: float = attr.ib(default=-np.inf)
+    # Moments of the finite values
+    n: int = attr.ib(default=0)
+    mean: float = attr.ib(default=0.0)
+    m2: float = attr.ib(default=0.0)
+    sketch: DDSketch = attr.ib(factory=DDSketch)
+
+    def update(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=float)
+        finite = values[np.isfinite(values)]
+        self.count += len(values)
+        self.n_nan += int(np.isnan(values).sum())
+        self.n_posinf += int(np.isposinf(values).sum())
+        self.n_neginf += int(np.isneginf(values).sum())
+        if not len(finite):
+            return
+        self.min = min(self.min, float(finite.min()))
+        self.max = max(self.max, float(finite.max()))
+        self._merge_moments(len(finite), float(finite.mean()), float(np.square(finite - finite.mean()).sum()))
+        self.sketch.add(finite)
+
+    def _merge_moments(self, n: int, mean: float, m2: float) -> None:
+        self.n, self.mean, self.m2 = merge_moments(self.n, self.mean, self.m2, n, mean, m2)
+
+    def __add__(self, other: "ColumnProfile") -> "ColumnProfile":
+        merged = ColumnProfile(count=self.count + other.count, n_nan=self.n_nan + other.n_nan,
+                               n_posinf=self.n_posinf + other.n_posinf, n_neginf=self.n_neginf + other.n_neginf,
+                               min=min(self.min, other.min), max=max(self.max, other.max),
+                               n=self.n, mean=self.mean, m2=self.m2, sketch=self.sketch + other.sketch)
+        merged._merge_moments(other.n, other.mean, other.m2)
+        return merged
+
+    @property
+    def std(self) -> float:
+        """ Sample standard deviation of the finite values, as pandas.Series.std """
+        return float(np.sqrt(self.m2 / (self.n - 1))) if self.n > 1 else np.nan
+
+    def summary(self, quantiles: Sequence[float] = QUANTILES) -> dict:
+        summary = dict(count=self.count, nan=self.n_nan, posinf=self.n_posinf, neginf=self.n_neginf,
+                       min=self.min if self.n else np.nan, max=self.max if self.n else np.nan,
+                       mean=self.mean if self.n else np.nan, std=self.std)
+        summary.update({f"q{100 * q:g}": value for q, value in zip(quantiles, self.sketch.quantiles(quantiles))})
+        return summary
+
+    def to_dict(self) -> dict:
+        d = attr.asdict(self, recurse=False)
+        d["sketch"] = self.sketch.to_dict()
+        return d
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "ColumnProfile":
+        return cls(**dict(d, sketch=DDSketch.from_dict(d["sketch"])))
+
+
+@attr.s
+class Profile:
+    columns: Dict[str, ColumnProfile] = attr.ib(factory=dict)
+
+    def update(self, df: pd.DataFrame) -> None:
+        for column in df.columns:
+            if df[column].dtype.kind in "biuf":
+                self.columns.setdefault(column, ColumnProfile()).update(df[column].to_numpy())
+
+    def __add__(self, other: "Profile") -> "Profile":
+        names = list(dict.fromkeys(list(self.columns) + list(other.columns)))
+        return Profile({c: self.columns.get(c, ColumnProfile()) + other.columns.get(c, ColumnProfile())
+                        for c in names})
+
+    def __radd__(self, other):
+        # So that sum() over profiles works
+        return self if other == 0 else self + other
+
+    def to_frame(self, quantiles: Sequence[float] = QUANTILES) -> pd.DataFrame:
+        """ One row of summary statistics per column """
+        return pd.DataFrame.from_dict({c: p.summary(quantiles) for c, p in self.columns.items()}, orient="index")
+
+    def save(self, path: str) -> None:
+        """ Compact JSON with everything needed to merge the profile further """
+        import os
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({c: p.to_dict() for c, p in self.columns.items()}, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Profile":
+        with open(path) as f:
+            return cls({c: ColumnProfile.from_dict(d) for c, d in json.load(f).items()})
+
+
+def profile_chunks(chunks: Iterable[pd.DataFrame]) -> Profile:
+    profile = Profile()
+    for chunk in chunks:
+        profile.update(chunk)
+    return profile
+
+
+def profile_file(path: str, key: str = "b0", chunksize: int = 100000) -> Profile:
+    """ Profile of one .root file, e.g. the output of one reconstruction job """
+    import root_pandas
+    return profile_chunks(root_pandas.read_root(path, key=key, chunksize=chunksize))
+
+
+def profile_merged(decay: str, key: str = "b0", columns: Optional[Sequence[str]] = None,
+                   chunksize: int = 100000) -> Profile:
+    """
+    Profile of a merged file, in one streaming pass
+    :param decay: The decay mode in question
+    :param key: The tree within the .root file
+    :param columns: Columns to profile, defaults to all
+    :param chunksize: Number of entries read at a time
+    :return: Profile
+    """
+    from misc.utils import iter_merged_df
+    columns = None if columns is None else list(columns)
+    return profile_chunks(iter_merged_df(decay, key=key, columns=columns, chunksize=chunksize))
+
+
+def profile_reconstructed(decay: str, key: str = "b0", max_workers: Optional[int] = None) -> Profile:
+    """ Profile of a mode made from its per-job reconstruction outputs in parallel, then merged """
+    import functools
+    from concurrent.futures import ProcessPoolExecutor
+    from misc.utils import get_reconstructed_files
+
+    paths = get_reconstructed_files(decay=decay)
+    if not paths:
+        raise FileNotFoundError(f"No reconstructed files found for {decay}")
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return sum(pool.map(functools.partial(profile_file, key=key), paths), Profile())
+
+
+def get_profile_file(decay: str, key: str = "b0") -> str:
+    import os
+    from constants.locations import CACHE_DIR
+    from misc.columnar import fingerprint
+    from misc.utils import get_merged_file
+
+    return os.path.join(CACHE_DIR, decay, f"{key}_{fingerprint(get_merged_file(decay=decay))}.profile.json")
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    for decay in sys.argv[1:]:
+        path = get_profile_file(decay)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        profile = profile_merged(decay)
+        profile.save(path)
+        print(f"Profile of {decay}: {path}")
+        with pd.option_context("display.max_rows", None, "display.width", 250):
+            print(profile.to_frame())
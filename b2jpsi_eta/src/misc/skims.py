@@ -0,0 +1,175 @@
+"""misc/skims.py
+Skims: slim Parquet derivatives of a merged tree holding only the candidates passing a named selection, and
+optionally only some columns, so studies that always start from the same tighter selection don't re-read the
+full merged file.
+A skim file is named after a hash of its definition and of its inputs (the merged file and any friend it reads,
+see misc/friends.py), so it is rebuilt exactly when the selection or the inputs change.
+Usage:
+    $ python misc/skims.py <skim> [<decay>,...]  # derive ahead of time
+    get_merged_df("jpsi2ee_eta2gammagamma", skim="signal_box", columns=["Mbc"], where="isSignal")
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import attr
+import pandas as pd
+
+from selection.cuts import cut_variables, where_mask
+from selection.signal_box import DEFAULT_BOX, box_where
+
+
+@attr.s(frozen=True)
+class Skim:
+    name: str = attr.ib()
+    where: Optional[str] = attr.ib(default=None)
+    # Columns kept, defaults to all
+    columns: Optional[Tuple[str, ...]] = attr.ib(default=None, converter=lambda c: None if c is None else tuple(c))
+    key: str = attr.ib(default="b0")
+
+    @property
+    def digest(self) -> str:
+        """ Hash of the definition (not the name), so editing a skim gives a new file """
+        definition = json.dumps([self.where, self.columns, self.key])
+        return hashlib.sha1(definition.encode()).hexdigest()[:12]
+
+
+SKIMS: Dict[str, Skim] = {
+    "signal_box": Skim("signal_box", where=box_where(DEFAULT_BOX)),
+    # The region plot_joint draws background from
+    "sideband": Skim("sideband", where="deltaE < -0.2 && deltaE > -5 && Mbc > 4.5"),
+    "fit": Skim("fit", where="Mbc > 5.2 && abs(deltaE) < 0.3",
+                columns=["__experiment__", "__run__", "__event__", "Mbc", "deltaE", "isSignal"]),
+}
+
+
+def get_skim(skim: Union[str, Skim]) -> Skim:
+    if isinstance(skim, Skim):
+        return skim
+    if skim not in SKIMS:
+        raise KeyError(f"Unknown skim {skim!r}, expected one of {sorted(SKIMS)}")
+    return SKIMS[skim]
+
+
+def get_skim_file(decay: str, skim: Union[str, Skim]) -> str:
+    """
+    Location of a skim of a merged file
+    :param decay: The decay mode in question
+    :param skim: Name of a skim in SKIMS, or a Skim
+    :return: A string representing the location of the skim file
+    """
+    from constants.locations import CACHE_DIR
+    from misc.friends import inputs_digest
+
+    skim = get_skim(skim)
+    columns = None if skim.columns is None else list(skim.columns)
+    name = f"{skim.name}_{skim.key}_{skim.digest}_{inputs_digest(decay, skim.key, columns, skim.where)}.parquet"
+    return os.path.join(CACHE_DIR, decay, "skims", name)
+
+
+def derive(decay: str, skim: Union[str, Skim], chunksize: int = 500000) -> str:
+    """
+    Write a skim, unless an up-to-date one already exists. The merged tree is streamed, so memory use is bounded.
+    :param decay: The decay mode in question
+    :param skim: Name of a skim in SKIMS, or a Skim
+    :param chunksize: Number of candidates read at a time
+    :return: Location of the skim file
+    """
+    skim = get_skim(skim)
+    path = get_skim_file(decay, skim)
+    if os.path.exists(path):
+        return path
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from misc.columnar import ROW_GROUP_SIZE
+    from misc.utils import get_merged_df, iter_merged_df
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Skims of the same name made from another definition or older inputs are never read again. The two hashes
+    # are matched exactly, so the files of a skim whose name starts with this one's are left alone.
+    own = re.compile(re.escape(f"{skim.name}_{skim.key}_") + r"[0-9a-f]{12}_[0-9a-f]{12}\.parquet")
+    for stale in glob.glob(os.path.join(directory, f"{skim.name}_{skim.key}_*.parquet")):
+        if stale != path and own.fullmatch(os.path.basename(stale)):
+            os.remove(stale)
+
+    columns = None if skim.columns is None else list(skim.columns)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    writer = None
+    for chunk in iter_merged_df(decay, key=skim.key, where=skim.where, columns=columns, chunksize=chunksize):
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(tmp_path, table.schema)
+        writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+    if writer is None:
+        # Nothing passes (or every row group was skipped): still record the columns and their types
+        empty = get_merged_df(decay, key=skim.key, where=skim.where, columns=columns, memoize=False)
+        pq.write_table(pa.Table.from_pandas(empty, preserve_index=False), tmp_path)
+    else:
+        writer.close()
+    os.replace(tmp_path, path)
+    return path
+
+
+def _columns_to_read(skim: Skim, columns: Optional[List[str]], where: Optional[str]) -> Optional[List[str]]:
+    """ Columns to read from a skim file, checked against those the skim keeps """
+    needed = list(dict.fromkeys(list(columns or []) + cut_variables(where)))
+    dropped = [] if skim.columns is None else [c for c in needed if c not in skim.columns]
+    if dropped:
+        raise ValueError(f"Skim {skim.name!r} doesn't keep columns {dropped}; it keeps {list(skim.columns)}")
+    return None if columns is None else needed
+
+
+def _finish(df: pd.DataFrame, columns: Optional[List[str]], where: Optional[str]) -> pd.DataFrame:
+    if where is not None:
+        df = df[where_mask(df, where)].reset_index(drop=True)
+    return df if columns is None else df[list(columns)]
+
+
+def read_skim(decay: str, skim: Union[str, Skim], where: Optional[str] = None,
+              columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Read a skim (derived on first use), with further cuts and a column subset
+    :param decay: The decay mode in question
+    :param skim: Name of a skim in SKIMS, or a Skim
+    :param where: Optional cuts on top of the skim selection
+    :param columns: Columns you want, among those kept by the skim
+    :return: pandas DataFrame
+    """
+    import pyarrow.parquet as pq
+    from misc.zone_map import parquet_row_groups
+
+    skim = get_skim(skim)
+    to_read = _columns_to_read(skim, columns, where)
+    parquet_file = pq.ParquetFile(derive(decay, skim))
+    row_groups = range(parquet_file.num_row_groups) if where is None else parquet_row_groups(parquet_file, where)
+    df = parquet_file.read_row_groups(list(row_groups), columns=to_read).to_pandas()
+    return _finish(df, columns, where)
+
+
+def iter_skim(decay: str, skim: Union[str, Skim], where: Optional[str] = None, columns: Optional[List[str]] = None,
+              chunksize: int = 100000) -> Iterator[pd.DataFrame]:
+    """ Chunked version of read_skim """
+    import pyarrow.parquet as pq
+    from misc.zone_map import parquet_row_groups
+
+    skim = get_skim(skim)
+    to_read = _columns_to_read(skim, columns, where)
+    parquet_file = pq.ParquetFile(derive(decay, skim))
+    row_groups = None if where is None else parquet_row_groups(parquet_file, where)
+    for batch in parquet_file.iter_batches(batch_size=chunksize, row_groups=row_groups, columns=to_read):
+        yield _finish(batch.to_pandas(), columns, where)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from constants.mode_info import mode2latex
+
+    name, *decays = sys.argv[1:]
+    for decay in decays or mode2latex:
+        print(f"Skim {name} of {decay}: {derive(decay, name)}")
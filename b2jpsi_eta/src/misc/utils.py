@@ -2,7 +2,7 @@
 Generally handy stuff for the analysis
 """
 
-from typing import Optional, List
+from typing import Iterator, Optional, List
 
 import pandas as pd
 
@@ -20,16 +20,212 @@ def get_merged_file(decay: str) -> str:
 
 
 def get_merged_df(decay: str, key: Optional[str] = "b0", where: Optional[str] = None,
-                  columns: Optional[List[str]] = None) -> pd.DataFrame:
+                  columns: Optional[List[str]] = None, cache: bool = True, memoize: bool = True,
+                  compact: bool = False, skim: Optional[str] = None) -> pd.DataFrame:
     """
     Returns a pandas DataFrame for the merged .root file of the specified decay
     :param decay: The decay you want
     :param key: The tree within the .root file you want
     :param where: Optional cuts to apply before returning
     :param columns: Columns you want in the DataFrame
+    :param cache: Read through the Parquet cache of the merged file (see misc/columnar.py) instead of the .root file.
+    Requests needing only the hot columns are served memory-mapped from misc/column_store.py, friend
+    columns (misc/friends.py) are joined in and event-level columns of normalized files (misc/event_table.py)
+    are broadcast onto the candidates
+    :param memoize: Share results through the process-wide cache in misc/df_cache.py. The returned DataFrame
+    then shares its values with the cached one, so don't modify them in place.
+    :param compact: Downcast every float to float32, and flags/integers to bool/small integers (see misc/dtypes.py).
+    The memory saved per column is reported in df.attrs["compact_report"]
+    :param skim: Read from a skim (see misc/skims.py) instead of the full tree: the name of a skim in
+    misc.skims.SKIMS, or a misc.skims.Skim. It is derived on first use, and again whenever it is out of date.
     :return: pandas DataFrame
     """
+    if skim is not None:
+        from misc.skims import get_skim
+        skim = get_skim(skim)
+        if key != skim.key:
+            raise ValueError(f"Skim {skim.name!r} is of tree {skim.key!r}, not {key!r}")
+
+    if memoize:
+        import functools
+        from misc.df_cache import DF_CACHE
+        loader = functools.partial(get_merged_df, cache=cache, memoize=False, compact=compact, skim=skim)
+        profile = "compact" if compact else ""
+        if skim is not None:
+            profile += f"skim:{skim.name}:{skim.digest}"
+        df = DF_CACHE.get(decay, key, columns, where, loader=loader, profile=profile)
+        if compact:
+            # A hit may be sliced from a larger cached DataFrame, whose report describes that one
+            from misc.dtypes import slice_report
+            df.attrs = dict(df.attrs, compact_report=slice_report(df.attrs["compact_report"], df))
+        return df
+
+    if compact:
+        from misc.dtypes import compact_dtypes
+        df, report = compact_dtypes(get_merged_df(decay, key=key, where=where, columns=columns, cache=cache,
+                                                  memoize=False, skim=skim))
+        df.attrs["compact_report"] = report
+        return df
+
+    if skim is not None:
+        from misc.skims import read_skim
+        return read_skim(decay, skim, where=where, columns=columns)
+
+    if cache:
+        from misc import friends
+        needed = friends.needed_friends(decay, key, columns, where)
+        if needed:
+            return friends.read_with_friends(decay, key, where, columns, needed, reader=_read_cached_tree)
+        return _read_cached_tree(decay=decay, key=key, where=where, columns=columns)
+
     import root_pandas
     path = get_merged_file(decay=decay)
     df = root_pandas.read_root(path, key=key, columns=columns, where=where)
     return df
+
+
+def merged_columns(decay: str, key: str = "b0") -> List[str]:
+    """
+    Names of the columns get_merged_df can return for a tree: those of the Parquet cache, of its friends and, for
+    candidate trees of normalized files, the event columns
+    :param decay: The decay mode in question
+    :param key: The tree within the .root file
+    :return: List of column names
+    """
+    import pyarrow.parquet as pq
+    from misc.columnar import build_cache
+    from misc.event_table import EVENT_KEY, event_columns
+    from misc.friends import friend_columns
+
+    names = pq.ParquetFile(build_cache(decay=decay, key=key)).schema_arrow.names
+    names += list(friend_columns(decay=decay, key=key))
+    if key != EVENT_KEY:
+        names += event_columns(decay)
+    return list(dict.fromkeys(names))
+
+
+def _read_cached_tree(decay: str, key: str, where: Optional[str], columns: Optional[List[str]]) -> pd.DataFrame:
+    from misc import event_table
+    needed = event_table.needed_event_columns(decay, key, columns, where)
+    if needed:
+        return event_table.read_with_events(decay, key, where, columns, needed, reader=_read_cached_columns)
+    return _read_cached_columns(decay=decay, key=key, where=where, columns=columns)
+
+
+def _read_cached_columns(decay: str, key: str, where: Optional[str], columns: Optional[List[str]]) -> pd.DataFrame:
+    from misc import column_store
+    if column_store.covers(columns, where):
+        return column_store.read_columns(decay=decay, key=key, where=where, columns=columns)
+
+    from misc.columnar import read_cached
+    return read_cached(decay=decay, key=key, where=where, columns=columns)
+
+
+def _iter_cached_tree(decay: str, key: str, where: Optional[str], columns: Optional[List[str]],
+                      chunksize: int) -> Iterator[pd.DataFrame]:
+    from misc import event_table
+    needed = event_table.needed_event_columns(decay, key, columns, where)
+    if needed:
+        return event_table.iter_with_events(decay, key, where, columns, needed, iterator=_iter_cached_columns,
+                                            chunksize=chunksize)
+    return _iter_cached_columns(decay=decay, key=key, where=where, columns=columns, chunksize=chunksize)
+
+
+def _iter_cached_columns(decay: str, key: str, where: Optional[str], columns: Optional[List[str]],
+                         chunksize: int) -> Iterator[pd.DataFrame]:
+    from misc import column_store
+    if column_store.covers(columns, where):
+        return column_store.iter_columns(decay=decay, key=key, where=where, columns=columns, chunksize=chunksize)
+
+    from misc.columnar import iter_cached
+    return iter_cached(decay=decay, key=key, where=where, columns=columns, chunksize=chunksize)
+
+
+def iter_merged_df(decay: str, key: Optional[str] = "b0", where: Optional[str] = None,
+                   columns: Optional[List[str]] = None, chunksize: int = 100000,
+                   cache: bool = True, skim: Optional[str] = None) -> Iterator[pd.DataFrame]:
+    """
+    Like get_merged_df, but yields the tree in chunks so memory use doesn't grow with the size of the file
+    :param decay: The decay you want
+    :param key: The tree within the .root file you want
+    :param where: Optional cuts, applied to each chunk
+    :param columns: Columns you want in each chunk
+    :param chunksize: Number of entries read at a time
+    :param cache: Read through the Parquet cache of the merged file (see misc/columnar.py) instead of the .root file
+    :param skim: Read from a skim instead of the full tree, see get_merged_df
+    :return: Generator of pandas DataFrames
+    """
+    if skim is not None:
+        from misc.skims import get_skim, iter_skim
+        if key != get_skim(skim).key:
+            raise ValueError(f"Skim {get_skim(skim).name!r} is of tree {get_skim(skim).key!r}, not {key!r}")
+        yield from iter_skim(decay, skim, where=where, columns=columns, chunksize=chunksize)
+        return
+
+    if cache:
+        from misc import friends
+        needed = friends.needed_friends(decay, key, columns, where)
+        if needed:
+            yield from friends.iter_with_friends(decay, key, where, columns, needed, iterator=_iter_cached_tree,
+                                                 chunksize=chunksize)
+        else:
+            yield from _iter_cached_tree(decay=decay, key=key, where=where, columns=columns, chunksize=chunksize)
+        return
+
+    import root_pandas
+    path = get_merged_file(decay=decay)
+    yield from root_pandas.read_root(path, key=key, columns=columns, where=where, chunksize=chunksize)
+
+
+def get_reconstructed_files(decay: str) -> List[str]:
+    """
+    Returns the per-job reconstruction outputs for the supplied mode (the inputs to the hadd in
+    snakefiles/perform_reconstruction.snake), ordered by job number as hadd would merge them
+    :param decay: The decay mode in question
+    :return: List of file locations
+    """
+    import glob
+    import os
+    import re
+    from constants.locations import RECONSTRUCTED_FILES
+    pattern = re.compile(re.escape(decay) + r"_(\d+)\.root$")
+    jobs = []
+    for path in glob.glob(os.path.join(RECONSTRUCTED_FILES, f"{decay}_*.root")):
+        match = pattern.search(os.path.basename(path))
+        if match is not None:
+            jobs.append((int(match.group(1)), path))
+    return [path for _, path in sorted(jobs)]
+
+
+def _read_root_file(path: str, key: str, where: Optional[str], columns: Optional[List[str]]) -> pd.DataFrame:
+    import root_pandas
+    return root_pandas.read_root(path, key=key, columns=columns, where=where)
+
+
+def get_reconstructed_df(decay: str, key: Optional[str] = "b0", where: Optional[str] = None,
+                         columns: Optional[List[str]] = None, max_workers: Optional[int] = None,
+                         use_threads: bool = False) -> pd.DataFrame:
+    """
+    Same as get_merged_df, but reads the per-job reconstruction outputs concurrently instead of the merged file,
+    so ad-hoc analysis can start before (or without) the hadd step
+    :param decay: The decay you want
+    :param key: The tree within the .root files you want
+    :param where: Optional cuts to apply, per file, before concatenating
+    :param columns: Columns you want in the DataFrame
+    :param max_workers: Number of files read at once, defaults to the number of cores
+    :param use_threads: Use a thread pool rather than a process pool
+    :return: pandas DataFrame, with entries in the same order as the merged file
+    """
+    import functools
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    paths = get_reconstructed_files(decay=decay)
+    if not paths:
+        raise FileNotFoundError(f"No reconstructed files found for {decay}")
+
+    read = functools.partial(_read_root_file, key=key, where=where, columns=columns)
+    executor = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+    with executor(max_workers=max_workers) as pool:
+        # map keeps the job order, so the result matches the hadd-merged file
+        frames = list(pool.map(read, paths))
+    return pd.concat(frames, ignore_index=True)
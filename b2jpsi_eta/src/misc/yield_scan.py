@@ -0,0 +1,129 @@
+"""misc/yield_scan.py
+Expected signal yields of every mode over a grid of sample sizes, with the branching ratio uncertainties in
+constants/branching_ratios.py propagated by toys. Everything is one broadcast product of NumPy arrays of shape
+(modes, scenarios, toys), so thousands of toys over dozens of scenarios take milliseconds.
+Branching ratios shared between modes (the B0 decay, each J/psi and eta decay) take the same value in a toy, so the
+modes stay correlated the way they are in reality.
+Usage:
+    scan = scan_yields(n_bb=lumi_to_n_bb(np.array([50, 200, 1000, 5000])))
+    scan.bands()  # pandas DataFrame with the median and 68% band per mode and scenario
+"""
+from typing import Dict, List, Optional, Sequence
+
+import attr
+import numpy as np
+import pandas as pd
+
+from constants.mode_info import mode2latex
+
+# BB pairs per fb^-1 at the Upsilon(4S), from a cross-section of 1.1 nb
+BB_PER_INVERSE_FB = 1.1e6
+
+
+def lumi_to_n_bb(lumi: np.ndarray) -> np.ndarray:
+    """
+    Number of BB pairs in a data set
+    :param lumi: Integrated luminosity in fb^-1
+    :return: numpy array
+    """
+    return np.asarray(lumi, dtype=float) * BB_PER_INVERSE_FB
+
+
+def branching_ratio_names(decay: str) -> List[str]:
+    """ Names in constants/branching_ratios.py of the branching ratios whose product gives a mode's yield """
+    jpsi, eta = decay.split("_")
+    return ["b02jpsi_eta", jpsi, eta]
+
+
+def sample_branching_ratios(names: Sequence[str], n_toys: int, rng: np.random.Generator) -> Dict[str, np.ndarray]:
+    """
+    Gaussian toys of branching ratios, truncated at zero
+    :param names: Names in constants/branching_ratios.py
+    :param n_toys: Toys per branching ratio
+    :param rng: numpy random generator
+    :return: dict of name to array of n_toys values
+    """
+    from constants import branching_ratios as br
+
+    central = np.array([getattr(br, name)[0] for name in names])
+    sigma = np.array([getattr(br, name)[1] for name in names])
+    toys = np.maximum(central[:, None] + sigma[:, None] * rng.standard_normal((len(names), n_toys)), 0)
+    return dict(zip(names, toys))
+
+
+@attr.s
+class YieldScan:
+    modes: List[str] = attr.ib()
+    n_bb: np.ndarray = attr.ib()
+    # Expected yields, shape (modes, scenarios, toys)
+    yields: np.ndarray = attr.ib()
+    # Yields with every branching ratio at its central value, shape (modes, scenarios)
+    central: np.ndarray = attr.ib()
+
+    def quantiles(self, q: Sequence[float]) -> np.ndarray:
+        """
+        Quantiles of the yield over toys
+        :param q: Quantiles, between 0 and 1
+        :return: numpy array of shape (len(q), modes, scenarios)
+        """
+        return np.quantile(self.yields, q, axis=-1)
+
+    def bands(self, coverage: float = 0.6827) -> pd.DataFrame:
+        """
+        Central value, median and central band of the yield of each mode in each scenario
+        :param coverage: Fraction of toys inside the band
+        :return: pandas DataFrame with one row per (mode, scenario)
+        """
+        low, median, high = self.quantiles([(1 - coverage) / 2, 0.5, (1 + coverage) / 2])
+        n_modes, n_scenarios = self.central.shape
+        return pd.DataFrame(dict(
+            decay=np.repeat(self.modes, n_scenarios),
+            num_bb=np.tile(self.n_bb, n_modes),
+            central=self.central.ravel(),
+            median=median.ravel(),
+            low=low.ravel(),
+            high=high.ravel(),
+        ))
+
+
+def scan_yields(n_bb: Optional[np.ndarray] = None, modes: Optional[Sequence[str]] = None, n_toys: int = 10000,
+                efficiencies: Optional[Dict[str, float]] = None, seed: Optional[int] = None) -> YieldScan:
+    """
+    Expected yields for every mode, sample size and branching ratio toy
+    :param n_bb: Numbers of BB pairs to scan, defaults to the 200e6 of misc/predicted_yields.py
+    :param modes: Decay modes, defaults to all modes of the analysis
+    :param n_toys: Number of branching ratio toys
+    :param efficiencies: Detection efficiency per mode, defaults to efficiencies/service.py
+    :param seed: Seed of the toys
+    :return: YieldScan
+    """
+    from constants import branching_ratios as br
+    from misc.predicted_yields import NUM_BB
+
+    modes = list(mode2latex if modes is None else modes)
+    n_bb = np.atleast_1d(np.asarray([NUM_BB] if n_bb is None else n_bb, dtype=float))
+    if efficiencies is None:
+        from efficiencies.service import EFFICIENCIES
+        versions = EFFICIENCIES.versions(modes)
+        EFFICIENCIES.prefetch(modes, versions=versions)
+        efficiencies = {decay: EFFICIENCIES.eff(decay, versions[decay]) for decay in modes}
+    eff = np.array([efficiencies[decay] for decay in modes])
+
+    names = [branching_ratio_names(decay) for decay in modes]
+    distinct = list(dict.fromkeys(name for mode_names in names for name in mode_names))
+    toys = sample_branching_ratios(distinct, n_toys, np.random.default_rng(seed))
+    # (modes, toys): product of each mode's branching ratios, toy by toy
+    product = np.stack([np.prod([toys[name] for name in mode_names], axis=0) for mode_names in names])
+    central = np.array([np.prod([getattr(br, name)[0] for name in mode_names]) for mode_names in names])
+
+    yields = eff[:, None, None] * n_bb[None, :, None] * product[:, None, :]
+    return YieldScan(modes=modes, n_bb=n_bb, yields=yields, central=eff[:, None] * n_bb[None, :] * central[:, None])
+
+
+if __name__ == "__main__":
+    import sys
+
+    lumis = np.array([float(x) for x in sys.argv[1:]] or [50, 200, 1000, 5000])
+    print(f"Yield bands for luminosities (fb^-1): {lumis}")
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(scan_yields(n_bb=lumi_to_n_bb(lumis)).bands())
@@ -0,0 +1,116 @@
+"""misc/zone_map.py
+Per-chunk min/max statistics ("zone maps") of cached columns, so readers can skip chunks a range cut rules out.
+- The Parquet cache (misc/columnar.py) already stores min/max per row group in its footer; parquet_zone_map
+  reads them without touching the data.
+- The memory-mapped column store (misc/column_store.py) keeps a copy of its columns clustered by Mbc, with a
+  ZoneMap saved alongside, so signal-region queries only touch the few blocks around the B mass.
+"""
+from typing import Dict, Iterable, Mapping, Tuple
+
+import attr
+import numpy as np
+
+from selection.cuts import compile_cut
+
+Bounds = Dict[str, Tuple[float, float]]
+
+# Rows per zone of the clustered column store
+ZONE_SIZE = 65536
+
+
+@attr.s
+class ZoneMap:
+    starts: np.ndarray = attr.ib()
+    stops: np.ndarray = attr.ib()
+    mins: Dict[str, np.ndarray] = attr.ib()
+    maxs: Dict[str, np.ndarray] = attr.ib()
+
+    @classmethod
+    def from_arrays(cls, arrays: Mapping[str, np.ndarray], zone_size: int = ZONE_SIZE) -> "ZoneMap":
+        """
+        Min/max of every array over consecutive blocks of zone_size rows. NaNs are ignored; an all-NaN
+        zone gets NaN bounds, which no range cut can match.
+        """
+        n_rows = len(next(iter(arrays.values())))
+        starts = np.arange(0, n_rows, zone_size)
+        stops = np.minimum(starts + zone_size, n_rows)
+        mins, maxs = {}, {}
+        for name, values in arrays.items():
+            values = np.asarray(values, dtype=float)
+            with np.errstate(invalid="ignore"):
+                mins[name] = np.fmin.reduceat(values, starts) if n_rows else np.empty(0)
+                maxs[name] = np.fmax.reduceat(values, starts) if n_rows else np.empty(0)
+        return cls(starts=starts, stops=stops, mins=mins, maxs=maxs)
+
+    def save(self, path: str) -> None:
+        arrays = dict(starts=self.starts, stops=self.stops)
+        arrays.update({f"min__{k}": v for k, v in self.mins.items()})
+        arrays.update({f"max__{k}": v for k, v in self.maxs.items()})
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "ZoneMap":
+        with np.load(path) as f:
+            mins = {k[len("min__"):]: f[k] for k in f.files if k.startswith("min__")}
+            maxs = {k[len("max__"):]: f[k] for k in f.files if k.startswith("max__")}
+            return cls(starts=f["starts"], stops=f["stops"], mins=mins, maxs=maxs)
+
+    def candidates(self, bounds: Bounds) -> np.ndarray:
+        """
+        Which zones may hold rows inside bounds. Variables without statistics never rule a zone out.
+        :param bounds: dict of variable to (lower, upper), e.g. from CompiledCut.bounds()
+        :return: Boolean array, one entry per zone
+        """
+        keep = np.ones(len(self.starts), dtype=bool)
+        for name, (lower, upper) in bounds.items():
+            if name in self.mins:
+                keep &= (self.maxs[name] >= lower) & (self.mins[name] <= upper)
+        return keep
+
+    def rows(self, bounds: Bounds) -> np.ndarray:
+        """ Row numbers of every zone that may hold rows inside bounds """
+        keep = self.candidates(bounds)
+        if not keep.any():
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(a, b) for a, b in zip(self.starts[keep], self.stops[keep])])
+
+
+def parquet_zone_map(parquet_file, columns: Iterable[str]) -> ZoneMap:
+    """
+    Zone map of a Parquet file, one zone per row group, from the statistics in its footer.
+    Row groups without statistics for a column get (-inf, inf) so they are never skipped.
+    :param parquet_file: pyarrow.parquet.ParquetFile
+    :param columns: Columns to get statistics for
+    :return: ZoneMap
+    """
+    metadata = parquet_file.metadata
+    names = [metadata.schema.column(i).name for i in range(metadata.num_columns)]
+    n_groups = metadata.num_row_groups
+    sizes = np.array([metadata.row_group(i).num_rows for i in range(n_groups)], dtype=np.int64)
+    stops = np.cumsum(sizes)
+
+    mins, maxs = {}, {}
+    for column in columns:
+        if column not in names:
+            continue
+        index = names.index(column)
+        mins[column] = np.full(n_groups, -np.inf)
+        maxs[column] = np.full(n_groups, np.inf)
+        for group in range(n_groups):
+            statistics = metadata.row_group(group).column(index).statistics
+            if statistics is not None and statistics.has_min_max:
+                mins[column][group] = statistics.min
+                maxs[column][group] = statistics.max
+    return ZoneMap(starts=stops - sizes, stops=stops, mins=mins, maxs=maxs)
+
+
+def parquet_row_groups(parquet_file, where: str) -> list:
+    """
+    Row groups of a Parquet file which may hold rows passing where
+    :param parquet_file: pyarrow.parquet.ParquetFile
+    :param where: ROOT-style cut string
+    :return: List of row group indices
+    """
+    bounds = compile_cut(where).bounds()
+    keep = parquet_zone_map(parquet_file, bounds).candidates(bounds)
+    return [int(i) for i in np.flatnonzero(keep)]
@@ -10,6 +10,12 @@ class Cut:
     def __repr__(self):
         return f"Cut({self.name!r}, {self.cut_string!r}, {self.category!r})"
 
+    def compile(self, aliases=None):
+        """ Vectorised evaluator of this cut over ntuple columns, see selection/cuts.py """
+        from selection.cuts import compile_cut
+
+        return compile_cut(self.cut_string, aliases=aliases)
+
 
 class Particle:
     def __init__(self, particle):
@@ -1,4 +1,6 @@
 # Script for general reconstruction
+import os
+
 import attr
 
 import basf2 as b2
@@ -6,6 +8,7 @@ import modularAnalysis as ma
 import variables.collections as vc
 import variables.utils as vu
 import vertex as vx
+import yaml
 
 
 @attr.s
@@ -167,9 +170,15 @@ class Reconstruction:
             path=self.path,
         )
 
-    def reconstruction(self, input_file: str, output_file: str) -> None:
+    def reconstruction(self, input_file: str, output_file: str, normalized: bool = False,
+                       background_fraction: float = 0.0) -> None:
         """
         A script to perform reconstruction as needed by the b2jpsi_eta analysis.
+        :param normalized: Write per-event variables (event shape) once per event to an "event" tree, instead of on
+        every B0 candidate. misc/event_table.py broadcasts them back onto the candidates when they are read.
+        :param background_fraction: Keep the background B0 candidates of this fraction of the events, weighted by
+        1 / background_fraction in a retentionWeight column, and flag the candidates of those events in a retainedEvent
+        column (see my_reconstruction/retention.py). With 0, only truth-matched signal is kept.
         :return: None
         """
 
@@ -184,7 +193,11 @@ class Reconstruction:
         # eta decay
         self.reconstruct_eta_decay()
         # They all have this one (you need to reconstruct the J/psi and eta first)
-        b_meson_cuts = "isSignal and Mbc > 5.1 and Mbc < 5.4"  # Quite harsh for now, otherwise files too big.
+        # The B0 cut lives in config/cuts.yaml next to this script, which selection/cut_flow.py also reads
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", "cuts.yaml")) as f:
+            b_meson_cuts = yaml.safe_load(f)["B0"]["reco"]
+        if not background_fraction:
+            b_meson_cuts = f"isSignal and {b_meson_cuts}"  # Quite harsh, otherwise files too big.
         ma.reconstructDecay("B0 -> J/psi eta", b_meson_cuts, path=self.path)
 
         # For now truth match everything
@@ -194,8 +207,16 @@ class Reconstruction:
         ma.looseMCTruth("eta", path=self.path)
         self.truth_match_all()
 
+        # Background is prescaled before the vertex fit, which then only runs on what is kept
+        weight_variables = []
+        if background_fraction:
+            from my_reconstruction.retention import retain_background
+            weight_variables = retain_background("B0", background_fraction, seed=os.path.basename(input_file),
+                                                 path=self.path)
+
         self.rave_vertex_reconstruction()
 
+        # Best candidates are chosen offline instead, see selection/best_candidate.py
         # ma.rankByLowest("B0", 'chiProb', numBest=3, outputVariable='B_vtx_rank', path=self.path)
         # ma.variables.addAlias('B_vtx_rank', 'extraInfo(B_vtx_rank)')
         ma.buildRestOfEvent("B0", path=self.path)
@@ -218,7 +239,7 @@ class Reconstruction:
                 cms_kinematics,
                 vc.deltae_mbc,
                 vc.inv_mass,
-                vc.event_shape,
+                [] if normalized else vc.event_shape,
                 vc.vertex,
                 vc.mc_truth,
                 vc.mc_kinematics,
@@ -228,6 +249,11 @@ class Reconstruction:
             for item in sublist
         ]
 
+        # Lab-frame four-vectors of the J/psi and eta of each B, for offline kinematics (misc/kinematics.py)
+        daughter_kinematics = vu.create_aliases(
+            vc.kinematics, "daughter(0, {variable})", prefix="jpsi"
+        ) + vu.create_aliases(vc.kinematics, "daughter(1, {variable})", prefix="eta")
+
         # These are in all decay modes
         # ma.variablesToNtuple(
         #     "J/psi", variables, filename=output_file, treename="jpsi", path=self.path
@@ -236,8 +262,15 @@ class Reconstruction:
         #     "eta", variables, filename=output_file, treename="eta", path=self.path
         # )
         ma.variablesToNtuple(
-            "B0", variables, filename=output_file, treename="b0", path=self.path
+            "B0", variables + daughter_kinematics + weight_variables, filename=output_file, treename="b0",
+            path=self.path
         )
+        if normalized:
+            # An empty decay string gives one row per event. Events without a B0 candidate are never read back.
+            ma.applyEventCuts("nParticlesInList(B0) > 0", path=self.path)
+            ma.variablesToNtuple(
+                "", vc.event_shape, filename=output_file, treename="event", path=self.path
+            )
         # ma.variablesToNtuple(
         #     "gamma", variables, filename=output_file, treename="gamma", path=self.path
         # )
@@ -297,10 +330,12 @@ if __name__ == "__main__":
 
     print(f"Reconstruction called with parameters: {args}")
 
-    input_file, output_file = args
+    input_file, output_file, *options = args
     path = b2.create_path()
 
     reco = Reconstruction(decay=input_file, path=path)
-    reco.reconstruction(input_file, output_file)
+    fractions = [float(o.split("=", 1)[1]) for o in options if o.startswith("--background-fraction=")]
+    reco.reconstruction(input_file, output_file, normalized="--normalized" in options,
+                        background_fraction=fractions[-1] if fractions else 0.0)
 
     print("Done!")
@@ -0,0 +1,66 @@
+"""my_reconstruction/retention.py
+Prescaled background retention. Rather than cutting on isSignal (which throws all background away) or keeping
+everything (which makes files too big), keep every truth-matched signal candidate and the candidates of a fixed
+fraction of the events. The decision is per event, so retained events keep all their candidates.
+Events that are not retained still keep their signal candidates, with no background around them: there the true
+candidate always wins best-candidate selection (selection/best_candidate.py), which would inflate its purity and
+efficiency. Every candidate therefore carries a RETAINED_COLUMN flag, the same for the whole event, and studies of
+whole events should use where="retainedEvent == 1". In that subset every candidate, signal included, stands for
+1 / fraction candidates of the unprescaled sample.
+On the full file, each candidate carries a weight, 1 for signal and 1 / fraction for background, so that weighted
+background counts estimate the unprescaled ones. Within background the weight is constant, so unweighted shapes are
+unbiased too.
+The random numbers are seeded from the input file, so re-running a job keeps the same events.
+"""
+from typing import List
+
+WEIGHT_COLUMN = "retentionWeight"
+# 1 for candidates of retained events, whose candidates are all kept, 0 for signal kept from the other events
+RETAINED_COLUMN = "retainedEvent"
+
+
+def _check_fraction(fraction: float) -> None:
+    if not 0 < fraction <= 1:
+        raise ValueError(f"The fraction of background kept must be in (0, 1], got {fraction}")
+
+
+def retention_cut(fraction: float) -> str:
+    """
+    basf2 cut keeping truth-matched signal and a fraction of the events
+    :param fraction: Fraction of events whose background candidates are kept, in (0, 1]
+    :return: Cut string
+    """
+    _check_fraction(fraction)
+    return f"isSignal == 1 or eventRandom < {fraction!r}"
+
+
+def retention_weight(fraction: float) -> str:
+    """ basf2 expression of the weight of a candidate kept by retention_cut: 1 for signal, 1 / fraction otherwise """
+    _check_fraction(fraction)
+    return f"formula(1 + {1 / fraction - 1!r} * (1 - ifNANgiveX(isSignal, 0)))"
+
+
+def retained_flag(fraction: float) -> str:
+    """ basf2 expression of RETAINED_COLUMN: whether the event of a candidate won the draw of retention_cut """
+    _check_fraction(fraction)
+    return f"passesCut(eventRandom < {fraction!r})"
+
+
+def retain_background(list_name: str, fraction: float, seed: str, path) -> List[str]:
+    """
+    Prescale the background of a truth-matched particle list
+    :param list_name: Particle list, already truth matched
+    :param fraction: Fraction of events whose background candidates are kept, in (0, 1]
+    :param seed: Random seed, e.g. the name of the input file
+    :param path: basf2 path
+    :return: Variables to add to the ntuple, i.e. [WEIGHT_COLUMN, RETAINED_COLUMN]
+    """
+    import basf2 as b2
+    import modularAnalysis as ma
+    from variables import variables as vm
+
+    b2.set_random_seed(seed)
+    ma.applyCuts(list_name, retention_cut(fraction), path=path)
+    vm.addAlias(WEIGHT_COLUMN, retention_weight(fraction))
+    vm.addAlias(RETAINED_COLUMN, retained_flag(fraction))
+    return [WEIGHT_COLUMN, RETAINED_COLUMN]
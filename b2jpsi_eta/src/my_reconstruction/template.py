@@ -5,10 +5,10 @@ import variables.utils as vu
 import vertex as vx
 import yaml
 
-from config.parse_config import DecayList
+from config.parse_config import DecayList, Track
 
 
-def reconstruction(input_file, output_file):
+def reconstruction(input_file, output_file, normalized=False):
     my_path = b2.create_path()
     ma.inputMdst("default", input_file, my_path)
 
@@ -37,13 +37,23 @@ def reconstruction(input_file, output_file):
     for truth_match_particle in truth_match_particles:
         ma.looseMCTruth(truth_match_particle, path=my_path)
 
-    # Perform vertex fitting
     head = decays.get_head()
+
+    # Optionally keep only a fraction of the background, weighted up (see retention.py)
+    weight_variables = []
+    if options.get("background_fraction"):
+        from my_reconstruction.retention import retain_background
+        weight_variables = retain_background(
+            head, options["background_fraction"], seed=input_file.split("/")[-1], path=my_path
+        )
+
+    # Perform vertex fitting
     vtx_decay_string = decays.get_chain()
     print(vtx_decay_string)
 
     vx.vertexRave(head, 0, vtx_decay_string, constraint="iptube", path=my_path)
 
+    # Best candidates are chosen offline instead, see selection/best_candidate.py
     # ma.rankByLowest("B0", 'chiProb', numBest=3, outputVariable='B_vtx_rank', path=my_path)
     # ma.variables.addAlias('B_vtx_rank', 'extraInfo(B_vtx_rank)')
     ma.buildRestOfEvent(head, path=my_path)
@@ -66,7 +76,7 @@ def reconstruction(input_file, output_file):
             cms_kinematics,
             vc.deltae_mbc,
             vc.inv_mass,
-            vc.event_shape,
+            [] if normalized else vc.event_shape,
             vc.vertex,
             vc.mc_truth,
             vc.mc_kinematics,
@@ -76,23 +86,70 @@ def reconstruction(input_file, output_file):
         for item in sublist
     ]
 
+    # Lab-frame four-vectors of the J/psi and eta of each B, for offline kinematics (misc/kinematics.py)
+    daughter_kinematics = vu.create_aliases(
+        vc.kinematics, "daughter(0, {variable})", prefix="jpsi"
+    ) + vu.create_aliases(vc.kinematics, "daughter(1, {variable})", prefix="eta")
+
+    # Whether a particle belongs to the signal B decay rather than the other B, for efficiencies/maps.py
+    from efficiencies.maps import SIGNAL_SIDE_COLUMN, SIGNAL_SIDE_CUT
+    from variables import variables as vm
+    vm.addAlias(SIGNAL_SIDE_COLUMN, f"passesCut({SIGNAL_SIDE_CUT})")
+    variables.append(SIGNAL_SIDE_COLUMN)
+
     trees = yaml.safe_load(open("config/tree_names.yaml"))
+
+    # Number the candidates of every list (e+ and e- are one list), and write on the head the numbers of its
+    # daughters, so that misc/event_index.py can join each B to its own J/psi and eta
+    from misc.event_index import RANK_COLUMN, daughter_column
+    for particle in sorted({Track(x).q_agnostic for x in decays.all_particles}):
+        ma.rankByHighest(particle, "p", outputVariable=RANK_COLUMN, path=my_path)
+    vm.addAlias(RANK_COLUMN, f"extraInfo({RANK_COLUMN})")
+    variables.append(RANK_COLUMN)
+    daughter_links = []
+    for i, daughter in enumerate(decays.decay_dict()[head].daughters):
+        vm.addAlias(daughter_column(trees[daughter]), f"daughter({i}, extraInfo({RANK_COLUMN}))")
+        daughter_links.append(daughter_column(trees[daughter]))
+
     for particle in decays.all_particles:
         ma.variablesToNtuple(
             particle,
-            variables,
+            variables + (daughter_kinematics + daughter_links + weight_variables if particle == head else []),
             filename=output_file,
             treename=trees[particle],
             path=my_path,
         )
 
+    # Generated B0, J/psi and eta, the denominators of the efficiency maps in efficiencies/maps.py, those of the
+    # signal decay only
+    for particle in ["B0", "J/psi", "eta"]:
+        ma.fillParticleListFromMC(f"{particle}:gen", SIGNAL_SIDE_CUT, path=my_path)
+        ma.variablesToNtuple(
+            f"{particle}:gen",
+            vc.mc_kinematics + [SIGNAL_SIDE_COLUMN],
+            filename=output_file,
+            treename=f"{trees[particle]}_gen",
+            path=my_path,
+        )
+
+    if normalized:
+        # Per-event variables once per event rather than on every candidate, see misc/event_table.py
+        ma.applyEventCuts(f"nParticlesInList({head}) > 0", path=my_path)
+        ma.variablesToNtuple("", vc.event_shape, filename=output_file, treename="event", path=my_path)
+
     b2.process(my_path)
     print(b2.statistics)
 
+    # Efficiency shard of this job (see efficiencies/shards.py), so efficiencies never need the merged files
+    from efficiencies.shards import count_signal, write_shard
+    n_gen = b2.statistics.get_global().calls(b2.statistics.EVENT)
+    write_shard(output_file, n_gen, count_signal(output_file, key=trees[head]))
+
 
 if __name__ == "__main__":
     import sys
 
     args = sys.argv[1:]
     print(f"Reconstruction called with parameters: {args}")
-    reconstruction(*args)
+    normalized = "--normalized" in args
+    reconstruction(*[arg for arg in args if arg != "--normalized"], normalized=normalized)
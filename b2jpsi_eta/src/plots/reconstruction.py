@@ -16,20 +16,37 @@ from typing import List, Optional, Iterable
 
 import matplotlib.pyplot as plt
 import pandas as pd
-import root_pandas as rpd
 import seaborn as sns
 
-from constants.locations import PLOTS_DIR, PROJECT_ROOT
+from constants.locations import PLOTS_DIR
+from misc.utils import get_merged_df
+from selection.cuts import cut_variables, where_mask
 
 
-def get_sig_and_bkg_series(decay, var, range=None):
-    # Processing data
-    where = f"{var} > {range[0]} && {var} < {range[1]}" if range is not None else None
-    tree = _read_decay(decay=decay, where=where)
-    is_signal = tree.isSignal.astype(bool)
-    signal = tree[is_signal]
-    background = tree[~is_signal]
-    return background, signal
+def get_sig_and_bkg_histograms(decay: str, var: str, range: Iterable[float], bins: int = 100) -> dict:
+    """
+    Histogram var for signal and background
+    :param decay: Specify decay to histogram
+    :param var: Specify variable to histogram
+    :param range: Range of the histogram; candidates outside it are cut before filling
+    :param bins: Number of bins
+    :return: dict with keys "signal" and "background", each a dict of
+    {counts: array of bin contents, edges: array of bin edges, total: number of entries (weighted by the
+    retention weight when there is one), std: standard deviation}
+    """
+    from misc.histograms import sig_and_bkg_histograms
+    from misc.utils import merged_columns
+    from my_reconstruction.retention import WEIGHT_COLUMN
+
+    # Files with prescaled background (my_reconstruction/retention.py) are weighted back to the full sample
+    weight = WEIGHT_COLUMN if WEIGHT_COLUMN in merged_columns(decay) else None
+    # Cached per request, so regenerating the plot doesn't read the ntuple (see misc/histograms.py)
+    cached = sig_and_bkg_histograms(decay, var, tuple(range), bins, weight=weight)
+    histograms = {}
+    for name, h in cached.items():
+        # Weights are constant within signal and within background, so the moments need none
+        histograms[name] = dict(counts=h.counts, edges=h.edges, total=h.total, std=h.std)
+    return histograms
 
 
 def _read_decay(decay: str, where: Optional[str] = None, columns: List[str] = None, key: str = "b0") -> pd.DataFrame:
@@ -45,8 +62,11 @@ def _read_decay(decay: str, where: Optional[str] = None, columns: List[str] = No
     """
     default_columns = "Mbc deltaE isSignal".split()
     columns = columns if columns is not None else default_columns
-    tree = rpd.read_root(os.path.join(PROJECT_ROOT, "merged", f"root_files/{decay}.root"), columns=columns, where=where,
-                         key=key)
+    # Read uncut, so every plot made in this process is cut from the same cached DataFrame (see misc/df_cache.py)
+    tree = get_merged_df(decay=decay, key=key, columns=list(dict.fromkeys(columns + cut_variables(where))))
+    if where is not None:
+        tree = tree[where_mask(tree, where)].reset_index(drop=True)
+    tree = tree[columns]
     return tree
 
 
@@ -65,18 +85,20 @@ def plot_sig_vs_bkg(decay: str, var: str, range: Iterable[float], bins: int = 10
     plt.rc("text", usetex=True)
     sns.set(context="paper", font_scale=1.1, style="ticks", palette="pastel")
 
-    background, signal = get_sig_and_bkg_series(decay, var, range)
+    histograms = get_sig_and_bkg_histograms(decay, var, range, bins)
     fig, (sig_ax, bkg_ax) = plt.subplots(nrows=2, sharex=True)
 
     # Plot signal
     sig_color = "green"
-    signal.hist(var, bins=bins, histtype="step", color=sig_color, ax=sig_ax, range=range,
-                label="Signal")
+    signal = histograms["signal"]
+    sig_ax.hist(signal["edges"][:-1], bins=signal["edges"], weights=signal["counts"], histtype="step",
+                color=sig_color, label="Signal")
 
     # Plot background
     bkg_color = "red"
-    background.hist(var, bins=bins, histtype="step", color=bkg_color, ax=bkg_ax, range=range,
-                    label="Background")
+    background = histograms["background"]
+    bkg_ax.hist(background["edges"][:-1], bins=background["edges"], weights=background["counts"], histtype="step",
+                color=bkg_color, label="Background")
 
     # Draw statistics box
     for ax, data in zip((sig_ax, bkg_ax), (signal, background)):
@@ -84,8 +106,8 @@ def plot_sig_vs_bkg(decay: str, var: str, range: Iterable[float], bins: int = 10
         if ax == sig_ax and var == "Mbc":
             xpos = 0.22
 
-        total = len(data)
-        std_dev = data[var].std()
+        total = data["total"]
+        std_dev = data["std"]
         text = (
             r"\begin{tabular}{cc}"
             f"Total & {round(total)} \\\\"
@@ -116,11 +138,16 @@ def plot_sig_vs_bkg_deltaE(decay: str) -> None:
     plot_sig_vs_bkg(decay=decay, var="deltaE", range=(-0.5, 0.5), latex="$\Delta E$ / GeV")
 
 
-def plot_joint(decay: str, sig_or_bkg: str) -> None:
-    e_lower = -0.2
-    e_upper = 0.2
-    m_lower = 5.27
-    m_upper = 5.285
+def plot_joint(decay: str, sig_or_bkg: str, box: str = "default") -> None:
+    """
+    Hexbin plot of Mbc against deltaE, for signal inside the signal box or for background with the box drawn on
+    :param box: "default" for the box of selection/signal_box.py DEFAULT_BOX, "optimised" to choose it with
+    selection/signal_box.optimise_box
+    """
+    from selection import signal_box
+    box = signal_box.DEFAULT_BOX if box == "default" else signal_box.optimise_box(decay).box
+    e_lower, e_upper = box["delta_e"]
+    m_lower, m_upper = box["mbc"]
     is_sig = sig_or_bkg == "sig"
     if is_sig:
         where = f"isSignal && deltaE < {e_upper} && deltaE > {e_lower} && Mbc > {m_lower} && Mbc < {m_upper}"
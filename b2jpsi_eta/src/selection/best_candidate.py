@@ -0,0 +1,194 @@
+"""selection/best_candidate.py
+Offline best-candidate selection on the merged ntuples, the counterpart of basf2's rankByHighest/rankByLowest
+(commented out in my_reconstruction/perform_reconstruction.py), so a new criterion costs one pass over a few columns
+rather than a new reconstruction.
+Candidates of one event are consecutive in the ntuples, so events are found from the boundaries where the event
+key changes, with no pandas groupby. Events with the same number of candidates are stacked into a matrix and ranked
+with one np.lexsort along its rows, which costs O(candidates x log(multiplicity)) rather than a sort of the whole
+sample. The file is ranked chunk by chunk, holding back the last event of each chunk until it is complete.
+Ranks start at 1 like basf2's; ties keep file order and NaN always ranks last.
+With prescaled background (my_reconstruction/retention.py) only retained events are whole, so studies of the ranks
+should add where="retainedEvent == 1".
+Usage:
+    ranks = rank_merged("jpsi2ee_eta2gammagamma", {"B_vtx_rank": [RankKey("chiProb", "highest")]})
+    best_candidates("jpsi2ee_eta2gammagamma", [RankKey("abs(deltaE)", "lowest")], columns=["Mbc", "deltaE"])
+    # The pi0 closest to the nominal mass, on the pi0 tree
+    rank_merged(decay, {"pi0_mass_rank": [RankKey("abs(M - 0.1349768)", "lowest")]}, key="pi0")
+    $ python selection/best_candidate.py <decay> [<decay>,...]  # stores DEFAULT_CRITERIA as a friend
+"""
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import attr
+import numpy as np
+import pandas as pd
+
+from misc.event_index import EVENT_COLUMNS, event_keys
+from selection.cuts import compile_cut
+
+FRIEND_NAME = "best_candidate"
+
+
+@attr.s(frozen=True)
+class RankKey:
+    # Column or expression, e.g. "chiProb" or "abs(deltaE)"
+    expression: str = attr.ib()
+    # "highest": the largest value ranks first, as rankByHighest; "lowest" as rankByLowest
+    order: str = attr.ib(default="highest", validator=attr.validators.in_(["highest", "lowest"]))
+
+    @property
+    def variables(self) -> List[str]:
+        return list(compile_cut(self.expression).variables)
+
+    def sort_values(self, columns) -> np.ndarray:
+        """ Values ordered so that the best candidate is the smallest, with NaN after everything else """
+        values = compile_cut(self.expression).values(columns).astype(float)
+        values = -values if self.order == "highest" else values
+        return np.where(np.isnan(values), np.inf, values)
+
+
+# rank column name: ranking keys, the first deciding and the following ones breaking ties
+Criteria = Dict[str, List[RankKey]]
+
+DEFAULT_CRITERIA: Criteria = {
+    "B_vtx_rank": [RankKey("chiProb", "highest")],
+    "B_deltaE_rank": [RankKey("abs(deltaE)", "lowest"), RankKey("chiProb", "highest")],
+}
+
+
+def criteria_variables(criteria: Criteria) -> List[str]:
+    """ Columns needed to rank by criteria, event columns included """
+    return list(dict.fromkeys(EVENT_COLUMNS + [v for keys in criteria.values() for k in keys for v in k.variables]))
+
+
+def ranks(event: np.ndarray, sort_values: List[np.ndarray]) -> np.ndarray:
+    """
+    Rank of every candidate within its event
+    :param event: Event key of every candidate (see misc/event_index.event_keys), candidates of one event
+    consecutive
+    :param sort_values: Ranking keys, most significant first, smallest value best
+    :return: numpy int32 array of ranks starting at 1, in the input order
+    """
+    n = len(event)
+    starts = np.flatnonzero(np.concatenate([[True], event[1:] != event[:-1]]))
+    multiplicity = np.diff(np.append(starts, n))
+    rank = np.ones(n, dtype=np.int32)
+    # Events with the same number of candidates form a matrix (events, candidates), sorted row by row with one
+    # np.lexsort. There are only a handful of distinct multiplicities, and most events have one candidate.
+    for m in np.unique(multiplicity[multiplicity > 1]):
+        rows = starts[multiplicity == m][:, None] + np.arange(m)
+        # np.lexsort sorts on its last key first; being stable, ties stay in file order
+        order = np.lexsort(tuple(values[rows] for values in sort_values[::-1]))
+        rank[np.take_along_axis(rows, order, axis=1)] = np.arange(1, m + 1, dtype=np.int32)
+    return rank
+
+
+def rank_frame(df: pd.DataFrame, criteria: Criteria) -> pd.DataFrame:
+    """
+    Rank columns for candidates of complete events
+    :param df: DataFrame with the event columns and every variable of criteria
+    :param criteria: dict of rank column name to ranking keys
+    :return: pandas DataFrame with one column per criterion, aligned with df
+    """
+    event = event_keys(*(df[c].to_numpy() for c in EVENT_COLUMNS))
+    return pd.DataFrame({name: ranks(event, [k.sort_values(df) for k in keys]) for name, keys in criteria.items()})
+
+
+def complete_events(chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """
+    Re-cut chunks of candidates so that no event is split between two of them, holding back the last event of
+    each chunk until the next one shows whether it continues
+    :param chunks: DataFrames with the event columns, in file order
+    :return: Iterator of DataFrames, together holding the same rows in the same order
+    """
+    carry = None
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        # Rows belonging to the last event form a run at the end of the chunk
+        last = np.ones(len(chunk), dtype=bool)
+        for column in EVENT_COLUMNS:
+            values = chunk[column].to_numpy()
+            last &= values == values[-1]
+        split = len(chunk) - int(np.argmin(last[::-1])) if not last.all() else 0
+        carry = chunk.iloc[split:]
+        if split:
+            yield chunk.iloc[:split]
+    if carry is not None:
+        yield carry
+
+
+def iter_ranks(chunks: Iterable[pd.DataFrame], criteria: Criteria) -> Iterator[pd.DataFrame]:
+    """
+    rank_frame over chunks whose events may continue into the next chunk
+    :param chunks: DataFrames with the event columns and every variable of criteria, in file order
+    :param criteria: dict of rank column name to ranking keys
+    :return: Iterator of rank DataFrames which, concatenated, align with the concatenated chunks
+    """
+    for events in complete_events(chunks):
+        yield rank_frame(events, criteria)
+
+
+def rank_merged(decay: str, criteria: Criteria = None, key: str = "b0", chunksize: int = 1000000) -> pd.DataFrame:
+    """
+    Rank columns for every candidate of a merged tree
+    :param decay: The decay mode in question
+    :param criteria: dict of rank column name to ranking keys, defaults to DEFAULT_CRITERIA
+    :param key: The tree within the .root file
+    :param chunksize: Number of candidates read at a time
+    :return: pandas DataFrame, one row per entry of the tree in file order
+    """
+    from misc.utils import iter_merged_df
+
+    criteria = DEFAULT_CRITERIA if criteria is None else criteria
+    chunks = iter_merged_df(decay, key=key, columns=criteria_variables(criteria), chunksize=chunksize)
+    frames = list(iter_ranks(chunks, criteria))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=list(criteria), dtype=np.int32)
+
+
+def add_rank_friend(decay: str, criteria: Criteria = None, key: str = "b0", name: str = FRIEND_NAME,
+                    version: int = 1, chunksize: int = 1000000) -> str:
+    """
+    Store rank columns as a friend of the merged tree (see misc/friends.py), so that get_merged_df(decay,
+    where="B_vtx_rank == 1") keeps best candidates only
+    :return: Location of the friend file
+    """
+    from misc.friends import write_friend_chunks
+    from misc.utils import iter_merged_df
+
+    criteria = DEFAULT_CRITERIA if criteria is None else criteria
+    chunks = iter_merged_df(decay, key=key, columns=criteria_variables(criteria), chunksize=chunksize)
+    return write_friend_chunks(decay, name, iter_ranks(chunks, criteria), version=version, key=key)
+
+
+def best_candidates(decay: str, keys: List[RankKey], columns: Optional[List[str]] = None, key: str = "b0",
+                    n_best: int = 1, chunksize: int = 1000000) -> pd.DataFrame:
+    """
+    The n_best candidates of every event
+    :param decay: The decay mode in question
+    :param keys: Ranking keys, the first deciding and the following ones breaking ties
+    :param columns: Columns to return, defaults to all. A "rank" column is added.
+    :param key: The tree within the .root file
+    :param n_best: Number of candidates kept per event
+    :param chunksize: Number of candidates read at a time
+    :return: pandas DataFrame
+    """
+    from misc.utils import iter_merged_df
+
+    criteria = {"rank": keys}
+    needed = None if columns is None else list(dict.fromkeys(list(columns) + criteria_variables(criteria)))
+    frames = []
+    for events in complete_events(iter_merged_df(decay, key=key, columns=needed, chunksize=chunksize)):
+        rank = rank_frame(events, criteria)["rank"].to_numpy()
+        keep = rank <= n_best
+        selected = events.loc[keep] if columns is None else events.loc[keep, list(columns)]
+        frames.append(selected.assign(rank=rank[keep]))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=list(columns or []) + ["rank"])
+
+
+if __name__ == "__main__":
+    import sys
+
+    for decay in sys.argv[1:]:
+        print(f"{decay}: {add_rank_friend(decay)}")
@@ -0,0 +1,214 @@
+"""selection/cut_flow.py
+Cut flow of the selection: how many candidates, and how many events, survive each cut, both in sequence and with
+every cut but one ("N-1"), for signal (isSignal == 1) and background separately.
+Every cut is evaluated once per chunk as a boolean column, and all the counts come from that one matrix, so a
+whole background sample is one chunked scan whatever the number of cuts.
+Usage:
+    cut_flow("jpsi2ee_eta2gammagamma", {"Mbc": "Mbc > 5.27", "deltaE": "abs(deltaE) < 0.2"})
+    $ python selection/cut_flow.py [<decay>,...]  # default cut flows (configured_cuts) of every mode
+"""
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from selection.cuts import compile_cut, cut_variables, reconstruction_cuts, to_python
+
+CATEGORIES = ["all", "sig", "bkg"]
+
+
+def split_cut(cut: str) -> List[str]:
+    """
+    Split a cut into the terms of its top-level "and", e.g. "Mbc > 5.1 and [a < 1 || b < 1]" into
+    ["Mbc > 5.1", "(a < 1 or b < 1)"]
+    :param cut: basf2/ROOT-style cut
+    :return: List of cut strings
+    """
+    python = to_python(cut)
+    terms, depth, start = [], 0, 0
+    for match in re.finditer(r"[()]|\band\b", python):
+        token = match.group()
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0:
+            terms.append(python[start:match.start()])
+            start = match.end()
+    terms.append(python[start:])
+    return [" ".join(term.split()) for term in terms if term.strip()]
+
+
+def configured_cuts(decay: str) -> Dict[str, Dict[str, str]]:
+    """
+    The default cut flow of a mode: the offline selection, one step per term, on the b0 tree. For now that is the
+    signal box of selection/signal_box.py.
+    Cuts applied during reconstruction (the particle-list cuts of my_reconstruction/config/reco_config.yaml and the
+    B-level cuts of my_reconstruction/config/cuts.yaml) are left out: every stored candidate passes them, and most
+    of their variables (electronID, d0, ...) aren't written to the ntuples.
+    :param decay: The decay mode in question
+    :return: dict of tree name to {step name: cut}
+    """
+    import yaml
+    from constants.locations import PROJECT_ROOT
+    from selection.signal_box import DEFAULT_BOX, box_where
+
+    config_dir = os.path.join(PROJECT_ROOT, "my_reconstruction", "config")
+    with open(os.path.join(config_dir, "reco_config.yaml")) as f:
+        particle_lists = yaml.safe_load(f).get(decay, {}).get("particle_lists", {})
+    with open(os.path.join(config_dir, "tree_names.yaml")) as f:
+        trees = yaml.safe_load(f)
+    upstream = {term for cut in reconstruction_cuts("B0").values() for term in split_cut(cut)}
+    upstream.update(term for lists in particle_lists.values() for named in lists for cut in named.values()
+                    for term in split_cut(cut))
+
+    steps = {f"signal_box[{i}]": term for i, term in enumerate(split_cut(box_where(DEFAULT_BOX)))}
+    return {trees["B0"]: {name: term for name, term in steps.items() if term not in upstream}}
+
+
+def pass_matrix(chunk: pd.DataFrame, cuts: Dict[str, str]) -> np.ndarray:
+    """
+    Boolean matrix of shape (candidates, 3 * (1 + 2 * len(cuts))): for each of all, signal and background, whether
+    a candidate passes no cut, the first i cuts, and every cut but the i-th
+    """
+    n = len(chunk)
+    ones = np.ones((1, n), dtype=bool)
+    if cuts:
+        passes = np.stack([compile_cut(cut)(chunk) for cut in cuts.values()])
+        sequential = np.logical_and.accumulate(passes, axis=0)
+        # Every cut but the i-th: AND of the cuts before it and of the cuts after it
+        before = np.vstack([ones, sequential[:-1]])
+        after = np.vstack([np.logical_and.accumulate(passes[::-1], axis=0)[::-1][1:], ones])
+        stages = np.vstack([ones, sequential, before & after]).T
+    else:
+        stages = ones.T
+
+    signal = (chunk["isSignal"].to_numpy() == 1)[:, None]
+    return np.hstack([stages, stages & signal, stages & ~signal])
+
+
+def _event_weights(matrix: np.ndarray, weights: np.ndarray, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Weight of each event at each stage, over runs of equal keys (candidates of one event are consecutive in the
+    ntuples): the smallest weight of its passing candidates, inf where none passes. Signal is never prescaled, so an
+    event with a passing signal candidate counts once, and one passing through background only stands for
+    1 / fraction events (see my_reconstruction/retention.py).
+    """
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    return keys[starts], np.minimum.reduceat(np.where(matrix, weights[:, None], np.inf), starts, axis=0)
+
+
+def _finite(event_weights: np.ndarray) -> np.ndarray:
+    return np.where(np.isinf(event_weights), 0, event_weights)
+
+
+def count_flow(chunks: Iterable[pd.DataFrame], cuts: Dict[str, str]) -> pd.DataFrame:
+    """
+    Cut flow over chunks of candidates
+    :param chunks: DataFrames with isSignal, the event columns and the cut variables, and optionally retentionWeight
+    :param cuts: dict of step name to cut, in the order they are applied
+    :return: pandas DataFrame, one row per stage, with candidate and event counts for all, sig and bkg; weighted
+    by retentionWeight (and so no longer integers) where the chunks have it
+    """
+    from misc.event_index import EVENT_COLUMNS, event_keys
+    from my_reconstruction.retention import WEIGHT_COLUMN
+
+    # Stages per category: no cut, each sequential step, each N-1
+    n_stages = 1 + 2 * len(cuts)
+    candidates = np.zeros(3 * n_stages)
+    events = np.zeros(3 * n_stages)
+    weighted = False
+    # The last event of a chunk may continue into the next one, so it is only counted once complete
+    carry_key, carry = None, None
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        matrix = pass_matrix(chunk, cuts)
+        weighted |= WEIGHT_COLUMN in chunk
+        weights = chunk[WEIGHT_COLUMN].to_numpy(dtype=float) if WEIGHT_COLUMN in chunk else np.ones(len(chunk))
+        candidates += weights @ matrix
+        keys, event_weights = _event_weights(matrix, weights,
+                                             event_keys(*(chunk[c].to_numpy() for c in EVENT_COLUMNS)))
+        if carry is not None:
+            if keys[0] == carry_key:
+                event_weights[0] = np.minimum(event_weights[0], carry)
+            else:
+                events += _finite(carry)
+        events += _finite(event_weights[:-1]).sum(axis=0)
+        carry_key, carry = keys[-1], event_weights[-1]
+    if carry is not None:
+        events += _finite(carry)
+
+    count = float if weighted else int
+    flow = []
+    for kind, offset in [("none", 0), ("sequential", 1), ("n-1", 1 + len(cuts))]:
+        steps = ["none"] if kind == "none" else list(cuts)
+        for i, step in enumerate(steps):
+            row = dict(kind=kind, step=step, cut="" if kind == "none" else cuts[step])
+            for c, category in enumerate(CATEGORIES):
+                row[f"candidates_{category}"] = count(candidates[c * n_stages + offset + i])
+                row[f"events_{category}"] = count(events[c * n_stages + offset + i])
+            flow.append(row)
+    return pd.DataFrame(flow)
+
+
+def cut_flow(decay: str, cuts: Dict[str, str], key: str = "b0", chunksize: int = 100000) -> pd.DataFrame:
+    """
+    Cut flow of one tree of a mode, streamed from the merged file
+    :param decay: The decay mode in question
+    :param cuts: dict of step name to cut, in the order they are applied
+    :param key: The tree within the .root file
+    :param chunksize: Number of candidates read at a time
+    :return: pandas DataFrame, see count_flow
+    """
+    from misc.event_index import EVENT_COLUMNS
+    from misc.utils import iter_merged_df, merged_columns
+    from my_reconstruction.retention import WEIGHT_COLUMN
+
+    variables = [v for cut in cuts.values() for v in cut_variables(cut)]
+    available = set(merged_columns(decay, key=key))
+    missing = [v for v in dict.fromkeys(variables) if v not in available]
+    if missing:
+        raise ValueError(f"The cut flow of {decay}/{key} needs columns {missing} that the ntuples don't have")
+    columns = list(dict.fromkeys(EVENT_COLUMNS + ["isSignal"] + variables
+                                 + ([WEIGHT_COLUMN] if WEIGHT_COLUMN in available else [])))
+    return count_flow(iter_merged_df(decay, key=key, columns=columns, chunksize=chunksize), cuts)
+
+
+def _mode_flows(decay: str, cuts: Optional[Dict[str, Dict[str, str]]], chunksize: int) -> List[pd.DataFrame]:
+    flows = []
+    for key, tree_cuts in (configured_cuts(decay) if cuts is None else cuts).items():
+        flow = cut_flow(decay, tree_cuts, key=key, chunksize=chunksize)
+        flow.insert(0, "tree", key)
+        flow.insert(0, "decay", decay)
+        flows.append(flow)
+    return flows
+
+
+def cut_flows(decays: Optional[Iterable[str]] = None, cuts: Optional[Dict[str, Dict[str, str]]] = None,
+              chunksize: int = 100000, max_workers: Optional[int] = None) -> pd.DataFrame:
+    """
+    Cut flows of several modes, one process per mode
+    :param decays: Modes, defaults to all modes of the analysis
+    :param cuts: dict of tree name to {step name: cut}, defaults to the configured cuts of each mode
+    :param chunksize: Number of candidates read at a time
+    :param max_workers: Number of modes processed at once
+    :return: pandas DataFrame, see count_flow, with decay and tree columns added
+    """
+    import functools
+    from concurrent.futures import ProcessPoolExecutor
+    from constants.mode_info import mode2latex
+
+    decays = list(mode2latex if decays is None else decays)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        flows = pool.map(functools.partial(_mode_flows, cuts=cuts, chunksize=chunksize), decays)
+        return pd.concat([flow for mode in flows for flow in mode], ignore_index=True)
+
+
+if __name__ == "__main__":
+    import sys
+
+    with pd.option_context("display.max_rows", None, "display.width", 250):
+        print(cut_flows(sys.argv[1:] or None))
@@ -0,0 +1,340 @@
+"""selection/cuts.py
+Compile basf2/ROOT-style cut strings into vectorised evaluators over columns already in memory, so a loaded
+sample can be re-cut without reading the file again.
+Understands the cuts in my_reconstruction/config/cuts.yaml, my_particle.Cut and the where strings used in
+plots/reconstruction.py:
+    && || and or ! not, [ ] or ( ) for grouping, < <= > >= == != (also chained), + - * /, abs()
+Compiled cuts run through numexpr when it is installed, and plain numpy otherwise.
+"""
+import ast
+import functools
+import os
+import re
+import sys
+from typing import Dict, List, Mapping, Optional, Tuple, Union
+
+import attr
+import numpy as np
+import pandas as pd
+
+try:
+    import numexpr
+except ImportError:  # pragma: no cover
+    numexpr = None
+
+Columns = Union[pd.DataFrame, Mapping[str, np.ndarray]]
+
+_GROUPING = str.maketrans("[]", "()")
+
+_COMPARISONS = {
+    ast.Lt: (np.less, "<"),
+    ast.LtE: (np.less_equal, "<="),
+    ast.Gt: (np.greater, ">"),
+    ast.GtE: (np.greater_equal, ">="),
+    ast.Eq: (np.equal, "=="),
+    ast.NotEq: (np.not_equal, "!="),
+}
+
+_ARITHMETIC = {
+    ast.Add: (np.add, "+"),
+    ast.Sub: (np.subtract, "-"),
+    ast.Mult: (np.multiply, "*"),
+    ast.Div: (np.divide, "/"),
+    ast.Pow: (np.power, "**"),
+}
+
+_BOOLEAN_NODES = (ast.BoolOp, ast.Compare)
+
+_NUMEXPR_DTYPES = {np.dtype(t) for t in (bool, np.int32, np.int64, np.float32, np.float64)}
+
+# python 3.7 parses numbers as ast.Num rather than ast.Constant
+_NUMBER_NODES = (ast.Constant,) if sys.version_info >= (3, 8) else (ast.Constant, ast.Num)
+
+
+def _number(node: ast.AST):
+    return node.value if isinstance(node, ast.Constant) else node.n
+
+
+def to_python(cut: str) -> str:
+    """ Rewrite a basf2/ROOT cut with python operators and parentheses, e.g. "[a > 1] && !b" -> "(a > 1) and not b" """
+    cut = cut.translate(_GROUPING).replace("&&", " and ").replace("||", " or ")
+    return re.sub(r"!(?!=)", " not ", cut).strip()
+
+
+def _truth(values) -> np.ndarray:
+    values = np.asarray(values)
+    return values if values.dtype == bool else values != 0
+
+
+def _is_boolean(node: ast.AST) -> bool:
+    return isinstance(node, _BOOLEAN_NODES) or (isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not))
+
+
+def _evaluate(node: ast.AST, columns: Columns):
+    """ numpy evaluation of a parsed cut """
+    if isinstance(node, ast.BoolOp):
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        return functools.reduce(combine, (_truth(_evaluate(x, columns)) for x in node.values))
+    if isinstance(node, ast.UnaryOp):
+        operand = _evaluate(node.operand, columns)
+        if isinstance(node.op, ast.Not):
+            return np.logical_not(_truth(operand))
+        return -operand if isinstance(node.op, ast.USub) else operand
+    if isinstance(node, ast.Compare):
+        mask = True
+        left = _evaluate(node.left, columns)
+        for op, comparator in zip(node.ops, node.comparators):
+            right = _evaluate(comparator, columns)
+            mask = np.logical_and(mask, _COMPARISONS[type(op)][0](left, right))
+            left = right
+        return mask
+    if isinstance(node, ast.BinOp):
+        return _ARITHMETIC[type(node.op)][0](_evaluate(node.left, columns), _evaluate(node.right, columns))
+    if isinstance(node, ast.Call):
+        return np.abs(_evaluate(node.args[0], columns))
+    if isinstance(node, ast.Name):
+        return np.asarray(columns[node.id])
+    return _number(node)
+
+
+def _constant(node: ast.AST) -> Optional[float]:
+    if isinstance(node, _NUMBER_NODES):
+        return float(_number(node))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = _constant(node.operand)
+        if value is not None:
+            return -value if isinstance(node.op, ast.USub) else value
+    return None
+
+
+def _comparison_bounds(left: ast.AST, op: ast.cmpop, right: ast.AST) -> Dict[str, Tuple[float, float]]:
+    """ Bounds implied by one "variable op constant" comparison (either way round) """
+    flipped = {ast.Lt: ast.Gt, ast.LtE: ast.GtE, ast.Gt: ast.Lt, ast.GtE: ast.LtE, ast.Eq: ast.Eq}
+    if type(op) not in flipped:
+        return {}
+    if _constant(left) is not None:
+        left, op, right = right, flipped[type(op)](), left
+    value = _constant(right)
+    if value is None:
+        return {}
+
+    is_abs = isinstance(left, ast.Call) and isinstance(left.args[0], ast.Name)
+    name = left.args[0].id if is_abs else getattr(left, "id", None)
+    if name is None:
+        return {}
+    if isinstance(op, (ast.Lt, ast.LtE)):
+        return {name: (-value, value) if is_abs else (-np.inf, value)}
+    if isinstance(op, (ast.Gt, ast.GtE)):
+        return {} if is_abs else {name: (value, np.inf)}
+    return {name: (-abs(value), abs(value)) if is_abs else (value, value)}
+
+
+def _bounds(node: ast.AST) -> Dict[str, Tuple[float, float]]:
+    if isinstance(node, ast.Compare):
+        parts = [_comparison_bounds(l, op, r) for l, op, r in zip([node.left] + node.comparators, node.ops,
+                                                                  node.comparators)]
+        return _bounds_and(parts)
+    if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+        return _bounds_and([_bounds(x) for x in node.values])
+    if isinstance(node, ast.BoolOp):
+        # A variable is only bounded by an "or" if every branch bounds it, and then by their hull
+        parts = [_bounds(x) for x in node.values]
+        common = set.intersection(*(set(p) for p in parts))
+        return {v: (min(p[v][0] for p in parts), max(p[v][1] for p in parts)) for v in common}
+    return {}
+
+
+def _bounds_and(parts: List[Dict[str, Tuple[float, float]]]) -> Dict[str, Tuple[float, float]]:
+    result = {}
+    for part in parts:
+        for name, (lower, upper) in part.items():
+            old_lower, old_upper = result.get(name, (-np.inf, np.inf))
+            result[name] = (max(lower, old_lower), min(upper, old_upper))
+    return result
+
+
+def _to_numexpr(node: ast.AST) -> str:
+    """ Equivalent numexpr expression for a parsed cut """
+    def as_bool(x):
+        return _to_numexpr(x) if _is_boolean(x) else f"({_to_numexpr(x)} != 0)"
+
+    if isinstance(node, ast.BoolOp):
+        joiner = " & " if isinstance(node.op, ast.And) else " | "
+        return "(" + joiner.join(as_bool(x) for x in node.values) + ")"
+    if isinstance(node, ast.UnaryOp):
+        if isinstance(node.op, ast.Not):
+            return f"(~{as_bool(node.operand)})"
+        return f"({'-' if isinstance(node.op, ast.USub) else '+'}{_to_numexpr(node.operand)})"
+    if isinstance(node, ast.Compare):
+        terms = []
+        left = node.left
+        for op, comparator in zip(node.ops, node.comparators):
+            terms.append(f"({_to_numexpr(left)} {_COMPARISONS[type(op)][1]} {_to_numexpr(comparator)})")
+            left = comparator
+        return "(" + " & ".join(terms) + ")"
+    if isinstance(node, ast.BinOp):
+        op = _ARITHMETIC[type(node.op)][1]
+        return f"({_to_numexpr(node.left)} {op} {_to_numexpr(node.right)})"
+    if isinstance(node, ast.Call):
+        return f"abs({_to_numexpr(node.args[0])})"
+    if isinstance(node, ast.Name):
+        return node.id
+    return repr(_number(node))
+
+
+class _Validate(ast.NodeVisitor):
+    """ Reject anything outside the cut grammar, and rename variables via aliases """
+
+    allowed = (
+        ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+        ast.Compare, ast.BinOp, ast.Name, ast.Load,
+        *_NUMBER_NODES, *_COMPARISONS, *_ARITHMETIC,
+    )
+
+    def __init__(self, cut: str, aliases: Dict[str, str]):
+        self.cut = cut
+        self.aliases = aliases
+
+    def generic_visit(self, node):
+        if isinstance(node, ast.Call):
+            if getattr(node.func, "id", None) != "abs" or len(node.args) != 1 or node.keywords:
+                raise ValueError(f"Only abs() can be called in a cut, not {ast.dump(node.func)} in {self.cut!r}")
+            return self.visit(node.args[0])
+        if not isinstance(node, self.allowed):
+            raise ValueError(f"Unsupported expression {type(node).__name__} in cut {self.cut!r}")
+        if isinstance(node, _NUMBER_NODES) and not isinstance(_number(node), (int, float)):
+            raise ValueError(f"Only numeric constants are allowed in cut {self.cut!r}")
+        if isinstance(node, ast.Name):
+            node.id = self.aliases.get(node.id, node.id)
+        super().generic_visit(node)
+
+
+@attr.s(frozen=True)
+class CompiledCut:
+    cut: str = attr.ib()
+    variables: Tuple[str, ...] = attr.ib()
+    tree: ast.Expression = attr.ib(repr=False)
+    numexpr_string: str = attr.ib(repr=False)
+
+    def __call__(self, columns: Columns, backend: Optional[str] = None) -> np.ndarray:
+        """
+        Evaluate the cut
+        :param columns: DataFrame or dict of equal-length arrays holding every variable in self.variables
+        :param backend: "numexpr" or "numpy". Defaults to numexpr when it is installed.
+        :return: Boolean numpy array, True for rows passing the cut
+        """
+        n_rows = len(columns) if isinstance(columns, pd.DataFrame) else len(columns[self.variables[0]])
+        local_dict = {v: np.asarray(columns[v]) for v in self.variables}
+        if backend is None:
+            # numexpr has no small integer types, e.g. the uint8 flags from misc/dtypes.py
+            supported = numexpr is not None and all(a.dtype in _NUMEXPR_DTYPES for a in local_dict.values())
+            backend = "numexpr" if supported else "numpy"
+        if backend == "numexpr":
+            mask = numexpr.evaluate(self.numexpr_string, local_dict=local_dict)
+        else:
+            mask = _truth(_evaluate(self.tree.body, columns))
+        return np.broadcast_to(mask, (n_rows,))
+
+    def values(self, columns: Columns) -> np.ndarray:
+        """
+        Evaluate the expression without turning it into a mask, e.g. "abs(M - 0.135)" gives the distance of every
+        row from 0.135
+        :param columns: DataFrame or dict of equal-length arrays holding every variable in self.variables
+        :return: numpy array
+        """
+        n_rows = len(columns) if isinstance(columns, pd.DataFrame) else len(columns[self.variables[0]])
+        return np.broadcast_to(_evaluate(self.tree.body, columns), (n_rows,))
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        """ Rows of df passing the cut, with a fresh index """
+        return df[self(df)].reset_index(drop=True)
+
+    def bounds(self) -> Dict[str, Tuple[float, float]]:
+        """
+        Ranges each variable must lie in for a row to pass the cut, e.g. {"Mbc": (5.27, 5.285)} for
+        "isSignal && Mbc > 5.27 && Mbc < 5.285". Conservative: a row outside them can't pass, but one inside
+        may still fail. Used to skip chunks of data via their min/max (see misc/zone_map.py).
+        :return: dict of variable name to closed (lower, upper) interval
+        """
+        return _bounds(self.tree.body)
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile(cut: str, aliases: Tuple[Tuple[str, str], ...]) -> CompiledCut:
+    tree = ast.parse(to_python(cut), mode="eval")
+    _Validate(cut, dict(aliases)).visit(tree)
+    body = tree.body
+    functions = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+    names = [node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and id(node) not in functions]
+    if not names:
+        raise ValueError(f"Cut {cut!r} doesn't depend on any variable")
+    numexpr_string = _to_numexpr(body) if _is_boolean(body) else f"({_to_numexpr(body)} != 0)"
+    return CompiledCut(cut=cut, variables=tuple(dict.fromkeys(names)), tree=tree, numexpr_string=numexpr_string)
+
+
+def compile_cut(cut: str, aliases: Optional[Dict[str, str]] = None) -> CompiledCut:
+    """
+    Parse a cut once into a reusable, vectorised evaluator. Results are cached, so compiling the same cut again
+    is free.
+    :param cut: basf2/ROOT-style cut, e.g. "isSignal && abs(deltaE) < 0.2"
+    :param aliases: Optional renaming of variables to ntuple columns, e.g. {"electronID": "e_electronID"}
+    :return: CompiledCut
+    """
+    return _compile(cut, tuple(sorted((aliases or {}).items())))
+
+
+def cut_variables(where: Optional[str]) -> List[str]:
+    """
+    Names of the columns a cut string depends on
+    :param where: ROOT-style cut string, e.g. "isSignal && Mbc > 5.27"
+    :return: List of column names
+    """
+    if where is None:
+        return []
+    return list(compile_cut(where).variables)
+
+
+def where_mask(df: Columns, where: str) -> np.ndarray:
+    """
+    Evaluate a ROOT-style cut string against columns already in memory
+    :param df: DataFrame (or dict of arrays) holding every column the cut uses
+    :param where: ROOT-style cut string
+    :return: Boolean numpy array, True for rows passing the cut
+    """
+    return compile_cut(where)(df)
+
+
+def _load_cuts(path: Optional[str] = None) -> dict:
+    import yaml
+    from constants.locations import PROJECT_ROOT
+
+    path = path or os.path.join(PROJECT_ROOT, "my_reconstruction", "config", "cuts.yaml")
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+
+def reconstruction_cuts(particle: str, path: Optional[str] = None) -> Dict[str, str]:
+    """
+    The named cuts of one particle in cuts.yaml, e.g. {"reco": "Mbc > 5.1 and Mbc < 5.4"} for "B0"
+    :param particle: Particle name, as in cuts.yaml
+    :param path: Location of the yaml file, defaults to my_reconstruction/config/cuts.yaml
+    :return: dict of cut name to cut string, empty if the particle has no cuts
+    """
+    return dict(_load_cuts(path).get(particle) or {})
+
+
+def particle_cuts(path: Optional[str] = None) -> dict:
+    """
+    Read the named particle-list cuts in cuts.yaml
+    :param path: Location of the yaml file, defaults to my_reconstruction/config/cuts.yaml
+    :return: dict of particle name to my_particle.Particle, with one Cut per named cut (category "default")
+    """
+    from my_reconstruction.config.my_particle import Particle
+
+    particles = {}
+    for name, cuts in _load_cuts(path).items():
+        particle = Particle(name)
+        for cut_name, cut_string in cuts.items():
+            particle.add_cut(name=cut_name, cut_string=cut_string, category="default")
+        particles[name] = particle
+    return particles
@@ -0,0 +1,236 @@
+"""selection/optimise.py
+Cut optimisation from cumulative histograms. Signal and background are binned finely once per variable, after
+which the signal and background passing every threshold are a cumulative sum away, so a whole figure-of-merit
+curve costs O(bins) instead of one pass over the candidates per threshold.
+Several variables are optimised together by iterating: each pass fills every variable's histograms with the
+current cuts on all the other variables applied ("N-1"), then moves each threshold to the best point of its curve.
+Candidates are weighted so that the signal adds up to the predicted yield of misc/predicted_yields.py; the
+background (mis-reconstructed candidates) gets the same per-event weight, times its retentionWeight in files whose
+background was prescaled (my_reconstruction/retention.py).
+Usage:
+    result = optimise("jpsi2ee_eta2gammagamma", [ScanVariable("Mbc", ">", 5.2, 5.29),
+                                                ScanVariable("abs(deltaE)", "<", 0, 0.5)])
+    result.cuts  # e.g. {"Mbc": "Mbc > 5.2712", "abs(deltaE)": "abs(deltaE) < 0.1015"}
+"""
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import attr
+import numpy as np
+import pandas as pd
+
+from selection.cuts import compile_cut, cut_variables
+
+# Significance (in sigma) the Punzi figure of merit is tuned for
+PUNZI_SIGMA = 3
+
+_ABS = re.compile(r"^abs\((?P<column>\w+)\)$")
+
+
+def significance(s: np.ndarray, b: np.ndarray, s_total: float) -> np.ndarray:
+    """ S / sqrt(S + B) """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(s + b > 0, s / np.sqrt(s + b), 0)
+
+
+def punzi(s: np.ndarray, b: np.ndarray, s_total: float) -> np.ndarray:
+    """ Punzi figure of merit, eff_S / (a / 2 + sqrt(B)) with a = PUNZI_SIGMA """
+    return (s / s_total if s_total > 0 else np.zeros_like(s)) / (PUNZI_SIGMA / 2 + np.sqrt(np.maximum(b, 0)))
+
+
+FIGURES_OF_MERIT = dict(significance=significance, punzi=punzi)
+
+
+def candidate_weight(decay: str) -> float:
+    """
+    Weight making the signal candidates of a mode add up to its predicted yield (misc/predicted_yields.py)
+    :param decay: The decay mode in question
+    :return: float
+    """
+    from efficiencies.service import EFFICIENCIES
+    from misc.predicted_yields import predicted_info
+
+    version = EFFICIENCIES.versions([decay])[decay]
+    nsig = EFFICIENCIES.nsig(decay, version)
+    return predicted_info(decay, version=version)["tot"] / nsig if nsig else 1.0
+
+
+@attr.s
+class ScanVariable:
+    # Column, or abs(column)
+    expression: str = attr.ib()
+    # ">" scans cuts keeping expression > threshold, "<" keeps expression < threshold
+    direction: str = attr.ib(validator=attr.validators.in_([">", "<"]))
+    low: float = attr.ib()
+    high: float = attr.ib()
+    n_bins: int = attr.ib(default=1000)
+
+    @property
+    def column(self) -> str:
+        match = _ABS.match(self.expression)
+        return self.expression if match is None else match.group("column")
+
+    @property
+    def edges(self) -> np.ndarray:
+        return np.linspace(self.low, self.high, self.n_bins + 1)
+
+    def values(self, df: pd.DataFrame) -> np.ndarray:
+        values = df[self.column].to_numpy(dtype=float)
+        return values if self.column == self.expression else np.abs(values)
+
+    def cut(self, threshold: float) -> str:
+        return f"{self.expression} {self.direction} {threshold:.6g}"
+
+    def bin_index(self, values: np.ndarray) -> np.ndarray:
+        """ Bin of each value, with 0 for underflow and n_bins + 1 for overflow """
+        return np.searchsorted(self.edges, values, side="right")
+
+    def passing(self, hist: np.ndarray) -> np.ndarray:
+        """
+        Weight passing the cut at every edge, from a histogram with underflow and overflow bins
+        :return: numpy array, one entry per edge
+        """
+        if self.direction == ">":
+            # Bins from the one starting at edge k, up to the overflow
+            return np.cumsum(hist[::-1])[::-1][1:]
+        # Bins below edge k, from the underflow
+        return np.cumsum(hist)[:-1]
+
+
+def fill(chunks: Iterable[pd.DataFrame], variables: List[ScanVariable], cuts: Dict[str, str],
+         weight: float = 1.0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Weighted signal and background histograms of every variable, each with the cuts on the other variables applied
+    :param chunks: DataFrames with isSignal and every column used, and optionally retentionWeight
+    :param variables: Variables to histogram
+    :param cuts: dict of variable expression to its current cut. Variables without an entry are not cut on.
+    :param weight: Weight of every candidate, multiplied by its retentionWeight where the chunks have one
+    :return: Tuple of arrays (signal, background) of shape (variables, n_bins + 2)
+    """
+    n_bins = max(v.n_bins for v in variables) + 2
+    signal = np.zeros((len(variables), n_bins))
+    background = np.zeros((len(variables), n_bins))
+    from my_reconstruction.retention import WEIGHT_COLUMN
+
+    for chunk in chunks:
+        is_signal = chunk["isSignal"].to_numpy() == 1
+        weights = weight * (chunk[WEIGHT_COLUMN].to_numpy(dtype=float) if WEIGHT_COLUMN in chunk
+                            else np.ones(len(chunk)))
+        passes = {v.expression: compile_cut(cuts[v.expression])(chunk) if v.expression in cuts else None
+                  for v in variables}
+        for i, variable in enumerate(variables):
+            keep = np.ones(len(chunk), dtype=bool)
+            for other, mask in passes.items():
+                if other != variable.expression and mask is not None:
+                    keep &= mask
+            values = variable.values(chunk)
+            # NaN fails every cut
+            keep &= ~np.isnan(values)
+            index = variable.bin_index(values)
+            for hist, selected in ((signal, keep & is_signal), (background, keep & ~is_signal)):
+                hist[i] += np.bincount(index[selected], weights=weights[selected], minlength=n_bins)[:n_bins]
+    return signal, background
+
+
+@attr.s
+class OptimisationResult:
+    variables: List[ScanVariable] = attr.ib()
+    thresholds: Dict[str, float] = attr.ib()
+    # Per variable: DataFrame with threshold, s, b and fom, from the last iteration
+    curves: Dict[str, pd.DataFrame] = attr.ib()
+    iterations: int = attr.ib()
+
+    @property
+    def cuts(self) -> Dict[str, str]:
+        return {v.expression: v.cut(self.thresholds[v.expression]) for v in self.variables}
+
+    @property
+    def summary(self) -> pd.DataFrame:
+        rows = []
+        for variable in self.variables:
+            curve = self.curves[variable.expression]
+            best = curve.loc[curve["threshold"] == self.thresholds[variable.expression]].iloc[0]
+            rows.append(dict(variable=variable.expression, cut=variable.cut(best["threshold"]), s=best["s"],
+                             b=best["b"], fom=best["fom"]))
+        return pd.DataFrame(rows)
+
+
+def optimise(decay: str, variables: List[ScanVariable], fom: str = "punzi", key: str = "b0",
+             where: Optional[str] = None, max_iterations: int = 5, chunksize: int = 100000,
+             weight: Optional[float] = None) -> OptimisationResult:
+    """
+    Optimise cuts on several variables of one mode together
+    :param decay: The decay mode in question
+    :param variables: Variables to cut on
+    :param fom: "punzi" or "significance"
+    :param key: The tree within the .root file
+    :param where: Cuts applied before optimising (e.g. preselection)
+    :param max_iterations: Stop after this many passes, even if the cuts are still moving
+    :param chunksize: Number of candidates read at a time
+    :param weight: Weight of every candidate, defaults to predicted yield / number of signal candidates. Candidates
+    of prescaled files are further weighted by their retentionWeight.
+    :return: OptimisationResult
+    """
+    from misc.utils import iter_merged_df, merged_columns
+    from my_reconstruction.retention import WEIGHT_COLUMN
+
+    weight = candidate_weight(decay) if weight is None else weight
+    figure_of_merit = FIGURES_OF_MERIT[fom]
+    columns = list(dict.fromkeys(["isSignal"] + [v.column for v in variables] + cut_variables(where)))
+    if WEIGHT_COLUMN in merged_columns(decay, key):
+        columns.append(WEIGHT_COLUMN)
+
+    thresholds, cuts, curves = {}, {}, {}
+    iteration = 0
+    for iteration in range(1, max_iterations + 1):
+        chunks = iter_merged_df(decay, key=key, where=where, columns=columns, chunksize=chunksize)
+        signal, background = fill(chunks, variables, cuts, weight=weight)
+        previous = dict(thresholds)
+        for i, variable in enumerate(variables):
+            hist_s, hist_b = signal[i, :variable.n_bins + 2], background[i, :variable.n_bins + 2]
+            s, b = variable.passing(hist_s), variable.passing(hist_b)
+            values = figure_of_merit(s, b, hist_s.sum())
+            best = int(np.argmax(values))
+            curves[variable.expression] = pd.DataFrame(dict(threshold=variable.edges, s=s, b=b, fom=values))
+            thresholds[variable.expression] = float(variable.edges[best])
+            cuts[variable.expression] = variable.cut(thresholds[variable.expression])
+        if thresholds == previous:
+            break
+    return OptimisationResult(variables=variables, thresholds=thresholds, curves=curves, iterations=iteration)
+
+
+def optimise_all(variables: List[ScanVariable], decays: Optional[Iterable[str]] = None, fom: str = "punzi",
+                 max_workers: Optional[int] = None, **kwargs) -> Dict[str, OptimisationResult]:
+    """
+    optimise for several modes, one process per mode
+    :param variables: Variables to cut on
+    :param decays: Modes, defaults to all modes of the analysis
+    :param fom: "punzi" or "significance"
+    :param max_workers: Number of modes optimised at once
+    :param kwargs: Passed on to optimise
+    :return: dict of decay to OptimisationResult
+    """
+    import functools
+    from concurrent.futures import ProcessPoolExecutor
+    from constants.mode_info import mode2latex
+
+    decays = list(mode2latex if decays is None else decays)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        results = pool.map(functools.partial(optimise, variables=variables, fom=fom, **kwargs), decays)
+        return dict(zip(decays, results))
+
+
+# Mbc, deltaE and vertex quality, in the b0 tree
+DEFAULT_VARIABLES = [
+    ScanVariable("Mbc", ">", 5.2, 5.29),
+    ScanVariable("abs(deltaE)", "<", 0, 0.5),
+    ScanVariable("chiProb", ">", 0, 1),
+]
+
+
+if __name__ == "__main__":
+    import sys
+
+    for decay, result in optimise_all(DEFAULT_VARIABLES, sys.argv[1:] or None).items():
+        print(f"{decay} ({result.iterations} iterations)")
+        print(result.summary)
@@ -0,0 +1,170 @@
+"""selection/separation.py
+Rank every ntuple column by how well it separates signal (isSignal == 1) from background: ROC AUC, Kolmogorov-
+Smirnov distance and the histogram separation <S^2> = 1/2 sum (p_s - p_b)^2 / (p_s + p_b).
+All three come from fine signal and background histograms of each column, filled in one chunked pass. The
+histogram ranges come from the min/max statistics in the Parquet cache footer (see misc/zone_map.py), so no extra
+pass is needed to find them. Columns are split between worker processes, each reading only its own columns.
+Usage:
+    ranking("jpsi2ee_eta2gammagamma").head(20)
+    $ python selection/separation.py [<decay>,...]
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from my_reconstruction.retention import RETAINED_COLUMN, WEIGHT_COLUMN
+
+# Truth information and bookkeeping, which would separate perfectly for the wrong reasons (retentionWeight is 1 for
+# signal only)
+EXCLUDED_PREFIXES = ("isSignal", "mc", "MC", "genMother", "__", WEIGHT_COLUMN, RETAINED_COLUMN)
+
+N_BINS = 1000
+
+
+def candidate_columns(decay: str, key: str = "b0") -> List[str]:
+    """
+    Numeric columns of a tree worth ranking
+    :param decay: The decay mode in question
+    :param key: The tree within the .root file
+    :return: List of column names
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from misc.columnar import build_cache
+
+    schema = pq.ParquetFile(build_cache(decay=decay, key=key)).schema_arrow
+    return [field.name for field in schema
+            if (pa.types.is_floating(field.type) or pa.types.is_integer(field.type))
+            and not field.name.startswith(EXCLUDED_PREFIXES)]
+
+
+def column_ranges(decay: str, columns: List[str], key: str = "b0") -> Dict[str, Tuple[float, float]]:
+    """
+    Range of every column, from the row group statistics of the Parquet cache
+    :return: dict of column to (min, max); (-inf, inf) for columns without statistics
+    """
+    import pyarrow.parquet as pq
+    from misc.columnar import build_cache
+    from misc.zone_map import parquet_zone_map
+
+    zones = parquet_zone_map(pq.ParquetFile(build_cache(decay=decay, key=key)), columns)
+    ranges = {}
+    for column in columns:
+        if column in zones.mins and len(zones.mins[column]):
+            with np.errstate(invalid="ignore"):
+                ranges[column] = (float(np.nanmin(zones.mins[column])), float(np.nanmax(zones.maxs[column])))
+        else:
+            ranges[column] = (-np.inf, np.inf)
+    return ranges
+
+
+def scores(signal: np.ndarray, background: np.ndarray) -> Dict[str, float]:
+    """
+    Separation scores of one column from its signal and background histograms (same bins, in increasing order)
+    :return: dict with auc (probability a signal value is above a background one, ties counted half), ks and
+    separation
+    """
+    n_s, n_b = signal.sum(), background.sum()
+    if n_s == 0 or n_b == 0:
+        return dict(auc=np.nan, ks=np.nan, separation=np.nan)
+    p_s, p_b = signal / n_s, background / n_b
+    cdf_b = np.cumsum(p_b)
+    auc = float(np.sum(p_s * (cdf_b - p_b / 2)))
+    ks = float(np.max(np.abs(np.cumsum(p_s) - cdf_b)))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        separation = float(0.5 * np.nansum((p_s - p_b) ** 2 / (p_s + p_b)))
+    return dict(auc=auc, ks=ks, separation=separation)
+
+
+def fill(chunks: Iterable[pd.DataFrame], ranges: Dict[str, Tuple[float, float]],
+         n_bins: int = N_BINS) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Signal and background histograms of every column, with an underflow and an overflow bin. NaNs are dropped.
+    Candidates are weighted by their retentionWeight where the chunks have one.
+    :param chunks: DataFrames with isSignal and the columns of ranges, and optionally retentionWeight
+    :param ranges: dict of column to (min, max) of its histogram
+    :return: dict of column to (signal, background) histograms
+    """
+    edges = {c: np.linspace(low, high, n_bins + 1) for c, (low, high) in ranges.items()}
+    hists = {c: (np.zeros(n_bins + 2), np.zeros(n_bins + 2)) for c in ranges}
+    for chunk in chunks:
+        is_signal = chunk["isSignal"].to_numpy() == 1
+        weights = chunk[WEIGHT_COLUMN].to_numpy(dtype=float) if WEIGHT_COLUMN in chunk else np.ones(len(chunk))
+        for column, (signal, background) in hists.items():
+            values = chunk[column].to_numpy(dtype=float)
+            index = np.searchsorted(edges[column], values, side="right")
+            valid = ~np.isnan(values)
+            for hist, selected in ((signal, valid & is_signal), (background, valid & ~is_signal)):
+                hist += np.bincount(index[selected], weights=weights[selected], minlength=n_bins + 2)
+    return hists
+
+
+def _rank_columns(decay: str, columns: List[str], key: str, chunksize: int) -> List[dict]:
+    from misc.utils import iter_merged_df, merged_columns
+
+    ranges = column_ranges(decay, columns, key=key)
+    # Columns without statistics (or constant ones) are only ranked if their range is usable
+    usable = {c: r for c, r in ranges.items() if np.isfinite(r).all() and r[1] > r[0]}
+    weights = [WEIGHT_COLUMN] if WEIGHT_COLUMN in merged_columns(decay, key) else []
+    chunks = iter_merged_df(decay, key=key, columns=["isSignal"] + weights + list(usable), chunksize=chunksize)
+    rows = []
+    for column, (signal, background) in fill(chunks, usable).items():
+        rows.append(dict(column=column, n_sig=int(round(signal.sum())), n_bkg=int(round(background.sum())),
+                         **scores(signal, background)))
+    return rows
+
+
+def ranking(decay: str, columns: Optional[List[str]] = None, key: str = "b0", max_workers: Optional[int] = None,
+            chunksize: int = 100000) -> pd.DataFrame:
+    """
+    Columns of a mode ranked by separation power, best first
+    :param decay: The decay mode in question
+    :param columns: Columns to rank, defaults to candidate_columns
+    :param key: The tree within the .root file
+    :param max_workers: Number of worker processes, each handling a share of the columns
+    :param chunksize: Number of candidates read at a time
+    :return: pandas DataFrame with column, auc, ks, separation, n_sig, n_bkg (weighted by retentionWeight in
+    prescaled files) and rank. auc is towards signal being higher; max(auc, 1 - auc) is what the ranking uses.
+    """
+    import functools
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+
+    columns = candidate_columns(decay, key=key) if columns is None else list(columns)
+    n_groups = max(1, min(len(columns), max_workers or os.cpu_count() or 1))
+    groups = [columns[i::n_groups] for i in range(n_groups)]
+    with ProcessPoolExecutor(max_workers=n_groups) as pool:
+        results = pool.map(functools.partial(_rank_columns, decay, key=key, chunksize=chunksize), groups)
+        df = pd.DataFrame([row for rows in results for row in rows])
+    if df.empty:
+        return df
+
+    df["discrimination"] = np.maximum(df["auc"], 1 - df["auc"])
+    df = df.sort_values(["discrimination", "ks"], ascending=False, ignore_index=True)
+    df["rank"] = np.arange(1, len(df) + 1)
+    return df
+
+
+def rank_modes(decays: Optional[Iterable[str]] = None, **kwargs) -> pd.DataFrame:
+    """
+    ranking for several modes, one after the other (each already uses every core)
+    :return: pandas DataFrame of all rankings, with a decay column
+    """
+    from constants.mode_info import mode2latex
+
+    frames = []
+    for decay in (mode2latex if decays is None else decays):
+        df = ranking(decay, **kwargs)
+        df.insert(0, "decay", decay)
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+if __name__ == "__main__":
+    import sys
+
+    with pd.option_context("display.max_rows", 50, "display.width", 200):
+        for decay, df in rank_modes(sys.argv[1:] or None).groupby("decay", sort=False):
+            print(decay)
+            print(df.head(20))
@@ -0,0 +1,170 @@
+"""selection/signal_box.py
+Choice of the Mbc/deltaE signal box. Signal and background are binned once into 2D histograms; with their
+summed-area tables (2D prefix sums) the content of any box of whole bins is four lookups, so every box on the
+grid can be scored. With 100 x 100 bins that is 25 million boxes, done in one vectorised sweep per lower Mbc edge.
+Usage:
+    result = optimise_box("jpsi2ee_eta2gammagamma")
+    result.mbc, result.delta_e  # ((5.271, 5.287), (-0.08, 0.05)), say
+"""
+from typing import Dict, Iterable, Optional, Tuple
+
+import attr
+import numpy as np
+
+from selection.optimise import FIGURES_OF_MERIT, candidate_weight
+
+# The box used so far in plots/reconstruction.py
+DEFAULT_BOX = dict(mbc=(5.27, 5.285), delta_e=(-0.2, 0.2))
+
+
+
+def box_where(box: Dict[str, Tuple[float, float]]) -> str:
+    """ Cut string of a box of the form of DEFAULT_BOX """
+    (m_lower, m_upper), (e_lower, e_upper) = box["mbc"], box["delta_e"]
+    return f"Mbc > {m_lower} && Mbc < {m_upper} && deltaE > {e_lower} && deltaE < {e_upper}"
+
+
+MBC_EDGES = np.linspace(5.2, 5.3, 101)
+DELTA_E_EDGES = np.linspace(-0.3, 0.3, 101)
+
+
+def fill(chunks: Iterable, mbc_edges: np.ndarray = MBC_EDGES, delta_e_edges: np.ndarray = DELTA_E_EDGES,
+         weight: float = 1.0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Weighted 2D histograms of (Mbc, deltaE) for signal and background, one np.bincount per chunk.
+    Candidates outside the edges are dropped, as no box on this grid can contain them.
+    :param chunks: DataFrames with Mbc, deltaE and isSignal
+    :return: Tuple of arrays (signal, background) of shape (Mbc bins, deltaE bins)
+    """
+    shape = (len(mbc_edges) - 1, len(delta_e_edges) - 1)
+    signal, background = np.zeros(shape), np.zeros(shape)
+    for chunk in chunks:
+        i = np.searchsorted(mbc_edges, chunk["Mbc"].to_numpy(), side="right") - 1
+        j = np.searchsorted(delta_e_edges, chunk["deltaE"].to_numpy(), side="right") - 1
+        inside = (i >= 0) & (i < shape[0]) & (j >= 0) & (j < shape[1])
+        flat = np.ravel_multi_index((i[inside], j[inside]), shape)
+        is_signal = chunk["isSignal"].to_numpy()[inside] == 1
+        size = shape[0] * shape[1]
+        signal += weight * np.bincount(flat[is_signal], minlength=size).reshape(shape)
+        background += weight * np.bincount(flat[~is_signal], minlength=size).reshape(shape)
+    return signal, background
+
+
+def summed_area(hist: np.ndarray) -> np.ndarray:
+    """
+    Summed-area table with a leading row and column of zeros: table[i, j] is the content of bins [:i, :j]
+    :return: numpy array of shape (rows + 1, columns + 1)
+    """
+    table = np.zeros((hist.shape[0] + 1, hist.shape[1] + 1))
+    table[1:, 1:] = hist.cumsum(axis=0).cumsum(axis=1)
+    return table
+
+
+def box_content(table: np.ndarray, i0, i1, j0, j1):
+    """ Content of bins [i0:i1, j0:j1] from a summed-area table, for scalars or broadcastable arrays """
+    return table[i1, j1] - table[i0, j1] - table[i1, j0] + table[i0, j0]
+
+
+@attr.s
+class BoxResult:
+    mbc: Tuple[float, float] = attr.ib()
+    delta_e: Tuple[float, float] = attr.ib()
+    s: float = attr.ib()
+    b: float = attr.ib()
+    fom: float = attr.ib()
+    # Best figure of merit for each Mbc window [mbc_edges[i0], mbc_edges[i1]] (over all deltaE windows), and vice
+    # versa. Entries with i1 <= i0 are NaN.
+    mbc_landscape: np.ndarray = attr.ib()
+    delta_e_landscape: np.ndarray = attr.ib()
+    mbc_edges: np.ndarray = attr.ib()
+    delta_e_edges: np.ndarray = attr.ib()
+
+    @property
+    def where(self) -> str:
+        """ The box as a cut string """
+        return (f"Mbc > {self.mbc[0]:.6g} && Mbc < {self.mbc[1]:.6g} && "
+                f"deltaE > {self.delta_e[0]:.6g} && deltaE < {self.delta_e[1]:.6g}")
+
+    @property
+    def box(self) -> Dict[str, Tuple[float, float]]:
+        """ Same form as DEFAULT_BOX """
+        return dict(mbc=self.mbc, delta_e=self.delta_e)
+
+
+def scan_boxes(signal: np.ndarray, background: np.ndarray, mbc_edges: np.ndarray = MBC_EDGES,
+               delta_e_edges: np.ndarray = DELTA_E_EDGES, fom: str = "punzi") -> BoxResult:
+    """
+    Score every box of whole bins
+    :param signal: 2D histogram of signal, from fill
+    :param background: 2D histogram of background, from fill
+    :param fom: "punzi" or "significance", see selection/optimise.py
+    :return: BoxResult for the best box
+    """
+    figure_of_merit = FIGURES_OF_MERIT[fom]
+    sat_s, sat_b = summed_area(signal), summed_area(background)
+    n_i, n_j = signal.shape
+    s_total = signal.sum()
+    j0, j1 = np.meshgrid(np.arange(n_j + 1), np.arange(n_j + 1), indexing="ij")
+    valid_j = j1 > j0
+
+    mbc_landscape = np.full((n_i + 1, n_i + 1), np.nan)
+    delta_e_landscape = np.full((n_j + 1, n_j + 1), -np.inf)
+    best = (-np.inf, None)
+    for i0 in range(n_i):
+        # Every box with lower Mbc edge i0 at once: shape (upper Mbc edges, lower deltaE edges, upper deltaE edges)
+        i1 = np.arange(i0 + 1, n_i + 1)[:, None, None]
+        values = figure_of_merit(box_content(sat_s, i0, i1, j0, j1), box_content(sat_b, i0, i1, j0, j1), s_total)
+        values = np.where(valid_j, values, -np.inf)
+
+        mbc_landscape[i0, i0 + 1:] = values.max(axis=(1, 2))
+        delta_e_landscape = np.maximum(delta_e_landscape, values.max(axis=0))
+        index = np.unravel_index(np.argmax(values), values.shape)
+        if values[index] > best[0]:
+            best = (values[index], (i0, i0 + 1 + index[0], index[1], index[2]))
+
+    fom_value, (i0, i1, j0, j1) = best
+    delta_e_landscape[~valid_j] = np.nan
+    return BoxResult(
+        mbc=(float(mbc_edges[i0]), float(mbc_edges[i1])),
+        delta_e=(float(delta_e_edges[j0]), float(delta_e_edges[j1])),
+        s=float(box_content(sat_s, i0, i1, j0, j1)),
+        b=float(box_content(sat_b, i0, i1, j0, j1)),
+        fom=float(fom_value),
+        mbc_landscape=mbc_landscape,
+        delta_e_landscape=delta_e_landscape,
+        mbc_edges=mbc_edges,
+        delta_e_edges=delta_e_edges,
+    )
+
+
+def optimise_box(decay: str, fom: str = "punzi", where: Optional[str] = None, mbc_edges: np.ndarray = MBC_EDGES,
+                 delta_e_edges: np.ndarray = DELTA_E_EDGES, weight: Optional[float] = None,
+                 chunksize: int = 100000) -> BoxResult:
+    """
+    Best Mbc/deltaE box of one mode
+    :param decay: The decay mode in question
+    :param fom: "punzi" or "significance"
+    :param where: Cuts applied before choosing the box
+    :param mbc_edges: Grid of possible Mbc box edges
+    :param delta_e_edges: Grid of possible deltaE box edges
+    :param weight: Weight of every candidate, defaults to predicted yield / number of signal candidates
+    :param chunksize: Number of candidates read at a time
+    :return: BoxResult
+    """
+    from misc.utils import iter_merged_df
+    from selection.cuts import cut_variables
+
+    weight = candidate_weight(decay) if weight is None else weight
+    columns = list(dict.fromkeys(["Mbc", "deltaE", "isSignal"] + cut_variables(where)))
+    chunks = iter_merged_df(decay, where=where, columns=columns, chunksize=chunksize)
+    signal, background = fill(chunks, mbc_edges, delta_e_edges, weight=weight)
+    return scan_boxes(signal, background, mbc_edges, delta_e_edges, fom=fom)
+
+
+if __name__ == "__main__":
+    import sys
+    from constants.mode_info import mode2latex
+
+    for decay in sys.argv[1:] or mode2latex:
+        result = optimise_box(decay)
+        print(f"{decay}: {result.where} (S = {result.s:.2f}, B = {result.b:.2f}, FOM = {result.fom:.4g})")
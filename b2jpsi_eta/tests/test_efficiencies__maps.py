@@ -0,0 +1,55 @@
+"""Test for efficiencies/maps.py"""
+import numpy as np
+import pandas as pd
+
+from efficiencies.maps import SIGNAL_SIDE_COLUMN, fill_map, true_kinematics
+
+
+def _chunks(df, size):
+    return [df.iloc[i:i + size] for i in range(0, len(df), size)]
+
+
+def test_chunked_map_matches_histogram():
+    rng = np.random.default_rng(3)
+    n = 20000
+    generated = pd.DataFrame({"mcPX": rng.normal(0, 1, n), "mcPY": rng.normal(0, 1, n), "mcPZ": rng.normal(0.5, 1, n)})
+    generated[SIGNAL_SIDE_COLUMN] = 1.0
+    # Two candidates per event, either, both or neither truth-matched
+    event = np.repeat(np.arange(n), 2)
+    reconstructed = generated.iloc[event].reset_index(drop=True)
+    reconstructed["__experiment__"], reconstructed["__run__"], reconstructed["__event__"] = 0, 0, event
+    reconstructed["isSignal"] = rng.integers(0, 2, 2 * n).astype(float)
+
+    efficiency_map = fill_map(_chunks(generated, 7777), _chunks(reconstructed, 3333))
+
+    p, cos_theta = true_kinematics(generated)
+    bins = [efficiency_map.p_edges, efficiency_map.cos_theta_edges]
+    detected = reconstructed.groupby("__event__")["isSignal"].max().to_numpy() == 1
+    assert np.array_equal(efficiency_map.denominator, np.histogram2d(p, cos_theta, bins=bins)[0])
+    assert np.array_equal(efficiency_map.numerator, np.histogram2d(p[detected], cos_theta[detected], bins=bins)[0])
+    assert np.array_equal((efficiency_map + efficiency_map).numerator, 2 * efficiency_map.numerator)
+
+
+def test_other_b_is_left_out():
+    rng = np.random.default_rng(4)
+    n = 10000
+    signal_side = pd.DataFrame({"mcPX": rng.normal(0, 1, n), "mcPY": rng.normal(0, 1, n),
+                                "mcPZ": rng.normal(0.5, 1, n)})
+    # The other B of every event is generated too, and sometimes reconstructed and truth-matched first
+    other_side = pd.DataFrame({"mcPX": rng.normal(0, 1, n), "mcPY": rng.normal(0, 1, n), "mcPZ": rng.normal(0, 1, n)})
+    generated = pd.concat([signal_side.assign(**{SIGNAL_SIDE_COLUMN: 1.0}),
+                           other_side.assign(**{SIGNAL_SIDE_COLUMN: 0.0})]).sort_index(kind="stable")
+    detected = rng.uniform(size=n) < 0.3
+    reconstructed = pd.concat([other_side.assign(**{SIGNAL_SIDE_COLUMN: 0.0, "order": 0}),
+                               signal_side.assign(**{SIGNAL_SIDE_COLUMN: 1.0, "order": 1})])
+    reconstructed["__experiment__"], reconstructed["__run__"] = 0, 0
+    reconstructed["__event__"] = reconstructed.index
+    reconstructed["isSignal"] = np.concatenate([np.ones(n), detected]).astype(float)
+    reconstructed = reconstructed.sort_values(["__event__", "order"], kind="stable").reset_index(drop=True)
+
+    efficiency_map = fill_map(_chunks(generated, 999), _chunks(reconstructed, 777))
+
+    p, cos_theta = true_kinematics(signal_side)
+    bins = [efficiency_map.p_edges, efficiency_map.cos_theta_edges]
+    assert np.array_equal(efficiency_map.denominator, np.histogram2d(p, cos_theta, bins=bins)[0])
+    assert np.array_equal(efficiency_map.numerator, np.histogram2d(p[detected], cos_theta[detected], bins=bins)[0])
@@ -0,0 +1,53 @@
+"""Test for efficiencies/service.py"""
+import pytest
+
+from constants.mode_info import mode2latex
+from efficiencies import service
+
+
+@pytest.fixture
+def counted(monkeypatch):
+    """ Fake inputs: every mode at version "v1" with 1000 generated events and 50 signal candidates """
+    versions, calls = {decay: "v1" for decay in mode2latex}, dict(count_mode=[], source_version=[])
+
+    def source_version(decay):
+        calls["source_version"].append(decay)
+        return versions[decay]
+
+    def count_mode(decay):
+        calls["count_mode"].append(decay)
+        return 1000, 50 if versions[decay] == "v1" else 80
+
+    monkeypatch.setattr(service, "_source_version", source_version)
+    monkeypatch.setattr(service, "count_mode", count_mode)
+    return versions, calls
+
+
+def test_counts_are_memoized_per_version(counted):
+    versions, calls = counted
+    efficiencies = service.EfficiencyService()
+    decay = "jpsi2ee_eta2gammagamma"
+
+    assert efficiencies.eff(decay) == 0.05
+    assert efficiencies.nsig(decay) == 50 and efficiencies.n_gen(decay) == 1000
+    assert calls["count_mode"] == [decay]
+
+    # New shards: counted again at the new version, the old counts are kept under the old one
+    versions[decay] = "v2"
+    assert efficiencies.nsig(decay) == 80
+    assert efficiencies.nsig(decay, version="v1") == 50
+    assert calls["count_mode"] == [decay, decay]
+
+
+def test_versions_are_resolved_once_per_table(counted, monkeypatch):
+    from efficiencies import detection
+
+    _, calls = counted
+    efficiencies = service.EfficiencyService()
+    monkeypatch.setattr(detection, "EFFICIENCIES", efficiencies)
+    monkeypatch.setattr(service, "EFFICIENCIES", efficiencies)
+
+    rows = detection.DetectionEfficiencyTable("unused.tex").get_rows()
+    assert len(rows) == len(mode2latex)
+    assert sorted(calls["source_version"]) == sorted(mode2latex)
+    assert sorted(calls["count_mode"]) == sorted(mode2latex)
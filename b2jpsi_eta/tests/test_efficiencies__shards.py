@@ -0,0 +1,40 @@
+"""Test for efficiencies/shards.py"""
+import os
+
+import pytest
+
+from efficiencies import shards
+
+
+def _job(tmp_path, name, n_gen=100, nsig=1, shard=True):
+    path = os.path.join(str(tmp_path), f"{name}.root")
+    open(path, "w").close()
+    if shard:
+        shards.write_shard(path, n_gen=n_gen, nsig=nsig)
+
+
+def test_reduce_shards(tmp_path, monkeypatch):
+    import constants.locations
+    monkeypatch.setattr(constants.locations, "RECONSTRUCTED_FILES", str(tmp_path))
+
+    for job, nsig in [(10, 3), (2, 5), (0, 7)]:
+        _job(tmp_path, f"jpsi2ee_eta23pi0_{job}", nsig=nsig)
+    _job(tmp_path, "jpsi2mumu_eta23pi0_0")
+
+    files = [os.path.basename(p) for p in shards.shard_files("jpsi2ee_eta23pi0")]
+    assert files == [f"jpsi2ee_eta23pi0_{job}.eff.json" for job in (0, 2, 10)]
+    assert shards.reduce_shards("jpsi2ee_eta23pi0") == dict(n_gen=300, nsig=15, n_jobs=3)
+    assert shards.reduce_shards("jpsi2ee_eta2gammagamma")["n_jobs"] == 0
+
+
+def test_partial_shards_are_refused(tmp_path, monkeypatch):
+    import constants.locations
+    monkeypatch.setattr(constants.locations, "RECONSTRUCTED_FILES", str(tmp_path))
+
+    _job(tmp_path, "jpsi2ee_eta23pi0_0")
+    _job(tmp_path, "jpsi2ee_eta23pi0_1", shard=False)
+    with pytest.raises(ValueError, match="jpsi2ee_eta23pi0_1.root"):
+        shards.reduce_shards("jpsi2ee_eta23pi0")
+
+    shards.write_shard(os.path.join(str(tmp_path), "jpsi2ee_eta23pi0_1.root"), n_gen=100, nsig=1)
+    assert shards.reduce_shards("jpsi2ee_eta23pi0") == dict(n_gen=200, nsig=2, n_jobs=2)
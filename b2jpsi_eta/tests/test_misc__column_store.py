@@ -0,0 +1,73 @@
+"""Test for misc/column_store.py"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from misc import column_store
+
+
+@pytest.fixture
+def merged(tmp_path, monkeypatch):
+    """ A merged tree, already in the Parquet cache, with the hot columns and one more, over several zones """
+    import constants.locations
+    from misc.columnar import get_cache_file
+
+    monkeypatch.setattr(constants.locations, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(constants.locations, "MERGED_FILES", str(tmp_path / "merged"))
+    (tmp_path / "merged").mkdir()
+    (tmp_path / "merged" / "d.root").write_text("merged")
+
+    rng = np.random.default_rng(6)
+    n = 300000
+    df = pd.DataFrame({"Mbc": rng.uniform(5.2, 5.29, n), "deltaE": rng.uniform(-0.5, 0.5, n),
+                       "isSignal": rng.integers(0, 2, n).astype(float), "chiProb": rng.uniform(0, 1, n)})
+    (tmp_path / "cache" / "d").mkdir(parents=True)
+    df.to_parquet(get_cache_file("d"), index=False)
+    return df
+
+
+def test_build_store(merged):
+    path = column_store.build_store("d")
+    for column in column_store.HOT_COLUMNS:
+        assert np.array_equal(np.load(os.path.join(path, f"{column}.npy")), merged[column].to_numpy())
+
+    # The clustered copy is sorted by Mbc, and __entry__ points back at the original rows
+    clustered = os.path.join(path, "clustered")
+    entry = np.load(os.path.join(clustered, "__entry__.npy"))
+    mbc = np.load(os.path.join(clustered, "Mbc.npy"))
+    assert np.all(np.diff(mbc) >= 0)
+    assert np.array_equal(mbc, merged["Mbc"].to_numpy()[entry])
+    # Up to date, so not rebuilt
+    assert column_store.build_store("d") == path
+    assert np.array_equal(np.load(os.path.join(clustered, "__entry__.npy")), entry)
+
+
+@pytest.mark.parametrize("where, clustered", [
+    (None, False),
+    ("deltaE > 0.1 && isSignal == 1", False),
+    ("Mbc > 5.27 && deltaE < 0", True),
+    ("Mbc > 5.3", True),
+])
+def test_read_columns(merged, monkeypatch, where, clustered):
+    from misc.zone_map import ZoneMap
+
+    kept = []
+    candidates = ZoneMap.candidates
+    monkeypatch.setattr(ZoneMap, "candidates", lambda self, bounds: kept.append(candidates(self, bounds)) or kept[-1])
+
+    got = column_store.read_columns("d", where=where, columns=["deltaE", "isSignal"])
+    selected = merged if where is None else merged[merged.eval(where.replace("&&", "and"))]
+    pd.testing.assert_frame_equal(got, selected[["deltaE", "isSignal"]].reset_index(drop=True))
+    # Cuts on Mbc only read the zones of the clustered copy they can pass
+    assert bool(kept) == clustered
+    if clustered:
+        assert not kept[0].all()
+
+
+def test_covers():
+    assert column_store.covers(["Mbc", "isSignal"], "deltaE < 0.1")
+    assert not column_store.covers(None)
+    assert not column_store.covers(["Mbc", "chiProb"])
+    assert not column_store.covers(["Mbc"], "chiProb > 0.1")
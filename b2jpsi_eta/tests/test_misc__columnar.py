@@ -0,0 +1,115 @@
+"""Test for misc/columnar.py, and for iter_merged_df reading through it"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from misc import columnar
+
+
+@pytest.fixture
+def merged(tmp_path, monkeypatch):
+    """ A merged tree with columns x (increasing, so row groups have disjoint ranges) and y, read in chunks """
+    import constants.locations
+    import misc.event_table
+
+    monkeypatch.setattr(constants.locations, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(constants.locations, "MERGED_FILES", str(tmp_path / "merged"))
+    monkeypatch.setattr(misc.event_table, "_has_event_tree", lambda source, source_fingerprint: False)
+    monkeypatch.setattr(columnar, "ROW_GROUP_SIZE", 1000)
+    (tmp_path / "merged").mkdir()
+    (tmp_path / "merged" / "d.root").write_text("merged")
+
+    rng = np.random.default_rng(12)
+    df = pd.DataFrame({"x": np.sort(rng.uniform(0, 1, 10000)), "y": rng.normal(size=10000)})
+    reads = []
+
+    def read_root_chunks(source, key):
+        """ Stands in for root_pandas """
+        reads.append(source)
+        for start in range(0, len(df), 2500):
+            yield df.iloc[start:start + 2500]
+
+    monkeypatch.setattr(columnar, "_read_root_chunks", read_root_chunks)
+    return df, reads
+
+
+def _cache_files(tmp_path):
+    return sorted(os.listdir(tmp_path / "cache" / "d"))
+
+
+def test_build_cache(merged):
+    import pyarrow.parquet as pq
+
+    df, reads = merged
+    path = columnar.build_cache("d")
+    parquet_file = pq.ParquetFile(path)
+    # Row groups of ROW_GROUP_SIZE, which don't span the 2500-candidate chunks read from ROOT
+    sizes = [parquet_file.metadata.row_group(i).num_rows for i in range(parquet_file.num_row_groups)]
+    assert sizes == [1000, 1000, 500] * 4
+    pd.testing.assert_frame_equal(parquet_file.read().to_pandas(), df)
+    # Up to date, so not converted again
+    assert columnar.build_cache("d") == path
+    assert len(reads) == 1
+
+
+def test_stale_caches_are_removed(merged, tmp_path):
+    df, reads = merged
+    old = columnar.build_cache("d")
+    other_tree = columnar.build_cache("d", key="jpsi")
+
+    (tmp_path / "merged" / "d.root").write_text("merged again")
+    new = columnar.build_cache("d")
+    assert new != old
+    assert _cache_files(tmp_path) == sorted(os.path.basename(p) for p in [new, other_tree])
+    assert len(reads) == 3
+
+
+def test_failed_conversion_leaves_nothing(merged, tmp_path, monkeypatch):
+    df, _ = merged
+    path = columnar.get_cache_file("d")
+
+    def failing_chunks(source, key):
+        yield df.iloc[:2500]
+        # Readers never see the cache before it is complete
+        assert not os.path.exists(path)
+        raise OSError("Truncated file")
+
+    monkeypatch.setattr(columnar, "_read_root_chunks", failing_chunks)
+    with pytest.raises(OSError, match="Truncated"):
+        columnar.build_cache("d")
+    assert _cache_files(tmp_path) == []
+
+
+@pytest.mark.parametrize("chunksize", [999, 1000, 3333, 20000])
+def test_iter_merged_df_chunks(merged, chunksize):
+    from misc.utils import iter_merged_df
+
+    df, _ = merged
+    chunks = list(iter_merged_df("d", columns=["y", "x"], chunksize=chunksize))
+    assert all(len(chunk) <= chunksize for chunk in chunks)
+    assert len(chunks) == -(-len(df) // chunksize)
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), df[["y", "x"]])
+
+
+def test_iter_merged_df_skips_row_groups(merged, monkeypatch):
+    import pyarrow.parquet as pq
+
+    import misc.zone_map
+    from misc.utils import iter_merged_df
+
+    df, _ = merged
+    selected = []
+    row_groups = misc.zone_map.parquet_row_groups
+    monkeypatch.setattr(misc.zone_map, "parquet_row_groups",
+                        lambda parquet_file, where: selected.append(row_groups(parquet_file, where)) or selected[-1])
+
+    chunks = list(iter_merged_df("d", columns=["y"], where="x > 0.75 && y > 0", chunksize=1500))
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True),
+                                  df.query("x > 0.75 and y > 0")[["y"]].reset_index(drop=True))
+    # x is increasing, so only the row groups reaching above 0.75 are read
+    metadata = pq.ParquetFile(columnar.get_cache_file("d")).metadata
+    stops = np.cumsum([metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)])
+    assert list(selected[0]) == [i for i, stop in enumerate(stops) if df["x"].iloc[stop - 1] > 0.75]
+    assert len(selected[0]) < metadata.num_row_groups / 2
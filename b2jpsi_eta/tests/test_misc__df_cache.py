@@ -0,0 +1,72 @@
+"""Test for misc/df_cache.py"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from misc.df_cache import DataFrameCache, nbytes
+
+
+@pytest.fixture()
+def tree():
+    return pd.DataFrame({
+        "Mbc": np.linspace(5.2, 5.3, 100),
+        "deltaE": np.linspace(-0.5, 0.5, 100),
+        "isSignal": (np.arange(100) % 2).astype(float),
+    })
+
+
+class CountingLoader:
+    def __init__(self, tree):
+        self.tree = tree
+        self.calls = 0
+
+    def __call__(self, decay, key, where, columns):
+        self.calls += 1
+        df = self.tree if columns is None else self.tree[columns]
+        return df.copy()
+
+
+def test_exact_hit(tree):
+    cache = DataFrameCache()
+    loader = CountingLoader(tree)
+    first = cache.get("decay", "b0", ["Mbc"], None, loader=loader)
+    second = cache.get("decay", "b0", ["Mbc"], None, loader=loader)
+    assert loader.calls == 1
+    assert cache.hits == 1
+    pd.testing.assert_frame_equal(first, second)
+
+
+def test_narrower_request_sliced_from_superset(tree):
+    cache = DataFrameCache()
+    loader = CountingLoader(tree)
+    cache.get("decay", "b0", ["Mbc", "deltaE", "isSignal"], None, loader=loader)
+
+    df = cache.get("decay", "b0", ["Mbc"], "isSignal && deltaE > 0", loader=loader)
+    assert loader.calls == 1
+    assert list(df.columns) == ["Mbc"]
+    expected = tree[(tree.isSignal == 1) & (tree.deltaE > 0)]["Mbc"].reset_index(drop=True)
+    pd.testing.assert_series_equal(df["Mbc"], expected)
+
+
+def test_cut_cache_does_not_answer_other_cut(tree):
+    cache = DataFrameCache()
+    loader = CountingLoader(tree)
+    cache.get("decay", "b0", ["Mbc", "isSignal"], "isSignal", loader=loader)
+    cache.get("decay", "b0", ["Mbc", "isSignal"], "isSignal!=1", loader=loader)
+    cache.get("other_decay", "b0", ["Mbc", "isSignal"], "isSignal", loader=loader)
+    assert loader.calls == 3
+
+
+def test_eviction_respects_budget(tree):
+    size = nbytes(tree[["Mbc"]])
+    cache = DataFrameCache(max_bytes=int(2.5 * size))
+    loader = CountingLoader(tree)
+    for column in ("Mbc", "deltaE", "isSignal"):
+        cache.get("decay", "b0", [column], None, loader=loader)
+    assert cache.current_bytes <= cache.max_bytes
+
+    # Least recently used entry ("Mbc") was evicted, the newest is still there
+    cache.get("decay", "b0", ["isSignal"], None, loader=loader)
+    assert loader.calls == 3
+    cache.get("decay", "b0", ["Mbc"], None, loader=loader)
+    assert loader.calls == 4
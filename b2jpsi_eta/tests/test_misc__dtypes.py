@@ -0,0 +1,48 @@
+"""Test for misc/dtypes.py"""
+import numpy as np
+import pandas as pd
+
+from misc.dtypes import compact_dtypes, slice_report
+
+
+def _ntuple(n=1000, seed=11):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "Mbc": rng.uniform(5.2, 5.3, n),
+        "isSignal": rng.integers(0, 2, n).astype(float),
+        "isSignalAcceptMissingGamma": np.where(np.arange(n) % 10 == 0, np.nan, 1.0),
+        "mcPDG": rng.choice([-511.0, 511.0], n),
+        "__event__": np.arange(n, dtype=float) + 70000,
+        "huge": rng.uniform(1, 2, n) * 1e300,
+        "tiny": rng.uniform(1, 2, n) * 1e-40,
+        "zero_or_nan": np.where(np.arange(n) % 2 == 0, 0.0, np.nan),
+        "name": "x",
+    })
+
+
+def test_compact_dtypes():
+    df = _ntuple()
+    compact, report = compact_dtypes(df)
+
+    assert compact["Mbc"].dtype == np.float32
+    assert np.all(np.abs(compact["Mbc"].to_numpy() - df["Mbc"].to_numpy()) <= 2.0 ** -24 * df["Mbc"].abs())
+    assert compact["isSignal"].dtype == bool
+    # NaN flags can't be integers
+    assert compact["isSignalAcceptMissingGamma"].dtype == np.float32
+    assert compact["mcPDG"].dtype == np.int16 and compact["__event__"].dtype == np.uint32
+    # Out of float32's range, or subnormal in it
+    assert compact["huge"].dtype == np.float64 and compact["tiny"].dtype == np.float64
+    assert compact["zero_or_nan"].dtype == np.float32
+    assert compact["name"].dtype == df["name"].dtype
+    assert df["Mbc"].dtype == np.float64
+
+    assert report.loc["Mbc", "saved"] == 4 * len(df) and report.loc["huge", "saved"] == 0
+    assert list(report.index) == list(df.columns)
+
+
+def test_slice_report():
+    df = _ntuple()
+    compact, report = compact_dtypes(df)
+    part = compact.iloc[100:300][["Mbc", "isSignal", "huge", "name"]]
+    expected = compact_dtypes(df.iloc[100:300][["Mbc", "isSignal", "huge", "name"]])[1]
+    pd.testing.assert_frame_equal(slice_report(report, part), expected, check_dtype=False)
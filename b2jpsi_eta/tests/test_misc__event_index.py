@@ -0,0 +1,57 @@
+"""Test for misc/event_index.py"""
+import numpy as np
+import pandas as pd
+
+from misc.event_index import RANK_COLUMN, EventIndex, daughter_column, join_rows
+
+
+def _tree(rng, n):
+    df = pd.DataFrame({
+        "__experiment__": np.full(n, 1003),
+        "__run__": rng.integers(0, 3, n),
+        "__event__": rng.integers(0, 500, n),
+    })
+    df["__candidate__"] = df.groupby(["__run__", "__event__"]).cumcount()
+    return df
+
+
+def _decays(rng, n_events=400):
+    """ J/psi candidates, numbered per event, and B candidates each built from one of them """
+    n_jpsi = rng.integers(1, 4, n_events)
+    jpsi = pd.DataFrame({"__experiment__": 1003, "__run__": 1, "__event__": np.repeat(np.arange(n_events), n_jpsi)})
+    jpsi[RANK_COLUMN] = (jpsi.groupby("__event__").cumcount() + 1).astype(float)
+    jpsi["jpsi_id"] = np.arange(len(jpsi))
+
+    # Each B takes a random J/psi of its event; a few B have a daughter missing from the jpsi tree
+    b0 = jpsi.sample(n=2 * len(jpsi), replace=True, random_state=3).reset_index(drop=True)
+    b0 = b0.rename(columns={RANK_COLUMN: daughter_column("jpsi"), "jpsi_id": "true_jpsi_id"})
+    missing = rng.random(len(b0)) < 0.05
+    b0.loc[missing, daughter_column("jpsi")] = np.nan
+    b0.loc[missing, "true_jpsi_id"] = -1
+    b0["__candidate__"] = b0.groupby("__event__").cumcount()
+
+    # The trees are written in their own order, not grouped by event
+    return b0.sample(frac=1, random_state=4).reset_index(drop=True), jpsi.sample(frac=1, random_state=5)
+
+
+def test_join_pairs_each_b_with_its_own_daughter():
+    rng = np.random.default_rng(2)
+    b0, jpsi = _decays(rng)
+    jpsi = jpsi.reset_index(drop=True)
+
+    left_rows, right_rows = join_rows(EventIndex.from_df(b0), b0[daughter_column("jpsi")].to_numpy(),
+                                      EventIndex.from_df(jpsi, candidate_column=RANK_COLUMN))
+
+    assert np.array_equal(left_rows, np.flatnonzero(b0["true_jpsi_id"] >= 0))
+    assert np.array_equal(jpsi["jpsi_id"].to_numpy()[right_rows], b0["true_jpsi_id"].to_numpy()[left_rows])
+
+
+def test_lookup_matches_pandas_merge():
+    rng = np.random.default_rng(2)
+    left, right = _tree(rng, 2000), _tree(rng, 1500)
+    left_index, right_index = EventIndex.from_df(left), EventIndex.from_df(right)
+
+    rows = right_index.lookup(left_index.row_keys, left["__candidate__"].to_numpy())
+    exact = left.merge(right.reset_index(), how="left",
+                       on=["__experiment__", "__run__", "__event__", "__candidate__"])
+    assert np.array_equal(rows, exact["index"].fillna(-1).astype(int).to_numpy())
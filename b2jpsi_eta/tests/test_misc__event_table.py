@@ -0,0 +1,58 @@
+"""Test for misc/event_table.py"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from misc.event_index import EVENT_COLUMNS
+
+
+@pytest.fixture
+def normalized(tmp_path, monkeypatch):
+    """ A merged file in the normalized layout: a b0 tree with several candidates per event, and an event tree """
+    import constants.locations
+    from misc.columnar import get_cache_file
+    from misc.df_cache import DF_CACHE
+
+    monkeypatch.setattr(constants.locations, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(constants.locations, "MERGED_FILES", str(tmp_path / "merged"))
+    (tmp_path / "merged").mkdir()
+    (tmp_path / "merged" / "d.root").write_text("merged")
+    (tmp_path / "cache" / "d").mkdir(parents=True)
+    DF_CACHE.clear()
+
+    rng = np.random.default_rng(10)
+    n_events = 3000
+    # Events 0 and 1 have no candidate; the candidates of the last event are missing from the event tree
+    events = pd.DataFrame({"__experiment__": 0, "__run__": np.repeat([1, 2], n_events // 2),
+                           "__event__": np.arange(n_events), "thrust": rng.uniform(0.5, 1, n_events)})
+    multiplicity = rng.integers(1, 6, n_events)
+    multiplicity[:2] = 0
+    candidates = events.loc[np.repeat(np.arange(n_events), multiplicity), EVENT_COLUMNS].reset_index(drop=True)
+    candidates["x"] = rng.normal(size=len(candidates))
+    events = events.iloc[:-1].sample(frac=1, random_state=1)
+
+    events.to_parquet(get_cache_file("d", key="event"), index=False)
+    candidates.to_parquet(get_cache_file("d", key="b0"), index=False, row_group_size=1000)
+    expected = candidates.merge(events, on=EVENT_COLUMNS, how="left")
+    yield expected
+    DF_CACHE.clear()
+
+
+def test_event_columns_are_broadcast(normalized):
+    from misc.event_table import event_columns
+    from misc.utils import get_merged_df, iter_merged_df
+
+    assert event_columns("d") == ["thrust"]
+    assert normalized["thrust"].isna().sum() == (normalized["__event__"] == normalized["__event__"].max()).sum() > 0
+
+    got = get_merged_df("d", columns=["x", "thrust"], memoize=False)
+    pd.testing.assert_frame_equal(got, normalized[["x", "thrust"]])
+    # Cuts on event columns, and on candidate columns only
+    for where in ["thrust > 0.9", "x > 1"]:
+        expected = normalized.query(where)[["__event__", "thrust"]].reset_index(drop=True)
+        pd.testing.assert_frame_equal(get_merged_df("d", columns=["__event__", "thrust"], where=where,
+                                                    memoize=False), expected)
+        chunks = iter_merged_df("d", columns=["__event__", "thrust"], where=where, chunksize=777)
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), expected)
+    # Requests without event columns read the candidate tree alone
+    assert list(get_merged_df("d", columns=["x"], memoize=False).columns) == ["x"]
@@ -0,0 +1,69 @@
+"""Test for misc/friends.py"""
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def merged(tmp_path, monkeypatch):
+    """ A merged tree, already in the Parquet cache, with columns x and w """
+    import constants.locations
+    import misc.event_table
+    from misc.columnar import get_cache_file
+
+    monkeypatch.setattr(constants.locations, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(constants.locations, "MERGED_FILES", str(tmp_path / "merged"))
+    monkeypatch.setattr(misc.event_table, "_has_event_tree", lambda source, source_fingerprint: False)
+    (tmp_path / "merged").mkdir()
+    (tmp_path / "merged" / "d.root").write_text("merged")
+
+    rng = np.random.default_rng(9)
+    df = pd.DataFrame({"x": rng.normal(size=10000), "w": rng.uniform(0, 1, 10000)})
+    path = get_cache_file("d")
+    (tmp_path / "cache" / "d").mkdir(parents=True)
+    df.to_parquet(path, index=False, row_group_size=3000)
+    return df
+
+
+def test_latest_version_is_joined_in_order(merged):
+    from misc.friends import add_friend, friend_files, write_friend
+    from misc.utils import get_merged_df
+
+    write_friend("d", "y", pd.DataFrame({"y": merged["x"] + 1}))
+    add_friend("d", "y", lambda df: pd.DataFrame({"y": 2 * df["x"]}), inputs=["x"], version=2, chunksize=777)
+    add_friend("d", "z", lambda df: pd.DataFrame({"z": df["x"] - df["w"]}), inputs=["x", "w"], chunksize=4096)
+    assert friend_files("d")["y"].endswith("y.v2.parquet")
+
+    expected = merged.assign(y=2 * merged["x"], z=merged["x"] - merged["w"])
+    got = get_merged_df("d", columns=["w", "y", "z"], where="y > 0 && z < 0.5", memoize=False)
+    pd.testing.assert_frame_equal(got, expected.query("y > 0 and z < 0.5")[["w", "y", "z"]].reset_index(drop=True))
+    # Friend columns only
+    got = get_merged_df("d", columns=["z"], memoize=False)
+    pd.testing.assert_frame_equal(got, expected[["z"]])
+
+
+@pytest.mark.parametrize("chunksize", [1000, 2999, 4096, 20000])
+def test_chunks_join_the_right_friend_rows(merged, chunksize):
+    from misc.friends import write_friend_chunks
+    from misc.utils import iter_merged_df
+
+    friend = pd.DataFrame({"y": np.arange(len(merged), dtype=float)})
+    write_friend_chunks("d", "y", (friend.iloc[i:i + 1234] for i in range(0, len(friend), 1234)))
+
+    expected = merged.assign(y=friend["y"])
+    for columns, where in [(["x", "y"], None), (["y"], "y >= 5000"), (["w", "y"], "x > 1")]:
+        chunks = list(iter_merged_df("d", columns=columns, where=where, chunksize=chunksize))
+        assert all(len(chunk) <= chunksize for chunk in chunks)
+        selected = expected if where is None else expected.query(where)
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), selected[columns].reset_index(drop=True))
+
+
+def test_invalid_friends(merged):
+    from misc.friends import write_friend
+
+    with pytest.raises(ValueError, match="rows"):
+        write_friend("d", "short", pd.DataFrame({"y": np.zeros(len(merged) - 1)}))
+    with pytest.raises(ValueError, match="shadow"):
+        write_friend("d", "x", pd.DataFrame({"x": np.zeros(len(merged))}))
+    with pytest.raises(ValueError, match="start at 1"):
+        write_friend("d", "y", pd.DataFrame({"y": np.zeros(len(merged))}), version=0)
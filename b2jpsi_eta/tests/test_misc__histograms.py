@@ -0,0 +1,28 @@
+"""Test for misc/histograms.py"""
+import numpy as np
+import pandas as pd
+
+from misc.histograms import bin_counts, fill, load, save
+
+
+def test_bincount_histograms_match_numpy(tmp_path):
+    rng = np.random.default_rng(6)
+    values = np.concatenate([rng.normal(5.25, 0.05, 100000), [4.9, 5.3, np.nan, np.inf]])
+    weights = rng.uniform(0.5, 2, len(values))
+    expected = np.histogram(values[np.isfinite(values)], bins=80, range=(4.9, 5.3),
+                            weights=weights[np.isfinite(values)])[0]
+    assert np.allclose(bin_counts(values, 4.9, 5.3, 80, weights=weights), expected)
+
+    df = pd.DataFrame({"Mbc": values, "isSignal": rng.integers(0, 2, len(values)), "w": weights})
+    chunks = [df.iloc[i:i + 30000] for i in range(0, len(df), 30000)]
+    histograms = fill(chunks, "Mbc", (4.9, 5.3), 80, weight="w")
+    path = str(tmp_path / "h.npz")
+    save(path, histograms)
+    loaded = load(path)
+
+    background = df[(df["isSignal"] != 1) & df["Mbc"].between(4.9, 5.3)]
+    assert np.allclose(loaded["background"].counts, np.histogram(background["Mbc"], bins=80, range=(4.9, 5.3),
+                                                                 weights=background["w"])[0])
+    assert loaded["background"].n == len(background)
+    assert np.isclose(loaded["background"].std, background["Mbc"].std())
+    assert np.isclose(loaded["signal"].total + loaded["background"].total, expected.sum())
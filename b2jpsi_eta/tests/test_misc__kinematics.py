@@ -0,0 +1,39 @@
+"""Test for misc/kinematics.py"""
+import numpy as np
+import pandas as pd
+
+from misc.kinematics import M_B0, M_ETA, M_JPSI, NOMINAL_BEAM, FourVector, recompute
+
+
+def _random_directions(rng, n):
+    directions = rng.normal(size=(3, n))
+    return directions / np.linalg.norm(directions, axis=0)
+
+
+def test_recompute_two_body_decays():
+    rng = np.random.default_rng(4)
+    n = 1000
+    beam = NOMINAL_BEAM
+    # B0 -> J/psi eta from B at the beam energy in the centre-of-mass frame, seen in the lab
+    p_star = np.sqrt((beam.sqrt_s / 2) ** 2 - M_B0 ** 2)
+    b_cms = FourVector(np.full(n, beam.sqrt_s / 2), *(p_star * _random_directions(rng, n)))
+    q = np.sqrt((M_B0 ** 2 - (M_JPSI + M_ETA) ** 2) * (M_B0 ** 2 - (M_JPSI - M_ETA) ** 2)) / (2 * M_B0)
+    direction = q * _random_directions(rng, n)
+    jpsi = FourVector(np.sqrt(q ** 2 + M_JPSI ** 2), *direction).boost(-b_cms.beta).boost(-beam.cms_beta)
+    eta = FourVector(np.sqrt(q ** 2 + M_ETA ** 2), *-direction).boost(-b_cms.beta).boost(-beam.cms_beta)
+
+    # J/psi measured with a 1% energy scale
+    measured = FourVector(1.01 * jpsi.e, 1.01 * jpsi.px, 1.01 * jpsi.py, 1.01 * jpsi.pz)
+    b = measured + eta
+    df = pd.DataFrame({"px": b.px, "py": b.py, "pz": b.pz, "E": b.e,
+                       "jpsi_px": measured.px, "jpsi_py": measured.py, "jpsi_pz": measured.pz, "jpsi_E": measured.e})
+
+    exact = recompute(pd.DataFrame({"px": (jpsi + eta).px, "py": (jpsi + eta).py, "pz": (jpsi + eta).pz,
+                                    "E": (jpsi + eta).e}))
+    assert np.allclose(exact["Mbc"], M_B0) and np.allclose(exact["deltaE"], 0, atol=1e-9)
+    assert np.allclose(exact["M"], M_B0)
+
+    shifted = recompute(df)
+    constrained = recompute(df, masses={"jpsi": M_JPSI}, suffix="_jpsi")
+    assert list(constrained.columns) == ["Mbc_jpsi", "deltaE_jpsi", "M_jpsi"]
+    assert np.abs(constrained["deltaE_jpsi"]).mean() < np.abs(shifted["deltaE"]).mean()
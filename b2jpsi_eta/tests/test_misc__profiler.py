@@ -0,0 +1,31 @@
+"""Test for misc/profiler.py"""
+import numpy as np
+import pandas as pd
+
+from misc.profiler import RELATIVE_ACCURACY, Profile, profile_chunks
+
+
+def test_merged_profiles_match_pandas(tmp_path):
+    rng = np.random.default_rng(5)
+    n = 50000
+    df = pd.DataFrame({"a": rng.normal(5, 2, n), "b": rng.exponential(1, n) - 0.3, "name": "x"})
+    df.loc[::100, "a"] = np.nan
+    df.loc[::1000, "b"] = np.inf
+
+    # Per-job profiles, merged after a round trip through the saved summaries
+    paths = []
+    for i, start in enumerate(range(0, n, 12345)):
+        paths.append(str(tmp_path / f"{i}.json"))
+        profile_chunks([df.iloc[start:start + 12345]]).save(paths[-1])
+    frame = sum(Profile.load(path) for path in paths).to_frame()
+
+    assert list(frame.index) == ["a", "b"]
+    assert frame.loc["a", "nan"] == 500 and frame.loc["b", "posinf"] == 50
+    for column in ["a", "b"]:
+        finite = df[column][np.isfinite(df[column])]
+        assert np.isclose(frame.loc[column, "mean"], finite.mean())
+        assert np.isclose(frame.loc[column, "std"], finite.std())
+        assert frame.loc[column, "min"] == finite.min() and frame.loc[column, "max"] == finite.max()
+        for q in [0.05, 0.5, 0.95]:
+            exact = np.quantile(finite, q, method="lower")
+            assert abs(frame.loc[column, f"q{100 * q:g}"] - exact) <= RELATIVE_ACCURACY * abs(exact) + 1e-12
@@ -0,0 +1,94 @@
+"""Test for misc/skims.py"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from misc.skims import Skim, derive, get_skim_file, iter_skim, read_skim
+
+
+def _write_cache(df):
+    from misc.columnar import get_cache_file
+
+    path = get_cache_file("d")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_parquet(path, index=False, row_group_size=3000)
+
+
+@pytest.fixture
+def merged(tmp_path, monkeypatch):
+    """ A merged tree, already in the Parquet cache, with columns x, w and n """
+    import constants.locations
+    import misc.event_table
+
+    monkeypatch.setattr(constants.locations, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(constants.locations, "MERGED_FILES", str(tmp_path / "merged"))
+    monkeypatch.setattr(misc.event_table, "_has_event_tree", lambda source, source_fingerprint: False)
+    (tmp_path / "merged").mkdir()
+    (tmp_path / "merged" / "d.root").write_text("merged")
+
+    rng = np.random.default_rng(3)
+    df = pd.DataFrame({"x": rng.normal(size=10000), "w": rng.uniform(0, 1, 10000),
+                       "n": rng.integers(0, 5, 10000).astype(np.int32)})
+    _write_cache(df)
+    return df
+
+
+def _skim_files(tmp_path):
+    return sorted(os.listdir(tmp_path / "cache" / "d" / "skims"))
+
+
+def test_read_and_iterate(merged):
+    skim = Skim("s", where="x > 0", columns=["x", "n"])
+    expected = merged.query("x > 0 and n > 1")[["n"]].reset_index(drop=True)
+    pd.testing.assert_frame_equal(read_skim("d", skim, where="n > 1", columns=["n"]), expected)
+    chunks = list(iter_skim("d", skim, where="n > 1", columns=["n"], chunksize=1000))
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), expected)
+
+
+def test_dropped_columns_are_named(merged):
+    skim = Skim("s", where="x > 0", columns=["x", "n"])
+    with pytest.raises(ValueError, match=r"Skim 's' doesn't keep columns \['w'\]"):
+        read_skim("d", skim, columns=["x", "w"])
+    with pytest.raises(ValueError, match=r"Skim 's' doesn't keep columns \['w'\]"):
+        next(iter_skim("d", skim, columns=["x"], where="w > 0.5"))
+
+
+def test_rebuilt_when_the_selection_changes(merged, tmp_path):
+    loose, tight = Skim("s", where="x > 0"), Skim("s", where="x > 1")
+    derive("d", loose)
+    path = derive("d", tight)
+    assert _skim_files(tmp_path) == [os.path.basename(path)]
+    pd.testing.assert_frame_equal(read_skim("d", tight), merged.query("x > 1").reset_index(drop=True))
+
+
+def test_rebuilt_when_the_source_changes(merged, tmp_path):
+    skim = Skim("s", where="x > 0")
+    old = derive("d", skim)
+
+    # A new merged file, converted to a new Parquet cache
+    (tmp_path / "merged" / "d.root").write_text("merged again")
+    changed = merged.assign(x=-merged["x"])
+    _write_cache(changed)
+
+    new = get_skim_file("d", skim)
+    assert new != old
+    assert derive("d", skim) == new
+    assert _skim_files(tmp_path) == [os.path.basename(new)]
+    pd.testing.assert_frame_equal(read_skim("d", skim), changed.query("x > 0").reset_index(drop=True))
+
+
+def test_stale_files_of_other_skims_are_kept(merged, tmp_path):
+    # "s" is a prefix of "s_b0", whose files also start with "s_b0_"
+    prefixed = derive("d", Skim("s_b0", where="x > 0"))
+    derive("d", Skim("s", where="x > 0"))
+    path = derive("d", Skim("s", where="x > 1"))
+    assert _skim_files(tmp_path) == sorted([os.path.basename(prefixed), os.path.basename(path)])
+
+
+def test_empty_skim_keeps_the_schema(merged):
+    df = read_skim("d", Skim("none", where="x > 100", columns=["x", "n"]))
+    assert df.empty
+    assert list(df.columns) == ["x", "n"]
+    assert df.dtypes.to_dict() == merged[["x", "n"]].dtypes.to_dict()
@@ -0,0 +1,52 @@
+"""Test for the per-job readers in misc/utils.py"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+DECAY = "jpsi2ee_eta2gammagamma"
+JOBS = [1, 2, 9, 10, 11, 100]
+
+
+def _read_job(path, key, where, columns):
+    """ Stands in for root_pandas: the "root" files are Parquet, and later jobs finish first """
+    df = pd.read_parquet(path, columns=columns)
+    time.sleep(0.05 / df["job"].iloc[0])
+    return df if where is None else df.query(where).reset_index(drop=True)
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch):
+    import constants.locations
+    import misc.utils
+
+    monkeypatch.setattr(constants.locations, "RECONSTRUCTED_FILES", str(tmp_path))
+    monkeypatch.setattr(misc.utils, "_read_root_file", _read_job)
+    for job in JOBS:
+        pd.DataFrame({"job": job, "x": np.arange(5.0) + 10 * job}).to_parquet(tmp_path / f"{DECAY}_{job}.root")
+    # Not job outputs of this mode
+    for name in [f"{DECAY}_1_friend.root", f"{DECAY}_x.root", "jpsi2mumu_eta2gammagamma_3.root"]:
+        (tmp_path / name).write_text("")
+    return tmp_path
+
+
+def test_files_in_job_order(jobs):
+    from misc.utils import get_reconstructed_files
+
+    paths = get_reconstructed_files(DECAY)
+    assert [os.path.basename(p) for p in paths] == [f"{DECAY}_{job}.root" for job in JOBS]
+
+
+@pytest.mark.parametrize("use_threads", [True, False])
+def test_concatenated_in_job_order(jobs, use_threads):
+    from misc.utils import get_reconstructed_df
+
+    df = get_reconstructed_df(DECAY, where="x % 2 == 0", max_workers=3, use_threads=use_threads)
+    expected = [x for job in JOBS for x in np.arange(5.0) + 10 * job if x % 2 == 0]
+    assert df["x"].tolist() == expected
+    assert df.index.equals(pd.RangeIndex(len(expected)))
+
+    with pytest.raises(FileNotFoundError):
+        get_reconstructed_df("jpsi2ee_eta23pi0")
@@ -0,0 +1,42 @@
+"""Test for misc/yield_scan.py"""
+import numpy as np
+
+from constants import branching_ratios as br
+from misc.yield_scan import sample_branching_ratios, scan_yields
+
+MODES = ["jpsi2ee_eta2gammagamma", "jpsi2mumu_eta2gammagamma", "jpsi2ee_eta23pi0"]
+EFFICIENCIES = {"jpsi2ee_eta2gammagamma": 0.2, "jpsi2mumu_eta2gammagamma": 0.3, "jpsi2ee_eta23pi0": 0.05}
+
+
+def test_scan_shapes_and_values():
+    n_bb = np.array([1e8, 5e8])
+    scan = scan_yields(n_bb=n_bb, modes=MODES, n_toys=20000, efficiencies=EFFICIENCIES, seed=1)
+    assert scan.yields.shape == (3, 2, 20000) and scan.central.shape == (3, 2)
+
+    central = 0.3 * 5e8 * br.b02jpsi_eta[0] * br.jpsi2mumu[0] * br.eta2gammagamma[0]
+    assert np.isclose(scan.central[1, 1], central)
+    # Yields scale with the sample size toy by toy, and modes sharing a branching ratio are correlated
+    assert np.allclose(scan.yields[:, 1], 5 * scan.yields[:, 0])
+    assert np.corrcoef(scan.yields[0, 0], scan.yields[1, 0])[0, 1] > 0.9
+
+    bands = scan.bands()
+    assert len(bands) == 6
+    assert list(bands["decay"]) == [m for m in MODES for _ in n_bb] and list(bands["num_bb"]) == list(n_bb) * 3
+    row = bands.iloc[3]
+    assert np.isclose(row["central"], central)
+    assert row["low"] < row["median"] < row["high"]
+    assert np.isclose(row["median"], central, rtol=0.01)
+    inside = (scan.yields[1, 1] >= row["low"]) & (scan.yields[1, 1] <= row["high"])
+    assert abs(inside.mean() - 0.6827) < 0.01
+
+    again = scan_yields(n_bb=n_bb, modes=MODES, n_toys=20000, efficiencies=EFFICIENCIES, seed=1)
+    assert np.array_equal(again.yields, scan.yields)
+
+
+def test_toys_are_truncated_at_zero(monkeypatch):
+    monkeypatch.setattr(br, "wide", (1.0, 2.0), raising=False)
+    toys = sample_branching_ratios(["wide", "jpsi2ee"], 10000, np.random.default_rng(2))
+    assert toys["wide"].shape == (10000,) and toys["wide"].min() == 0
+    # About P(N(1, 2) < 0) = 31% of toys land on zero
+    assert abs((toys["wide"] == 0).mean() - 0.3085) < 0.02
+    assert np.array_equal(toys["wide"], sample_branching_ratios(["wide"], 10000, np.random.default_rng(2))["wide"])
@@ -0,0 +1,37 @@
+"""Test for misc/zone_map.py"""
+import numpy as np
+import pytest
+
+from misc.zone_map import ZoneMap
+from selection.cuts import compile_cut
+
+
+@pytest.mark.parametrize("where", [
+    "isSignal && deltaE < 0.2 && deltaE > -0.2 && Mbc > 5.27 && Mbc < 5.285",
+    "isSignal!=1 && deltaE < -0.2 && deltaE > -5 && Mbc > 4.5",
+    "abs(deltaE) < 0.05 or Mbc > 5.29",
+])
+def test_pruning_keeps_every_passing_row(where):
+    rng = np.random.default_rng(1)
+    n = 50000
+    arrays = {
+        "Mbc": np.sort(rng.uniform(4.5, 5.3, n)),
+        "deltaE": rng.uniform(-1, 1, n),
+        "isSignal": rng.integers(0, 2, n).astype(float),
+    }
+    arrays["Mbc"][::11] = np.nan
+    cut = compile_cut(where)
+    zones = ZoneMap.from_arrays(arrays, zone_size=1000)
+
+    rows = zones.rows(cut.bounds())
+    passing = np.flatnonzero(cut(arrays))
+    assert np.isin(passing, rows).all()
+
+
+def test_save_and_load(tmp_path):
+    zones = ZoneMap.from_arrays({"Mbc": np.arange(10.0)}, zone_size=4)
+    zones.save(str(tmp_path / "zones.npz"))
+    loaded = ZoneMap.load(str(tmp_path / "zones.npz"))
+    np.testing.assert_array_equal(loaded.mins["Mbc"], [0, 4, 8])
+    np.testing.assert_array_equal(loaded.maxs["Mbc"], [3, 7, 9])
+    np.testing.assert_array_equal(loaded.candidates({"Mbc": (4.5, 5)}), [False, True, False])
@@ -0,0 +1,19 @@
+"""Test for my_reconstruction/retention.py"""
+import pytest
+
+from my_reconstruction.retention import retained_flag, retention_cut, retention_weight
+
+
+def test_retention_expressions():
+    assert retention_cut(0.1) == "isSignal == 1 or eventRandom < 0.1"
+    assert retained_flag(0.1) == "passesCut(eventRandom < 0.1)"
+    # Weight 1 for signal, 1 / fraction for background and for candidates without truth information
+    assert retention_weight(0.25) == "formula(1 + 3.0 * (1 - ifNANgiveX(isSignal, 0)))"
+    assert retention_weight(1) == "formula(1 + 0.0 * (1 - ifNANgiveX(isSignal, 0)))"
+
+
+@pytest.mark.parametrize("fraction", [0, -0.1, 1.5])
+def test_fraction_must_be_in_unit_interval(fraction):
+    for expression in [retention_cut, retention_weight, retained_flag]:
+        with pytest.raises(ValueError):
+            expression(fraction)
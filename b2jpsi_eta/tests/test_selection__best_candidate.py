@@ -0,0 +1,29 @@
+"""Test for selection/best_candidate.py"""
+import numpy as np
+import pandas as pd
+
+from selection.best_candidate import RankKey, iter_ranks, rank_frame
+
+
+def test_chunked_ranks_match_pandas():
+    rng = np.random.default_rng(2)
+    event = np.repeat(np.arange(5000), rng.integers(1, 6, 5000))
+    n = len(event)
+    df = pd.DataFrame({"__experiment__": 0, "__run__": 1, "__event__": event,
+                       "chiProb": rng.random(n), "deltaE": rng.normal(0, 0.1, n).round(2)})
+    df.loc[::7, "chiProb"] = np.nan
+    criteria = {"vtx": [RankKey("chiProb", "highest")],
+                "de": [RankKey("abs(deltaE)", "lowest"), RankKey("chiProb", "highest")]}
+
+    ranks = rank_frame(df, criteria)
+    chunks = [df.iloc[i:i + 999] for i in range(0, n, 999)]
+    assert pd.concat(list(iter_ranks(chunks, criteria)), ignore_index=True).equals(ranks)
+
+    # NaN last, ties in file order
+    expected = df.assign(c=df["chiProb"].fillna(-np.inf)).groupby("__event__")["c"].rank(ascending=False,
+                                                                                         method="first")
+    assert np.array_equal(ranks["vtx"], expected.astype(int))
+    ordered = df.assign(a=df["deltaE"].abs(), c=-df["chiProb"].fillna(-np.inf), row=np.arange(n))
+    ordered = ordered.sort_values(["__event__", "a", "c", "row"])
+    ordered["rank"] = ordered.groupby("__event__").cumcount() + 1
+    assert np.array_equal(ranks["de"], ordered.sort_values("row")["rank"])
@@ -0,0 +1,113 @@
+"""Test for selection/cut_flow.py"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from selection.cut_flow import CATEGORIES, configured_cuts, count_flow, pass_matrix, split_cut
+from selection.cuts import cut_variables
+
+CUTS = {"mbc": "Mbc > 5.2", "de": "abs(deltaE) < 0.1", "chi": "chiProb > 0.01"}
+
+
+def _candidates(n_events=3000, seed=5):
+    rng = np.random.default_rng(seed)
+    multiplicity = rng.integers(1, 5, n_events)
+    event = np.repeat(np.arange(n_events), multiplicity)
+    n = len(event)
+    return pd.DataFrame({"__experiment__": 0, "__run__": 1, "__event__": event,
+                         "Mbc": rng.uniform(5.0, 5.3, n), "deltaE": rng.uniform(-0.3, 0.3, n),
+                         "chiProb": rng.uniform(0, 0.1, n), "isSignal": rng.integers(0, 2, n).astype(float)})
+
+
+def test_split_cut():
+    assert split_cut("Mbc > 5.1 and Mbc < 5.4") == ["Mbc > 5.1", "Mbc < 5.4"]
+    assert split_cut("Mbc > 5.1 && [a < 1 || b < 1]") == ["Mbc > 5.1", "(a < 1 or b < 1)"]
+    assert split_cut("abs(deltaE) < 0.2") == ["abs(deltaE) < 0.2"]
+
+
+def test_pass_matrix():
+    df = _candidates(200)
+    matrix = pass_matrix(df, CUTS)
+    n_stages = 1 + 2 * len(CUTS)
+    assert matrix.shape == (len(df), 3 * n_stages)
+
+    passes = [df.eval(cut).to_numpy() for cut in ["Mbc > 5.2", "abs(deltaE) < 0.1", "chiProb > 0.01"]]
+    signal = df["isSignal"].to_numpy() == 1
+    for i in range(len(CUTS)):
+        sequential = np.logical_and.reduce(passes[:i + 1])
+        n_minus_1 = np.logical_and.reduce([p for j, p in enumerate(passes) if j != i])
+        assert np.array_equal(matrix[:, 1 + i], sequential)
+        assert np.array_equal(matrix[:, 1 + len(CUTS) + i], n_minus_1)
+        assert np.array_equal(matrix[:, n_stages + 1 + i], sequential & signal)
+        assert np.array_equal(matrix[:, 2 * n_stages + 1 + i], sequential & ~signal)
+    assert matrix[:, 0].all()
+
+
+def test_count_flow_across_chunks():
+    df = _candidates()
+    # Chunk boundaries fall inside events
+    chunks = [df.iloc[i:i + 997] for i in range(0, len(df), 997)]
+    flow = count_flow(chunks, CUTS).set_index(["kind", "step"])
+
+    signal = df["isSignal"].to_numpy() == 1
+    passes = [pass_matrix(df, {step: cut})[:, 1] for step, cut in CUTS.items()]
+    masks = {("none", "none"): np.ones(len(df), dtype=bool)}
+    for i, step in enumerate(CUTS):
+        masks[("sequential", step)] = np.logical_and.reduce(passes[:i + 1])
+        masks[("n-1", step)] = np.logical_and.reduce(passes[:i] + passes[i + 1:])
+
+    for index, mask in masks.items():
+        for category, selected in zip(CATEGORIES, [mask, mask & signal, mask & ~signal]):
+            assert flow.loc[index, f"candidates_{category}"] == selected.sum()
+            assert flow.loc[index, f"events_{category}"] == df.loc[selected, "__event__"].nunique()
+
+
+def test_count_flow_weights_prescaled_background():
+    df = _candidates()
+    df["retentionWeight"] = np.where(df["isSignal"] == 1, 1.0, 10.0)
+    chunks = [df.iloc[i:i + 997] for i in range(0, len(df), 997)]
+    flow = count_flow(chunks, CUTS).set_index(["kind", "step"])
+
+    mask = np.logical_and.reduce([pass_matrix(df, {step: cut})[:, 1] for step, cut in CUTS.items()])
+    signal = df["isSignal"].to_numpy() == 1
+    row = flow.loc[("sequential", "chi")]
+    assert row["candidates_sig"] == (mask & signal).sum()
+    assert row["candidates_bkg"] == pytest.approx(10 * (mask & ~signal).sum())
+    # An event passing through a signal candidate counts once, one passing through background only ten times
+    passing = df.loc[mask].groupby("__event__")["isSignal"].max()
+    assert row["events_all"] == pytest.approx((passing == 1).sum() + 10 * (passing == 0).sum())
+    assert row["events_bkg"] == pytest.approx(10 * df.loc[mask & ~signal, "__event__"].nunique())
+
+
+def test_configured_cuts_of_the_real_config(monkeypatch):
+    import os
+
+    import yaml
+
+    import constants.locations
+    from constants.mode_info import mode2latex
+
+    src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+    monkeypatch.setattr(constants.locations, "PROJECT_ROOT", src)
+    with open(os.path.join(src, "my_reconstruction", "config", "reco_config.yaml")) as f:
+        modes = yaml.safe_load(f).values()
+    particle_lists = [cut for mode in modes for lists in mode.get("particle_lists", {}).values()
+                      for named in lists for cut in named.values()]
+
+    for decay in mode2latex:
+        cuts = configured_cuts(decay)
+        assert cuts == {"b0": {"signal_box[0]": "Mbc > 5.27", "signal_box[1]": "Mbc < 5.285",
+                               "signal_box[2]": "deltaE > -0.2", "signal_box[3]": "deltaE < 0.2"}}
+        # Only columns template.py writes (vc.deltae_mbc), none of the cuts basf2 already applied
+        for step in cuts["b0"].values():
+            assert set(cut_variables(step)) <= {"Mbc", "deltaE"}
+            assert not any(step in split_cut(cut) for cut in particle_lists)
+
+
+def test_missing_columns_are_named(monkeypatch):
+    import misc.utils
+    from selection.cut_flow import cut_flow
+
+    monkeypatch.setattr(misc.utils, "merged_columns", lambda decay, key: ["__event__", "isSignal", "Mbc"])
+    with pytest.raises(ValueError, match=r"\['electronID', 'd0'\]"):
+        cut_flow("d", {"pid": "electronID > 0.5", "d0": "abs(d0) < 1", "mbc": "Mbc > 5.2"}, key="electron")
@@ -0,0 +1,67 @@
+"""Test for selection/cuts.py"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from selection.cuts import compile_cut, cut_variables, particle_cuts, where_mask
+
+
+@pytest.fixture()
+def tree():
+    rng = np.random.default_rng(42)
+    n = 1000
+    return pd.DataFrame({
+        "Mbc": rng.uniform(5.2, 5.3, n),
+        "deltaE": rng.uniform(-0.5, 0.5, n),
+        "isSignal": rng.integers(0, 2, n).astype(float),
+        "d0": rng.normal(0, 1, n),
+    })
+
+
+@pytest.mark.parametrize("cut,expected", [
+    ("isSignal && deltaE < 0.2 && deltaE > -0.2 && Mbc > 5.27 && Mbc < 5.285",
+     lambda t: (t.isSignal != 0) & (t.deltaE < 0.2) & (t.deltaE > -0.2) & (t.Mbc > 5.27) & (t.Mbc < 5.285)),
+    ("isSignal!=1 && deltaE < -0.2 && deltaE > -5 && Mbc > 4.5",
+     lambda t: (t.isSignal != 1) & (t.deltaE < -0.2) & (t.deltaE > -5) & (t.Mbc > 4.5)),
+    ("abs(d0) < 1 and abs(deltaE) < 0.1", lambda t: (t.d0.abs() < 1) & (t.deltaE.abs() < 0.1)),
+    ("[Mbc > 5.28] or [!isSignal]", lambda t: (t.Mbc > 5.28) | (t.isSignal == 0)),
+    ("5.27 < Mbc < 5.29", lambda t: (t.Mbc > 5.27) & (t.Mbc < 5.29)),
+    ("Mbc - 2 * deltaE > 5.3", lambda t: t.Mbc - 2 * t.deltaE > 5.3),
+])
+@pytest.mark.parametrize("backend", ["numpy", "numexpr"])
+def test_compiled_cut_matches_pandas(tree, cut, expected, backend):
+    if backend == "numexpr":
+        pytest.importorskip("numexpr")
+    mask = compile_cut(cut)(tree, backend=backend)
+    np.testing.assert_array_equal(mask, expected(tree).to_numpy())
+
+
+def test_cut_variables():
+    assert sorted(cut_variables("abs(d0) < 1 && isSignal")) == ["d0", "isSignal"]
+    assert cut_variables(None) == []
+
+
+def test_aliases(tree):
+    mask = compile_cut("electronID > 0", aliases={"electronID": "d0"})(tree)
+    np.testing.assert_array_equal(mask, (tree.d0 > 0).to_numpy())
+
+
+def test_dict_of_arrays(tree):
+    columns = {c: tree[c].to_numpy() for c in tree.columns}
+    np.testing.assert_array_equal(where_mask(columns, "Mbc > 5.25"), (tree.Mbc > 5.25).to_numpy())
+
+
+@pytest.mark.parametrize("cut", ["__import__('os')", "Mbc.real > 1", "sqrt(Mbc) > 1", "'a' == Mbc"])
+def test_rejects_non_cut_expressions(cut):
+    with pytest.raises(ValueError):
+        compile_cut(cut)
+
+
+def test_particle_cuts_compile():
+    import os
+    path = os.path.join(os.path.dirname(__file__), "..", "src", "my_reconstruction", "config", "cuts.yaml")
+    particles = particle_cuts(path)
+    assert "e+" in particles
+    for particle in particles.values():
+        for cut in particle.cuts["default"]:
+            assert cut.compile().variables
@@ -0,0 +1,61 @@
+"""Test for selection/optimise.py"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from selection.cuts import where_mask
+from selection.optimise import ScanVariable, fill, optimise
+
+
+@pytest.mark.parametrize("variable", [
+    ScanVariable("Mbc", ">", 5.2, 5.29, 90),
+    ScanVariable("abs(deltaE)", "<", 0, 0.5, 50),
+])
+def test_cumulative_counts_match_direct_cuts(variable):
+    rng = np.random.default_rng(4)
+    n = 50000
+    df = pd.DataFrame({
+        "isSignal": rng.integers(0, 2, n).astype(float),
+        "Mbc": rng.uniform(5.15, 5.3, n),
+        "deltaE": rng.uniform(-0.6, 0.6, n),
+        "chiProb": rng.uniform(0, 1, n),
+    })
+    df.loc[::37, "deltaE"] = np.nan
+    variables = [variable, ScanVariable("chiProb", ">", 0, 1, 10)]
+
+    signal, background = fill([df.iloc[i:i + 7000] for i in range(0, n, 7000)], variables,
+                              cuts={"chiProb": "chiProb > 0.3"}, weight=0.5)
+    size = variable.n_bins + 2
+    s, b = variable.passing(signal[0, :size]), variable.passing(background[0, :size])
+    for k in range(0, variable.n_bins + 1, 7):
+        passing = (df["chiProb"] > 0.3).to_numpy() & where_mask(df, variable.cut(variable.edges[k]))
+        assert s[k] == pytest.approx(0.5 * (passing & (df["isSignal"] == 1)).sum())
+        assert b[k] == pytest.approx(0.5 * (passing & (df["isSignal"] == 0)).sum())
+
+
+
+def _chunks(df, chunksize):
+    def iter_merged_df(decay, key, where, columns, chunksize):
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start + chunksize][columns]
+    return iter_merged_df
+
+
+@pytest.mark.parametrize("background_weight, best", [(None, 0.0), (100.0, 0.1)])
+def test_optimise_finds_the_known_optimum(monkeypatch, background_weight, best):
+    # 100 signal at chiProb 0.15 and 100 at 0.05, 10 background at 0.05: keeping everything is best
+    # (200 / sqrt(210) > 100 / sqrt(100)) unless each background candidate stands for 100 (200 / sqrt(1200))
+    df = pd.DataFrame({
+        "isSignal": np.repeat([1.0, 1.0, 0.0], [100, 100, 10]),
+        "chiProb": np.repeat([0.15, 0.05, 0.05], [100, 100, 10]),
+    })
+    if background_weight is not None:
+        df["retentionWeight"] = np.where(df["isSignal"] == 1, 1.0, background_weight)
+    monkeypatch.setattr("misc.utils.iter_merged_df", _chunks(df.sample(frac=1, random_state=1), 30))
+    monkeypatch.setattr("misc.utils.merged_columns", lambda decay, key: list(df.columns))
+
+    result = optimise("mode", [ScanVariable("chiProb", ">", 0, 1, 10)], fom="significance", weight=1.0)
+    assert result.thresholds["chiProb"] == pytest.approx(best)
+    summary = result.summary.iloc[0]
+    assert summary["s"] == pytest.approx(200 if best == 0 else 100)
+    assert summary["b"] == pytest.approx(10 if best == 0 else 0)
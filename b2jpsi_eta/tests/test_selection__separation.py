@@ -0,0 +1,50 @@
+"""Test for selection/separation.py"""
+import math
+
+import numpy as np
+import pandas as pd
+
+from selection.separation import fill, scores
+
+
+def _phi(x):
+    return 0.5 * (1 + math.erf(x / math.sqrt(2)))
+
+
+def test_scores_of_gaussians():
+    rng = np.random.default_rng(8)
+    n = 200000
+    # Signal ~ N(1, 1), background ~ N(0, 1); "lower" has the signal below instead, "bkg_only" is NaN for signal
+    x = np.concatenate([rng.normal(1, 1, n), rng.normal(0, 1, n)])
+    is_signal = np.concatenate([np.ones(n), np.zeros(n)])
+    df = pd.DataFrame({"x": x, "lower": -x, "bkg_only": np.where(is_signal == 1, np.nan, x), "isSignal": is_signal})
+    chunks = [df.iloc[i:i + 70000] for i in range(0, len(df), 70000)]
+    ranges = {"x": (-4.0, 5.0), "lower": (-5.0, 4.0), "bkg_only": (-4.0, 5.0)}
+    results = {c: scores(*h) for c, h in fill(chunks, ranges, n_bins=200).items()}
+
+    # AUC = P(x_s > x_b) = Phi(1 / sqrt(2)); KS = max |Phi(x - 1) - Phi(x)| = 2 Phi(1 / 2) - 1
+    grid = np.linspace(-10, 10, 200001)
+    p_s, p_b = np.exp(-(grid - 1) ** 2 / 2), np.exp(-grid ** 2 / 2)
+    p_s, p_b = p_s / p_s.sum(), p_b / p_b.sum()
+    separation = 0.5 * np.sum((p_s - p_b) ** 2 / (p_s + p_b))
+    assert abs(results["x"]["auc"] - _phi(1 / math.sqrt(2))) < 0.005
+    assert abs(results["x"]["ks"] - (2 * _phi(0.5) - 1)) < 0.01
+    assert abs(results["x"]["separation"] - separation) < 0.005
+    assert abs(results["lower"]["auc"] - (1 - _phi(1 / math.sqrt(2)))) < 0.005
+    assert np.isclose(results["lower"]["ks"], results["x"]["ks"])
+
+    assert all(np.isnan(v) for v in results["bkg_only"].values())
+
+
+def test_scores_of_identical_and_disjoint_histograms():
+    same = scores(np.array([1.0, 2, 3]), np.array([2.0, 4, 6]))
+    assert np.isclose(same["auc"], 0.5) and np.isclose(same["ks"], 0) and np.isclose(same["separation"], 0)
+    disjoint = scores(np.array([0.0, 0, 5]), np.array([5.0, 0, 0]))
+    assert np.isclose(disjoint["auc"], 1) and np.isclose(disjoint["ks"], 1) and np.isclose(disjoint["separation"], 1)
+
+
+def test_fill_weights_prescaled_background():
+    df = pd.DataFrame({"x": [0.5, 1.5, 1.5, 2.5], "isSignal": [1.0, 0, 0, 1], "retentionWeight": [1.0, 10, 10, 1]})
+    signal, background = fill([df.iloc[:2], df.iloc[2:]], {"x": (0.0, 3.0)}, n_bins=3)["x"]
+    assert np.array_equal(signal, [0, 1, 0, 1, 0])
+    assert np.array_equal(background, [0, 0, 20, 0, 0])
@@ -0,0 +1,52 @@
+"""Test for selection/signal_box.py"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from selection.optimise import FIGURES_OF_MERIT
+from selection.signal_box import box_content, fill, scan_boxes, summed_area
+
+
+def test_summed_area():
+    hist = np.arange(12.0).reshape(3, 4)
+    table = summed_area(hist)
+    for i0, i1, j0, j1 in itertools.product(range(4), range(4), range(5), range(5)):
+        if i1 >= i0 and j1 >= j0:
+            assert box_content(table, i0, i1, j0, j1) == hist[i0:i1, j0:j1].sum()
+
+
+def test_scan_boxes_matches_brute_force():
+    rng = np.random.default_rng(7)
+    mbc_edges, delta_e_edges = np.linspace(5.2, 5.3, 8), np.linspace(-0.3, 0.3, 7)
+    # Signal peaking in the middle of a flat background
+    df = pd.DataFrame({"Mbc": np.concatenate([rng.normal(5.28, 0.01, 500), rng.uniform(5.2, 5.3, 3000)]),
+                       "deltaE": np.concatenate([rng.normal(0, 0.05, 500), rng.uniform(-0.3, 0.3, 3000)]),
+                       "isSignal": np.concatenate([np.ones(500), np.zeros(3000)])})
+    signal, background = fill([df.iloc[:1000], df.iloc[1000:]], mbc_edges, delta_e_edges, weight=0.1)
+
+    for fom in ["punzi", "significance"]:
+        result = scan_boxes(signal, background, mbc_edges, delta_e_edges, fom=fom)
+
+        best, box = -np.inf, None
+        for i0, i1 in itertools.combinations(range(len(mbc_edges)), 2):
+            for j0, j1 in itertools.combinations(range(len(delta_e_edges)), 2):
+                s, b = signal[i0:i1, j0:j1].sum(), background[i0:i1, j0:j1].sum()
+                value = FIGURES_OF_MERIT[fom](s, b, signal.sum())
+                if value > best:
+                    best, box = value, (i0, i1, j0, j1)
+        i0, i1, j0, j1 = box
+        assert np.isclose(result.fom, best)
+        assert result.mbc == (mbc_edges[i0], mbc_edges[i1])
+        assert result.delta_e == (delta_e_edges[j0], delta_e_edges[j1])
+        assert np.isclose(result.s, signal[i0:i1, j0:j1].sum())
+        assert np.isclose(result.b, background[i0:i1, j0:j1].sum())
+        assert np.isclose(np.nanmax(result.mbc_landscape), best)
+        assert np.isclose(np.nanmax(result.delta_e_landscape), best)
+
+        # The cut string selects the candidates of the box
+        inside = df.query(result.where.replace("&&", "and"))
+        in_bins = ((df["Mbc"] > result.mbc[0]) & (df["Mbc"] < result.mbc[1])
+                   & (df["deltaE"] > result.delta_e[0]) & (df["deltaE"] < result.delta_e[1]))
+        assert len(inside) == in_bins.sum()
+        assert np.isclose(0.1 * (inside["isSignal"] == 1).sum(), result.s)